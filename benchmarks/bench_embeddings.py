@@ -0,0 +1,95 @@
+"""
+File: bench_embeddings.py
+Description: Compares loading and saving a persona's embeddings as the legacy
+embeddings.json against the memory-mapped float32 store, for synthetic stores
+of 1k and 10k ada-sized (1536-dim) embeddings. "add + save" is one new
+memory followed by a save, what every module task does.
+
+Usage:
+  python benchmarks/bench_embeddings.py [dim] [repeats]
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+
+import numpy as np
+
+from napthaville.persona.memory_structures.embedding_store import (
+    EMBEDDINGS_FILE,
+    EmbeddingStore,
+)
+
+SIZES = [1_000, 10_000]
+
+
+def time_call(fn, repeats):
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start_time) / repeats
+
+
+def folder_size(folder):
+    return sum(os.path.getsize(f"{folder}/{name}") for name in os.listdir(folder))
+
+
+def main(dim=1536, repeats=3):
+    print(f"dim: {dim}, repeats: {repeats}")
+    rng = np.random.default_rng(0)
+    for n in SIZES:
+        embeddings = {f"memory {i}": rng.normal(size=dim).tolist() for i in range(n)}
+        with tempfile.TemporaryDirectory() as root:
+            json_folder = f"{root}/json"
+            bin_folder = f"{root}/bin"
+            os.makedirs(json_folder)
+            with open(f"{json_folder}/embeddings.json", "w") as outfile:
+                json.dump(embeddings, outfile)
+            EmbeddingStore(embeddings).save(bin_folder)
+
+            def json_load():
+                return json.load(open(f"{json_folder}/embeddings.json"))
+
+            def json_add_save():
+                d = json_load()
+                d["new memory"] = rng.normal(size=dim).tolist()
+                with open(f"{json_folder}/embeddings.json", "w") as outfile:
+                    json.dump(d, outfile)
+
+            def bin_add_save():
+                store = EmbeddingStore.open(bin_folder)
+                store["new memory"] = rng.normal(size=dim)
+                store.save(bin_folder)
+
+            def bin_scan():
+                # Touches every row, as a retrieval does.
+                return EmbeddingStore.open(bin_folder).unit.sum()
+
+            json_size = os.path.getsize(f"{json_folder}/embeddings.json")
+            bin_size = folder_size(bin_folder)
+            results = [
+                ("json load", time_call(json_load, repeats)),
+                ("mmap open", time_call(lambda: EmbeddingStore.open(bin_folder), repeats)),
+                ("mmap open + scan", time_call(bin_scan, repeats)),
+                ("json add + save", time_call(json_add_save, repeats)),
+                ("mmap add + save", time_call(bin_add_save, repeats)),
+            ]
+            print(
+                f"{n:>6} embeddings: json {json_size / 1e6:6.1f} MB, "
+                f"binary {bin_size / 1e6:6.1f} MB "
+                f"({os.path.getsize(f'{bin_folder}/{EMBEDDINGS_FILE}') / 1e6:.1f} MB matrix)"
+            )
+            for name, elapsed in results:
+                print(f"{name:>22}: {elapsed * 1000:9.2f} ms")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and not sys.argv[1].isdigit():
+        print(__doc__)
+        sys.exit(1)
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 1536,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 3,
+    )
@@ -0,0 +1,124 @@
+"""
+File: bench_maze.py
+Description: Compares the load time and memory of the array-backed Maze
+against the nested list of tile dictionaries it replaced. The legacy grid is
+rebuilt here from the same matrix folder the way Maze.__init__ used to build
+it. Also times parsing the CSVs against loading the compiled artifact.
+
+Usage:
+  python benchmarks/bench_maze.py <maze_folder> [repeats]
+"""
+
+import sys
+import json
+import time
+import tracemalloc
+
+from napthaville.maze import Maze
+from napthaville.compiled_maze import (
+    COMPILED_FILE,
+    CompiledMaze,
+    compile_maze,
+    source_hash,
+)
+from napthaville.global_methods import read_file_to_list
+
+
+def load_legacy_tiles(maze_folder):
+    meta_info = json.load(open(f"{maze_folder}/maze_meta_info.json"))
+    width = int(meta_info["maze_width"])
+    height = int(meta_info["maze_height"])
+
+    blocks_folder = f"{maze_folder}/special_blocks"
+    wb = read_file_to_list(f"{blocks_folder}/world_blocks.csv", header=False)[0][-1]
+    block_dicts = dict()
+    for level, name in [
+        ("sector", "sector_blocks"),
+        ("arena", "arena_blocks"),
+        ("game_object", "game_object_blocks"),
+        ("spawning_location", "spawning_location_blocks"),
+    ]:
+        rows = read_file_to_list(f"{blocks_folder}/{name}.csv", header=False)
+        block_dicts[level] = {row[0]: row[-1] for row in rows}
+
+    raw = dict()
+    for level in ["collision", "sector", "arena", "game_object", "spawning_location"]:
+        flat = read_file_to_list(f"{maze_folder}/maze/{level}_maze.csv", header=False)[0]
+        raw[level] = [flat[i : i + width] for i in range(0, len(flat), width)]
+
+    tiles = []
+    for i in range(height):
+        row = []
+        for j in range(width):
+            tile_details = dict()
+            tile_details["world"] = wb
+            for level in ["sector", "arena", "game_object", "spawning_location"]:
+                tile_details[level] = block_dicts[level].get(raw[level][i][j], "")
+            tile_details["collision"] = raw["collision"][i][j] != "0"
+            tile_details["events"] = set()
+            row += [tile_details]
+        tiles += [row]
+    for i in range(height):
+        for j in range(width):
+            if tiles[i][j]["game_object"]:
+                object_name = ":".join(
+                    [tiles[i][j][level] for level in ["world", "sector", "arena", "game_object"]]
+                )
+                tiles[i][j]["events"].add((object_name, None, None, None))
+    return tiles
+
+
+def measure(loader, repeats):
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        loader()
+    elapsed = (time.perf_counter() - start_time) / repeats
+
+    tracemalloc.start()
+    result = loader()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return elapsed, current
+
+
+def main(maze_folder, repeats=3):
+    legacy_time, legacy_mem = measure(lambda: load_legacy_tiles(maze_folder), repeats)
+
+    def parse():
+        compiled = CompiledMaze.from_matrix(maze_folder)
+        return compiled, compiled.address_tiles
+
+    compile_maze(maze_folder)
+    path = f"{maze_folder}/{COMPILED_FILE}"
+    parse_time, parse_mem = measure(parse, repeats)
+    load_time, _ = measure(
+        lambda: CompiledMaze.load(path, source_hash(maze_folder)), repeats
+    )
+    # Every Maze after the first one in a process shares the static layers.
+    Maze("bench", maze_folder)
+    maze_time, _ = measure(lambda: Maze("bench", maze_folder), repeats)
+
+    maze = Maze("bench", maze_folder)
+    print(f"maze: {maze.maze_width}x{maze.maze_height}, repeats: {repeats}")
+    print(f"{'dict grid':>14}: {legacy_time * 1000:8.1f} ms, {legacy_mem / 1e6:7.2f} MB")
+    print(f"{'array layers':>14}: {parse_time * 1000:8.1f} ms, {parse_mem / 1e6:7.2f} MB")
+    print("(the array figures include address_tiles, which the dict grid omits)")
+    print(f"{'compiled load':>14}: {load_time * 1000:8.1f} ms")
+    print(f"{'warm Maze()':>14}: {maze_time * 1000:8.3f} ms")
+
+    legacy = load_legacy_tiles(maze_folder)
+    mismatched = sum(
+        1
+        for y, row in enumerate(legacy)
+        for x, tile in enumerate(row)
+        if tile != dict(maze.access_tile((x, y)))
+    )
+    print(f"tile mismatches: {mismatched}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    main(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 3)
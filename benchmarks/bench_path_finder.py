@@ -0,0 +1,107 @@
+"""
+File: bench_path_finder.py
+Description: Compares the wavefront path_finder_v2 against the BFS and A*
+engines on a full maze (e.g., the Ville matrix folder), and against the
+precomputed distance table when one has been built for the folder and the
+hierarchical planner.
+
+Usage:
+  python benchmarks/bench_path_finder.py <maze_folder> [num_pairs]
+"""
+
+import sys
+import time
+import random
+
+from napthaville.maze import Maze
+from napthaville.distance_table import get_distance_table
+from napthaville.hierarchical_path_finder import HierarchicalPathFinder
+from napthaville.path_finder import (
+    path_finder,
+    path_finder_v2,
+    path_finder_bfs,
+    path_finder_astar,
+    get_collision_grid,
+)
+
+
+COLLISION_BLOCK_ID = "32125"
+
+
+def _v2(maze, start, end, collision_block_char):
+    # path_finder_v2 works in (row, col) form.
+    return path_finder_v2(
+        maze, (start[1], start[0]), (end[1], end[0]), collision_block_char
+    )
+
+
+def time_engine(engine, maze, pairs):
+    start_time = time.perf_counter()
+    lengths = [len(engine(maze, s, e, COLLISION_BLOCK_ID)) for s, e in pairs]
+    return time.perf_counter() - start_time, lengths
+
+
+def main(maze_folder, num_pairs=50):
+    maze = Maze("bench", maze_folder)
+    collision_maze = maze.collision_maze
+
+    grid = get_collision_grid(collision_maze, COLLISION_BLOCK_ID)
+    walkable = [grid.tile(i) for i, w in enumerate(grid.walkable) if w]
+    rng = random.Random(0)
+    pairs = [(rng.choice(walkable), rng.choice(walkable)) for _ in range(num_pairs)]
+
+    print(f"maze: {maze.maze_width}x{maze.maze_height}, pairs: {num_pairs}")
+    results = {}
+    for name, engine in [
+        ("path_finder_v2", _v2),
+        ("path_finder_bfs", path_finder_bfs),
+        ("path_finder_astar", path_finder_astar),
+    ]:
+        elapsed, lengths = time_engine(engine, collision_maze, pairs)
+        results[name] = lengths
+        print(f"{name:>18}: {elapsed * 1000 / num_pairs:9.2f} ms/path")
+
+    mismatched = sum(
+        1 for a, b in zip(results["path_finder_bfs"], results["path_finder_astar"])
+        if a != b
+    )
+    print(f"bfs/astar length mismatches: {mismatched}")
+
+    build_time = time.perf_counter()
+    planner = HierarchicalPathFinder(maze, COLLISION_BLOCK_ID)
+    build_time = time.perf_counter() - build_time
+
+    def _hierarchical(maze, start, end, collision_block_char):
+        return planner.find_path(start, end)
+
+    elapsed, lengths = time_engine(_hierarchical, collision_maze, pairs)
+    print(
+        f"{'hierarchical':>18}: {elapsed * 1000 / num_pairs:9.2f} ms/path "
+        f"(graph built in {build_time * 1000:.0f} ms)"
+    )
+    extra = sum(lengths) - sum(results["path_finder_astar"])
+    print(f"hierarchical extra steps: {extra} over {sum(lengths)}")
+
+    distance_table = get_distance_table(maze, COLLISION_BLOCK_ID)
+    if distance_table is None:
+        print("no distance table (python -m napthaville.distance_table to build)")
+        return
+
+    def _table(maze, start, end, collision_block_char):
+        return path_finder(
+            maze, start, end, collision_block_char, distance_table=distance_table
+        )
+
+    elapsed, lengths = time_engine(_table, collision_maze, pairs)
+    print(f"{'distance_table':>18}: {elapsed * 1000 / num_pairs:9.2f} ms/path")
+    mismatched = sum(
+        1 for a, b in zip(results["path_finder_astar"], lengths) if a != b
+    )
+    print(f"astar/table length mismatches: {mismatched}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    main(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 50)
@@ -0,0 +1,221 @@
+"""
+File: bench_retrieve.py
+Description: Times new_retrieve on synthetic associative memories of 1k, 10k
+and 100k nodes against the per-node dictionary pipeline it replaced (rebuilt
+here from the extract_* helpers). The legacy pipeline keeps every embedding
+as a list of Python floats, so it is only run up to LEGACY_MAX nodes.
+get_embedding(s) is replaced with a deterministic random vector, so no API calls
+are made.
+
+Past ANN_EXACT_THRESHOLD nodes the IVF index is timed against exact search,
+with the recall of the 30 most relevant nodes for a few n_probe values. Those
+memories are drawn around a few hundred topics, as real embeddings cluster.
+
+Usage:
+  python benchmarks/bench_retrieve.py [dim] [repeats]
+"""
+
+import sys
+import json
+import time
+import types
+import tempfile
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import napthaville.persona.cognitive_modules.retrieve as retrieve
+from napthaville.persona.memory_structures.associative_memory import AssociativeMemory
+from napthaville.persona.memory_structures.ann_index import (
+    ANN_EXACT_THRESHOLD,
+    IVFIndex,
+)
+
+SIZES = [1_000, 10_000, 100_000]
+LEGACY_MAX = 10_000
+FOCAL_POINTS = ["How are you?", "Jane is swimming in the pond", "planning"]
+N_PROBES = [4, 16, 64]
+TOPICS = 300
+
+
+def fake_embedding(dim):
+    def get_embedding(text):
+        seed = sum(ord(c) * (i + 1) for i, c in enumerate(text))
+        return np.random.default_rng(seed).normal(size=dim).tolist()
+
+    return get_embedding
+
+
+def fake_embeddings(dim):
+    get_embedding = fake_embedding(dim)
+    return lambda texts: [get_embedding(text) for text in texts]
+
+
+def make_persona(n, dim, rng, clustered=False):
+    with tempfile.TemporaryDirectory() as folder:
+        json.dump({}, open(f"{folder}/nodes.json", "w"))
+        json.dump({}, open(f"{folder}/embeddings.json", "w"))
+        json.dump(
+            {"kw_strength_event": None, "kw_strength_thought": None},
+            open(f"{folder}/kw_strength.json", "w"),
+        )
+        a_mem = AssociativeMemory(folder)
+        # The store is opened lazily; open it while the folder exists.
+        a_mem.load_embeddings()
+
+    topics = rng.normal(size=(TOPICS, dim))
+    start = datetime(2023, 2, 13)
+    for i in range(n):
+        if clustered:
+            embedding = topics[rng.integers(TOPICS)] + 0.5 * rng.normal(size=dim)
+        else:
+            embedding = rng.normal(size=dim)
+        created = start + timedelta(seconds=int(rng.integers(0, 30 * 86400)))
+        add = a_mem.add_thought if i % 4 == 0 else a_mem.add_event
+        add(
+            created,
+            None,
+            "Isabella Rodriguez",
+            "is",
+            f"doing {i}",
+            f"Isabella Rodriguez is doing {i}",
+            {"isabella rodriguez"},
+            int(rng.integers(1, 10)),
+            (f"memory {i}", embedding.astype(np.float32)),
+            [],
+        )
+
+    scratch = types.SimpleNamespace(
+        recency_w=1,
+        relevance_w=1,
+        importance_w=1,
+        recency_decay=0.99,
+        curr_time=start + timedelta(days=31),
+    )
+    return types.SimpleNamespace(a_mem=a_mem, scratch=scratch)
+
+
+def legacy_retrieve(persona, focal_points, n_count=30):
+    retrieved = dict()
+    for focal_pt in focal_points:
+        nodes = [
+            [i.last_accessed, i]
+            for i in persona.a_mem.seq_event + persona.a_mem.seq_thought
+            if "idle" not in i.embedding_key
+        ]
+        nodes = sorted(nodes, key=lambda x: x[0])
+        nodes = [i for created, i in nodes]
+        recency_out = retrieve.normalize_dict_floats(
+            retrieve.extract_recency(persona, nodes), 0, 1
+        )
+        importance_out = retrieve.normalize_dict_floats(
+            retrieve.extract_importance(persona, nodes), 0, 1
+        )
+        relevance_out = retrieve.normalize_dict_floats(
+            retrieve.extract_relevance(persona, nodes, focal_pt), 0, 1
+        )
+        gw = [0.5, 3, 2]
+        master_out = dict()
+        for key in recency_out.keys():
+            master_out[key] = (
+                persona.scratch.recency_w * recency_out[key] * gw[0]
+                + persona.scratch.relevance_w * relevance_out[key] * gw[1]
+                + persona.scratch.importance_w * importance_out[key] * gw[2]
+            )
+        master_out = retrieve.top_highest_x_values(master_out, n_count)
+        master_nodes = [persona.a_mem.id_to_node[key] for key in master_out]
+        for n in master_nodes:
+            n.last_accessed = persona.scratch.curr_time
+        retrieved[focal_pt] = master_nodes
+    return retrieved
+
+
+def time_call(fn, repeats):
+    fn()
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        result = fn()
+    return (time.perf_counter() - start_time) / repeats, result
+
+
+def bench_ann(n, dim, repeats):
+    persona = make_persona(n, dim, np.random.default_rng(n), clustered=True)
+    a_mem = persona.a_mem
+    index = a_mem.ann_index
+    exact = IVFIndex(exact_threshold=float("inf"))
+    rng = np.random.default_rng(0)
+    topics = [a_mem.embeddings.unit[rng.integers(n)] for _ in range(20)]
+    queries = [t + 0.5 * rng.normal(size=dim) / np.sqrt(dim) for t in topics]
+
+    a_mem.ann_index = exact
+    exact_time, _ = time_call(
+        lambda: retrieve.new_retrieve(persona, FOCAL_POINTS), repeats
+    )
+    truth = np.argsort(-a_mem.embeddings.cosine(queries), axis=1)[:, :30]
+    print(f"{n:>8} nodes, clustered: exact new_retrieve {exact_time * 1000:9.2f} ms")
+
+    a_mem.ann_index = index
+    for n_probe in N_PROBES:
+        index.n_probe = n_probe
+        ann_time, _ = time_call(
+            lambda: retrieve.new_retrieve(persona, FOCAL_POINTS), repeats
+        )
+        found = [
+            rows[np.argsort(-sims)[:30]]
+            for rows, sims in index.search(a_mem.embeddings, queries)
+        ]
+        recall = np.mean([len(set(t) & set(f)) / 30 for t, f in zip(truth, found)])
+        print(
+            f"{'':>8} ivf ({len(index.centroids)} lists, n_probe {n_probe:>2}): "
+            f"{ann_time * 1000:9.2f} ms, relevance recall@30 {recall:.3f}"
+        )
+
+
+def main(dim=1536, repeats=5):
+    retrieve.get_embedding = fake_embedding(dim)
+    retrieve.get_embeddings = fake_embeddings(dim)
+    print(f"dim: {dim}, focal points: {len(FOCAL_POINTS)}, repeats: {repeats}")
+    for n in SIZES:
+        persona = make_persona(n, dim, np.random.default_rng(n))
+        persona.a_mem.ann_index = IVFIndex(exact_threshold=float("inf"))
+        new_time, _ = time_call(
+            lambda: retrieve.new_retrieve(persona, FOCAL_POINTS), repeats
+        )
+        line = f"{n:>8} nodes: vectorised {new_time * 1000:9.2f} ms"
+
+        if n <= LEGACY_MAX:
+            # The legacy pipeline on a fresh copy of the same memory, with the
+            # embeddings as the dictionary of lists it used to read.
+            legacy = make_persona(n, dim, np.random.default_rng(n))
+            legacy.a_mem.embeddings = legacy.a_mem.embeddings.to_dict()
+            old_time, _ = time_call(
+                lambda: legacy_retrieve(legacy, FOCAL_POINTS), repeats
+            )
+            line += f", legacy {old_time * 1000:9.2f} ms ({old_time / new_time:.0f}x)"
+
+            fresh = make_persona(n, dim, np.random.default_rng(n))
+            fresh_legacy = make_persona(n, dim, np.random.default_rng(n))
+            fresh_legacy.a_mem.embeddings = fresh_legacy.a_mem.embeddings.to_dict()
+            a = retrieve.new_retrieve(fresh, FOCAL_POINTS)
+            b = legacy_retrieve(fresh_legacy, FOCAL_POINTS)
+            same = all(
+                [x.node_id for x in a[f]] == [x.node_id for x in b[f]]
+                for f in FOCAL_POINTS
+            )
+            line += f", same result: {same}"
+        print(line)
+    del persona
+
+    for n in SIZES:
+        if n >= ANN_EXACT_THRESHOLD:
+            bench_ann(n, dim, repeats)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and not sys.argv[1].isdigit():
+        print(__doc__)
+        sys.exit(1)
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 1536,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 5,
+    )
@@ -0,0 +1,82 @@
+"""
+File: bench_storage.py
+Description: Times the put/get-by-hash round trip of the storage backends on
+the payloads the simulation exchanges every step: maze event patches and,
+for comparison, the full Maze.to_json dump. The local store is timed with and
+without zstd; IPFS is timed too when IPFS_GATEWAY_URL is set.
+
+Usage:
+  python benchmarks/bench_storage.py <maze_folder> [num_objects]
+"""
+
+import os
+import sys
+import time
+import json
+import random
+import tempfile
+
+from napthaville.maze import Maze
+from napthaville_module.storage import IPFSStorage, LocalStorage, zstandard
+
+
+def payloads(maze_folder, num_objects):
+    maze = Maze("bench", maze_folder)
+    maze.set_base("base")
+    rng = random.Random(0)
+    patches = []
+    for i in range(num_objects):
+        tile = (rng.randrange(maze.maze_width), rng.randrange(maze.maze_height))
+        maze.add_event_from_tile((f"persona {i}", "is", "idle", "idle"), tile)
+        patches.append(json.dumps(maze.to_patch_json()))
+    return patches, json.dumps(maze.to_json())
+
+
+def time_backend(name, storage, patches, full):
+    start_time = time.perf_counter()
+    hashes = [storage.add_str(patch) for patch in patches]
+    put = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    for ipfs_hash in hashes:
+        storage.cat(ipfs_hash)
+    get = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    storage.cat_many(storage.add_many(patches))
+    bulk = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    storage.cat(storage.add_str(full))
+    full_time = time.perf_counter() - start_time
+
+    n = len(patches)
+    print(
+        f"{name:>12}: put {put * 1000 / n:7.2f} ms, get {get * 1000 / n:7.2f} ms, "
+        f"bulk round trip {bulk * 1000 / n:7.2f} ms per patch; "
+        f"full maze round trip {full_time * 1000:8.1f} ms"
+    )
+
+
+def main(maze_folder, num_objects=100):
+    patches, full = payloads(maze_folder, num_objects)
+    print(
+        f"patches: {num_objects}, avg {sum(map(len, patches)) / num_objects:.0f} "
+        f"bytes; full maze json: {len(full) / 1e6:.2f} MB"
+    )
+    with tempfile.TemporaryDirectory() as root:
+        time_backend("local", LocalStorage(f"{root}/plain"), patches, full)
+        if zstandard is not None:
+            storage = LocalStorage(f"{root}/zstd", compression="zstd")
+            time_backend("local+zstd", storage, patches, full)
+    if os.getenv("IPFS_GATEWAY_URL"):
+        time_backend("ipfs", IPFSStorage(), patches, full)
+    else:
+        print("IPFS_GATEWAY_URL is not set; skipping IPFS")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    main(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 100)
@@ -0,0 +1,193 @@
+"""
+File: bench_wire.py
+Description: Times the encoding of a persona_step call, its params and its
+result, on both ends of the module: the old way (the scratch of every persona
+sent as a JSON string inside JSON params, and a JSON result), JSON without
+the nested strings, and the msgpack wire format of napthaville_module.schemas.
+The payloads are made up but shaped like the real ones: persona scratches
+with a day's schedule and a planned path, and the retrieved events and
+thoughts of a step.
+
+Usage:
+  python benchmarks/bench_wire.py [num_personas] [num_rounds]
+"""
+
+import sys
+import time
+import json
+import random
+from datetime import datetime, timedelta
+
+from napthaville.utils import DateTimeEncoder
+from napthaville_module.schemas import (
+    InputSchema,
+    WIRE_FORMATS,
+    decode_result,
+    encode_result,
+    pack_input,
+    parse_task_params,
+    unpack_input,
+)
+
+
+def scratch(rng, name, curr_time):
+    return {
+        "name": name,
+        "first_name": name.split()[0],
+        "last_name": name.split()[-1],
+        "age": rng.randrange(20, 70),
+        "innate": "friendly, outgoing, hospitable",
+        "learned": f"{name} is a cafe owner who loves to make people feel welcome",
+        "currently": f"{name} is planning a Valentine's Day party at the cafe",
+        "lifestyle": f"{name} goes to bed around 11pm and wakes up around 6am",
+        "living_area": "the Ville:Hobbs Cafe:main cafe area",
+        "curr_time": curr_time.isoformat(),
+        "curr_tile": (rng.randrange(140), rng.randrange(100)),
+        "daily_req": [f"wake up and complete the morning routine {i}" for i in range(6)],
+        "f_daily_schedule": [
+            [f"{name} is doing task {i} of the day", rng.randrange(5, 60)]
+            for i in range(40)
+        ],
+        "f_daily_schedule_hourly_org": [
+            [f"{name} is doing hour {i} of the day", 60] for i in range(24)
+        ],
+        "act_address": "the Ville:Hobbs Cafe:cafe:behind the cafe counter",
+        "act_start_time": curr_time.isoformat(),
+        "act_duration": 30,
+        "act_description": "serving customers at the counter",
+        "act_event": [name, "is", "serving customers"],
+        "chatting_with": None,
+        "chat": None,
+        "chatting_with_buffer": {},
+        "act_path_set": True,
+        "planned_path": [
+            (rng.randrange(140), rng.randrange(100)) for _ in range(rng.randrange(30))
+        ],
+    }
+
+
+def node(rng, node_id, curr_time):
+    created = curr_time - timedelta(minutes=rng.randrange(600))
+    return {
+        "node_id": f"node_{node_id}",
+        "node_count": node_id,
+        "type_count": node_id,
+        "node_type": rng.choice(["event", "thought"]),
+        "depth": rng.randrange(3),
+        "created": created.isoformat(),
+        "expiration": None,
+        "last_accessed": curr_time.isoformat(),
+        "subject": "Isabella Rodriguez",
+        "predicate": "is",
+        "object": "serving customers",
+        "description": f"Isabella Rodriguez is serving customers {node_id}",
+        "embedding_key": f"serving customers {node_id}",
+        "poignancy": rng.randrange(1, 10),
+        "keywords": ["Isabella Rodriguez", "serving customers"],
+        "filling": None,
+    }
+
+
+def payloads(num_personas):
+    rng = random.Random(0)
+    curr_time = datetime(2023, 2, 13, 9, 30)
+    names = [f"Persona{i} Surname{i}" for i in range(num_personas)]
+    personas = {name: scratch(rng, name, curr_time) for name in names}
+    params = {
+        "init_persona_name": names[0],
+        "sims_folder": "sims_0",
+        "curr_time": curr_time.strftime("%B %d, %Y, %H:%M:%S"),
+        "curr_tile": personas[names[0]]["curr_tile"],
+        "maze_ipfs_hash": "QmWrCkdJHVb5MfQuL1yXh6Wt2Dxp7ajJPDH7cRRdEuBvAK",
+        "personas": personas,
+        "personas_curr_tiles": {name: personas[name]["curr_tile"] for name in names},
+    }
+    retrieved = {
+        f"event {i}": {
+            "curr_event": node(rng, i, curr_time),
+            "events": [node(rng, i * 100 + j, curr_time) for j in range(10)],
+            "thoughts": [node(rng, i * 100 + 50 + j, curr_time) for j in range(10)],
+        }
+        for i in range(4)
+    }
+    result = {
+        "reaction_mode": None,
+        "focused_event": False,
+        "execution": (
+            (rng.randrange(140), rng.randrange(100)),
+            "☕️",
+            "serving customers @ the Ville:Hobbs Cafe:cafe",
+        ),
+        "maze_delta": {
+            "added": [[10, 20, [names[0], "is", "serving customers", "serving"]]],
+            "removed": [[11, 20, [names[0], "is", "idle", "idle"]]],
+        },
+        "retrieved": retrieved,
+        "new_day": False,
+        "curr_time": curr_time,
+    }
+    return params, result
+
+
+def legacy_round(params, result):
+    # Caller: the scratches as a JSON string, then the params as JSON.
+    inputs = json.dumps(
+        {
+            "task": "persona_step",
+            "task_params": {**params, "personas": json.dumps(params["personas"])},
+        }
+    )
+    # Module: decode the params, then the nested string.
+    task_params = json.loads(inputs)["task_params"]
+    task_params["personas"] = json.loads(task_params["personas"])
+    response = json.dumps(result, cls=DateTimeEncoder)
+    json.loads(response)
+    return len(inputs), len(response)
+
+
+def json_round(params, result):
+    inputs = json.dumps({"task": "persona_step", "task_params": params})
+    parse_task_params("persona_step", json.loads(inputs)["task_params"])
+    response = encode_result(result, "json")
+    decode_result(response)
+    return len(inputs), len(response)
+
+
+def msgpack_round(params, result):
+    inputs = pack_input(
+        InputSchema(task="persona_step", task_params=params, wire_format="msgpack")
+    )
+    parse_task_params("persona_step", unpack_input(inputs).task_params)
+    response = encode_result(result, "msgpack")
+    decode_result(response)
+    return len(inputs), len(response)
+
+
+def time_format(name, round_trip, params, result, num_rounds):
+    sizes = round_trip(params, result)
+    start_time = time.perf_counter()
+    for _ in range(num_rounds):
+        round_trip(params, result)
+    elapsed = time.perf_counter() - start_time
+    print(
+        f"{name:>8}: params {sizes[0] / 1e3:8.1f} kB, result {sizes[1] / 1e3:6.1f} kB, "
+        f"{elapsed * 1000 / num_rounds:7.2f} ms per call"
+    )
+
+
+def main(num_personas=25, num_rounds=200):
+    params, result = payloads(num_personas)
+    print(f"persona_step with {num_personas} personas, {num_rounds} rounds")
+    time_format("legacy", legacy_round, params, result, num_rounds)
+    time_format("json", json_round, params, result, num_rounds)
+    if "msgpack" in WIRE_FORMATS:
+        time_format("msgpack", msgpack_round, params, result, num_rounds)
+    else:
+        print("msgpack is not installed; skipping msgpack")
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 25,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 200,
+    )
@@ -13,9 +13,11 @@ load_dotenv(find_dotenv())
 from napthaville.maze import Maze
 from datetime import datetime, timedelta
 from typing import Dict, List, Any, Tuple, Optional
-from napthaville_module.run import run as module_run
+from napthaville_module.run import run as module_run, run_async as module_run_async
+from napthaville_module.schemas import WIRE_FORMATS, decode_result
 from napthaville_module.utils import (
-    upload_maze_json_to_ipfs,
+    upload_maze_to_ipfs,
+    retrieve_maze_from_ipfs,
     get_folder_from_ipfs,
     setup_logging,
     retrieve_json_from_ipfs,
@@ -36,6 +38,14 @@ BASE_SIMS_IPFS_HASH = "QmXhXrkrGMNukzFzRJMai2nKC2X181bFvZRDw27W2NyGH7"
 
 
 BASE_SIMS_FOLDER = f"{os.getenv('BASE_OUTPUT_DIR')}"
+# The format module results come back in, "json" or "msgpack" (which needs
+# the msgpack extra); see napthaville_module.schemas.
+WIRE_FORMAT = os.getenv("WIRE_FORMAT", "json")
+if WIRE_FORMAT not in WIRE_FORMATS:
+    raise ValueError(f"Wire format {WIRE_FORMAT} is not available: {WIRE_FORMATS}")
+# How many steps apart the worker's cache and rate limiter stats are logged,
+# at debug level.
+WORKER_STATS_EVERY = int(os.getenv("WORKER_STATS_EVERY", "10"))
 
 
 class SimulationManager:
@@ -49,7 +59,9 @@ class SimulationManager:
         else:
             self.maze_folder = f"{BASE_SIMS_FOLDER}/maze"
             if not os.path.exists(self.maze_folder):
-                get_folder_from_ipfs(BASE_MAZE_IPFS_HASH, self.maze_folder)
+                get_folder_from_ipfs(
+                    BASE_MAZE_IPFS_HASH, self.maze_folder, read_only=True
+                )
 
             self.maze_folder = f"{self.maze_folder}/{BASE_MAZE_IPFS_HASH}/matrix"
             self.maze = Maze(maze_name="napthaville", maze_folder=self.maze_folder)
@@ -94,8 +106,12 @@ class SimulationManager:
         }
 
         # Load the maze state using the IPFS hash
-        maze_json = retrieve_json_from_ipfs(self.maze_ipfs_hash)
-        self.maze = Maze.from_json(maze_json)
+        self.maze_folder = f"{BASE_SIMS_FOLDER}/maze/{BASE_MAZE_IPFS_HASH}/matrix"
+        if not os.path.exists(self.maze_folder):
+            get_folder_from_ipfs(
+                BASE_MAZE_IPFS_HASH, f"{BASE_SIMS_FOLDER}/maze", read_only=True
+            )
+        self.maze = retrieve_maze_from_ipfs(self.maze_ipfs_hash, self.maze_folder)
 
         logger.info("Simulation state loaded successfully from IPFS")
 
@@ -149,8 +165,7 @@ class SimulationManager:
     def init_personas(self, env: Dict):
         """Initialize the personas."""
         logger.info("Initializing personas")
-        maze_json = self.maze.to_json()
-        maze_ipfs_hash = upload_maze_json_to_ipfs(maze_json)
+        maze_ipfs_hash = upload_maze_to_ipfs(self.maze)
         logger.info(f"Maze uploaded to IPFS. Hash: {maze_ipfs_hash}")
 
         for persona in self.all_personas:
@@ -165,7 +180,7 @@ class SimulationManager:
                     "curr_tile": (env[persona]["x"], env[persona]["y"]),
                 },
             )
-            response = json.loads(module_run(input_schema))
+            response = decode_result(module_run(input_schema))
             self.sims_folders[persona] = response["sims_folder"]
             self.persona_tiles[persona] = (env[persona]["x"], env[persona]["y"])
             self.maze_ipfs_hash = maze_ipfs_hash
@@ -185,89 +200,250 @@ class SimulationManager:
         return env
 
     def get_all_persona_scratch(self) -> Dict[str, Dict]:
-        """Get scratch data for all personas."""
+        """Get scratch data for all personas, in one batch."""
         logger.info("Fetching scratch data for all personas")
+        input_schema = InputSchema(
+            task="batch",
+            task_params={
+                "tasks": [
+                    {
+                        "task": "get_scratch",
+                        "task_params": {
+                            "persona_name": persona,
+                            "sims_folder": self.sims_folders[persona],
+                        },
+                    }
+                    for persona in self.all_personas
+                ]
+            },
+        )
+        results = decode_result(module_run(input_schema))["results"]
         persona_scratch = {}
-        for persona in self.all_personas:
-            logger.info(f"Fetching scratch data for persona: {persona}")
-            input_schema = InputSchema(
-                task="get_scratch",
-                task_params={
-                    "persona_name": persona,
-                    "sims_folder": self.sims_folders[persona],
-                },
-            )
-            response = json.loads(module_run(input_schema))
-            persona_scratch[persona] = response
-            logger.info(f"Scratch data fetched for persona: {persona}")
+        for persona, result in zip(self.all_personas, results):
+            if "error" in result:
+                raise RuntimeError(
+                    f"Fetching scratch data for {persona} failed: {result['error']}"
+                )
+            persona_scratch[persona] = result["result"]
         logger.info("All persona scratch data fetched")
         return persona_scratch
 
     async def get_all_person_moves_v2(
         self, personas_scratch: Dict[str, Dict]
     ) -> Dict[str, Dict]:
-        """Get all persona moves."""
+        """
+        Get all persona moves. The personas of a step run concurrently, all
+        against the maze as it was at the start of the step:
+        (1) every persona runs its whole step in one persona_step task,
+            except that one that chats stops once it picks the reaction;
+        (2) a persona that chats and the persona it chats with (and so on)
+            form one unit, run in persona order, since the chat changes both:
+            a persona that stopped before its chat chats, plans and executes,
+            and a persona chatted with earlier in the unit runs its step
+            again after the chat, so it moves as the chat has it. The units
+            run concurrently;
+        (3) once all are done, the maze changes of every persona are merged
+            in persona order.
+        As when the personas move one at a time, a persona chatted with that
+        comes before the one that chats keeps the step it had, and takes the
+        chat into its plans from the next step on.
+        """
         logger.info("Starting get_all_person_moves_v2")
-        moves = {}
+        step_maze_ipfs_hash = self.maze_ipfs_hash
+
+        steps = dict(
+            zip(
+                self.all_personas,
+                await asyncio.gather(
+                    *(
+                        self.get_persona_step(
+                            persona, personas_scratch, step_maze_ipfs_hash
+                        )
+                        for persona in self.all_personas
+                    )
+                ),
+            )
+        )
+
+        units = [
+            unit
+            for unit in self.get_step_units(steps)
+            if any(steps[persona]["execution"] is None for persona in unit)
+        ]
+        logger.info(f"Step units with chats: {units}")
+        unit_results = await asyncio.gather(
+            *(
+                self.run_step_unit(unit, steps, personas_scratch, step_maze_ipfs_hash)
+                for unit in units
+            )
+        )
+        results = {
+            persona: {**step, "maze_change": {"maze_delta": step["maze_delta"]}}
+            for persona, step in steps.items()
+        }
+        for unit_result in unit_results:
+            results.update(unit_result)
+
         for persona in self.all_personas:
-            logger.info(f"Processing moves for persona: {persona}")
+            reaction_mode = results[persona]["reaction_mode"]
+            if reaction_mode and reaction_mode[:9] == "chat with":
+                self.chat = True
+                self.chat_personas = [persona, reaction_mode[9:]]
 
-            # (1) get perceived and retrieved ; save the memory on persona
-            logger.info(f"Getting perceived and retrieved for {persona}")
-            input_schema = InputSchema(
-                task="get_perceived_retrieved",
+        moves = {
+            persona: results[persona]["execution"] for persona in self.all_personas
+        }
+        merge_response = await module_run_async(
+            InputSchema(
+                task="merge_maze_states",
                 task_params={
-                    "init_persona_name": persona,
-                    "sims_folder": self.sims_folders[persona],
-                    "curr_time": self.curr_time.strftime("%B %d, %Y, %H:%M:%S"),
-                    "maze_ipfs_hash": self.maze_ipfs_hash,
-                    "curr_tile": self.persona_tiles[persona],
+                    "maze_ipfs_hash": step_maze_ipfs_hash,
+                    "maze_changes": [
+                        results[persona]["maze_change"]
+                        for persona in self.all_personas
+                    ],
                 },
             )
-            retrieved_response = module_run(input_schema)
-            retrieved_data = json.loads(retrieved_response)
-            logger.info(f"Retrieved data for {persona}: {retrieved_data}")
-            retrieved = retrieved_data["retrieved"]
-            new_day = retrieved_data["new_day"]
-            curr_time = retrieved_data["curr_time"]
-
-            # (2) get_reaction_mode
-            logger.info(f"Getting reaction mode for {persona}")
-            input_schema = InputSchema(
-                task="get_reaction_mode",
-                task_params={
-                    "retrieved": json.dumps(retrieved),
-                    "new_day": new_day,
-                    "curr_time": curr_time,
-                    "maze_ipfs_hash": self.maze_ipfs_hash,
-                    "curr_tile": self.persona_tiles[persona],
-                    "sims_folder": self.sims_folders[persona],
-                    "personas": json.dumps(personas_scratch),
-                    "init_persona_name": persona,
-                },
-            )
-            reaction_mode_response = module_run(input_schema)
-            reaction_mode_data = json.loads(reaction_mode_response)
-            logger.info(f"Reaction mode data for {persona}: {reaction_mode_data}")
-            reaction_mode = reaction_mode_data["reaction_mode"]
-            focused_event = reaction_mode_data["focused_event"]
+        )
+        self.maze_ipfs_hash = decode_result(merge_response)["maze_ipfs_hash"]
+
+        logger.info("Completed get_all_person_moves_v2")
+        return moves
+
+    async def get_persona_step(
+        self, persona: str, personas_scratch: Dict[str, Dict], maze_ipfs_hash: str
+    ) -> Dict[str, Any]:
+        """
+        Run the step of a persona, up to its chat if it has one. No
+        sims_folders are passed, as the other personas step at the same
+        time; the chat goes through the fine-grained tasks in run_step_unit.
+        """
+        logger.info(f"Running the step of {persona}")
+        input_schema = InputSchema(
+            task="persona_step",
+            task_params={
+                "init_persona_name": persona,
+                "sims_folder": self.sims_folders[persona],
+                "curr_time": self.curr_time.strftime("%B %d, %Y, %H:%M:%S"),
+                "curr_tile": self.persona_tiles[persona],
+                "maze_ipfs_hash": maze_ipfs_hash,
+                "personas": personas_scratch,
+                "personas_curr_tiles": self.persona_tiles,
+            },
+        )
+        step = decode_result(await module_run_async(input_schema))
+        logger.info(f"Step of {persona}: {step}")
+        return step
+
+    def get_step_units(self, reactions: Dict[str, Dict]) -> List[List[str]]:
+        """
+        Groups the personas that chat with each other this step. Units and
+        the personas in them are in persona order.
+        """
+        unit_of = {persona: persona for persona in self.all_personas}
+
+        def find(persona):
+            while unit_of[persona] != persona:
+                persona = unit_of[persona]
+            return persona
 
-            # if persona == "Richard Blythman": # this is to force chat for debug
-            #     reaction_mode = "chat with Mo Arshy"
+        for persona in self.all_personas:
+            reaction_mode = reactions[persona]["reaction_mode"]
+            if reaction_mode and reaction_mode[:9] == "chat with":
+                target_persona_name = reaction_mode[9:].strip()
+                if target_persona_name in unit_of:
+                    unit_of[find(target_persona_name)] = find(persona)
+
+        units = {}
+        for persona in self.all_personas:
+            units.setdefault(find(persona), []).append(persona)
+        return list(units.values())
+
+    async def get_persona_reaction_mode(
+        self,
+        persona: str,
+        retrieved_data: Dict[str, Any],
+        personas_scratch: Dict[str, Dict],
+        maze_ipfs_hash: str,
+    ) -> Dict[str, Any]:
+        # (2) get_reaction_mode
+        logger.info(f"Getting reaction mode for {persona}")
+        input_schema = InputSchema(
+            task="get_reaction_mode",
+            task_params={
+                "retrieved": retrieved_data["retrieved"],
+                "new_day": retrieved_data["new_day"],
+                "curr_time": retrieved_data["curr_time"],
+                "maze_ipfs_hash": maze_ipfs_hash,
+                "curr_tile": self.persona_tiles[persona],
+                "sims_folder": self.sims_folders[persona],
+                "personas": personas_scratch,
+                "init_persona_name": persona,
+            },
+        )
+        reaction_mode_response = await module_run_async(input_schema)
+        reaction_mode_data = decode_result(reaction_mode_response)
+        logger.info(f"Reaction mode data for {persona}: {reaction_mode_data}")
+
+        # if persona == "Richard Blythman": # this is to force chat for debug
+        #     reaction_mode = "chat with Mo Arshy"
+
+        # if persona == "Mo Arshy" and self.step == 1:
+        #     reaction_mode = "chat with Richard Blythman"
+
+        return {
+            **retrieved_data,
+            "reaction_mode": reaction_mode_data["reaction_mode"],
+            "focused_event": reaction_mode_data["focused_event"],
+        }
 
-            # if persona == "Mo Arshy" and self.step == 1:
-            #     reaction_mode = "chat with Richard Blythman"
+    async def run_step_unit(
+        self,
+        unit: List[str],
+        reactions: Dict[str, Dict],
+        personas_scratch: Dict[str, Dict],
+        maze_ipfs_hash: str,
+    ) -> Dict[str, Dict]:
+        """
+        Plan, reflect and execute the personas of a unit, in order. A
+        persona whose step finished in persona_step keeps it, unless a chat
+        earlier in the unit changed its plans.
+        """
+        results = {}
+        chatted = set()
+        for persona in unit:
+            reaction = reactions[persona]
+            if persona in chatted:
+                # A chat earlier in the unit changed this persona's plans, so
+                # it picks its reaction again, as it would have one persona
+                # at a time. One that finished its step runs it again.
+                if reaction["execution"] is None:
+                    reaction = await self.get_persona_reaction_mode(
+                        persona, reaction, personas_scratch, maze_ipfs_hash
+                    )
+                else:
+                    reaction = await self.get_persona_step(
+                        persona, personas_scratch, maze_ipfs_hash
+                    )
+            if reaction["execution"] is not None:
+                if persona in chatted:
+                    results[persona] = {
+                        **reaction,
+                        "maze_change": {"maze_delta": reaction["maze_delta"]},
+                    }
+                continue
+            reaction_mode = reaction["reaction_mode"]
 
             # (3) next step based on reaction_mode
-            if reaction_mode:
-                if reaction_mode[:9] == "chat with":
-                    logger.info(f"{persona} will chat with {reaction_mode[9:]}")
-                    self.chat = True
-                    self.chat_personas = [persona, reaction_mode[9:]]
-                    persona_plan = await self.chat_react_plan(persona, reaction_mode)
-                elif reaction_mode[:4] == "wait":
-                    logger.info(f"{persona} will wait {reaction_mode[5:]}")
-                    persona_plan = await self.wait_react_plan(persona, reaction_mode)
+            if reaction_mode and reaction_mode[:9] == "chat with":
+                logger.info(f"{persona} will chat with {reaction_mode[9:]}")
+                chatted.add(reaction_mode[9:].strip())
+                persona_plan = await self.chat_react_plan(
+                    persona, reaction_mode, maze_ipfs_hash
+                )
+            elif reaction_mode and reaction_mode[:4] == "wait":
+                logger.info(f"{persona} will wait {reaction_mode[5:]}")
+                persona_plan = await self.wait_react_plan(persona, reaction_mode)
             else:
                 logger.info(f"No reaction for {persona}")
                 persona_plan = await self.no_reaction_plan(persona)
@@ -283,27 +459,30 @@ class SimulationManager:
                     "sims_folder": self.sims_folders[persona],
                     "personas_curr_tiles": self.persona_tiles,
                     "plan": persona_plan,
-                    "maze_ipfs_hash": self.maze_ipfs_hash,
+                    "maze_ipfs_hash": maze_ipfs_hash,
                 },
             )
-            reflect_execute_response = module_run(input_schema)
-            reflect_execute_data = json.loads(reflect_execute_response)
+            reflect_execute_response = await module_run_async(input_schema)
+            reflect_execute_data = decode_result(reflect_execute_response)
             logger.info(
                 f"Reflect and execute response for {persona}: {reflect_execute_data}"
             )
-            moves[persona] = reflect_execute_data["execution"]
-            self.maze_ipfs_hash = reflect_execute_data["maze_ipfs_hash"]
-
-        logger.info("Completed get_all_person_moves_v2")
-        return moves
+            results[persona] = {
+                "reaction_mode": reaction_mode,
+                "execution": reflect_execute_data["execution"],
+                "maze_change": {
+                    "maze_ipfs_hash": reflect_execute_data["maze_ipfs_hash"]
+                },
+            }
+        return results
 
-    async def chat_react_plan(self, persona, reaction_mode):
+    async def chat_react_plan(self, persona, reaction_mode, maze_ipfs_hash):
         logger.info(f"Starting chat_react_plan for {persona}")
         target_persona_name = reaction_mode[9:].strip()
 
         # Get personal info for both personas
-        init_persona_info = json.loads(
-            module_run(
+        init_persona_info = decode_result(
+            await module_run_async(
                 InputSchema(
                     task="get_personal_info",
                     task_params={
@@ -313,8 +492,8 @@ class SimulationManager:
                 )
             )
         )
-        target_persona_info = json.loads(
-            module_run(
+        target_persona_info = decode_result(
+            await module_run_async(
                 InputSchema(
                     task="get_personal_info",
                     task_params={
@@ -328,8 +507,8 @@ class SimulationManager:
         # Simulate chat
         curr_chat = []
         for i in range(8):
-            init_utterance = json.loads(
-                module_run(
+            init_utterance = decode_result(
+                await module_run_async(
                     InputSchema(
                         task="get_utterence",
                         task_params={
@@ -339,14 +518,14 @@ class SimulationManager:
                             "target_persona_description": target_persona_info[
                                 "act_description"
                             ],
-                            "curr_chat": json.dumps(curr_chat),
+                            "curr_chat": curr_chat,
                         },
                     )
                 )
             )
 
-            target_utterance = json.loads(
-                module_run(
+            target_utterance = decode_result(
+                await module_run_async(
                     InputSchema(
                         task="get_utterence",
                         task_params={
@@ -356,7 +535,7 @@ class SimulationManager:
                             "target_persona_description": init_persona_info[
                                 "act_description"
                             ],
-                            "curr_chat": json.dumps(init_utterance["curr_chat"]),
+                            "curr_chat": init_utterance["curr_chat"],
                         },
                     )
                 )
@@ -368,8 +547,8 @@ class SimulationManager:
         all_utt = "\n".join([f"{row[0]}: {row[1]}" for row in curr_chat])
         convo_length = math.ceil(int(len(all_utt) / 8) / 30)
 
-        target_persona_scratch = json.loads(
-            module_run(
+        target_persona_scratch = decode_result(
+            await module_run_async(
                 InputSchema(
                     task="get_scratch",
                     task_params={
@@ -382,8 +561,8 @@ class SimulationManager:
 
         logger.info(f"Chat react plan for {persona}")
 
-        complete_plan_response = json.loads(
-            module_run(
+        complete_plan_response = decode_result(
+            await module_run_async(
                 InputSchema(
                     task="get_complete_plan_chat",
                     task_params={
@@ -391,7 +570,7 @@ class SimulationManager:
                         "init_persona_name": persona,
                         "sims_folder": self.sims_folders[persona],
                         "target_persona_scratch": target_persona_scratch,
-                        "maze_ipfs_hash": self.maze_ipfs_hash,
+                        "maze_ipfs_hash": maze_ipfs_hash,
                         "convo_length": convo_length,
                     },
                 )
@@ -402,8 +581,8 @@ class SimulationManager:
         target_persona_return = complete_plan_response["target_persona_return"]
 
         # make a call to the target persona to return the values
-        finalise_target_persona = json.loads(
-            module_run(
+        finalise_target_persona = decode_result(
+            await module_run_async(
                 InputSchema(
                     task="finalise_target_persona_chat",
                     task_params={
@@ -420,8 +599,8 @@ class SimulationManager:
 
     async def wait_react_plan(self, persona, reaction_mode):
         logger.info(f"Starting wait_react_plan for {persona}")
-        wait_react_response = json.loads(
-            module_run(
+        wait_react_response = decode_result(
+            await module_run_async(
                 InputSchema(
                     task="get_complete_plan_wait",
                     task_params={
@@ -437,8 +616,8 @@ class SimulationManager:
 
     async def no_reaction_plan(self, persona):
         logger.info(f"Starting no_reaction_plan for {persona}")
-        no_reaction_response = json.loads(
-            module_run(
+        no_reaction_response = decode_result(
+            await module_run_async(
                 InputSchema(
                     task="get_complete_plan_no_reaction",
                     task_params={
@@ -633,12 +812,19 @@ class SimulationManager:
                 self.maze.remove_event_from_tile(blank, new_tile)
 
         # Upload maze to IPFS
-        self.maze_ipfs_hash = upload_maze_json_to_ipfs(self.maze.to_json())
+        self.maze_ipfs_hash = upload_maze_to_ipfs(self.maze)
 
         # Get all movements
         movements = await self.get_all_person_moves_v2(self.personas_scratch)
         logger.info(f"Movements: {movements}")
 
+        # The worker keeps the personas in memory during the step; this is
+        # the one time they are written to disk.
+        flush_response = decode_result(
+            await module_run_async(InputSchema(task="flush_personas", task_params={}))
+        )
+        logger.info(f"Flushed {flush_response['flushed']} personas")
+
         self.personas_scratch = self.get_all_persona_scratch()
         self.update_environment(new_env, self.personas_scratch)
         self.save_movements(self.step, movements)
@@ -647,12 +833,21 @@ class SimulationManager:
         self.curr_time += timedelta(seconds=self.sec_per_step)
         self.save_environment(self.step, movements)
         self.save_state()
+        if logger.isEnabledFor(logging.DEBUG) and self.step % WORKER_STATS_EVERY == 0:
+            worker_stats = decode_result(
+                await module_run_async(
+                    InputSchema(task="get_worker_stats", task_params={})
+                )
+            )
+            for name, stats in worker_stats.items():
+                logger.debug(f"{name} after step {self.step}: {stats}")
         logger.info(f"Step {self.step} processing completed")
 
 
 class InputSchema(BaseModel):
     task: str
     task_params: Dict
+    wire_format: str = WIRE_FORMAT
 
 
 async def run(inputs, cfg: Dict = None):
@@ -0,0 +1,372 @@
+"""
+File: compiled_maze.py
+Description: The static part of a map -- its meta information, the integer
+coded world/sector/arena/game_object/spawning_location layers, the collision
+layer and the reverse address index. It is parsed from the Tiled CSV exports in
+a "matrix" folder once, written next to them as a single .npz artifact, and
+shared by every <Maze> instance of that folder in the process.
+
+Compile a folder ahead of time with:
+  python -m napthaville.compiled_maze <maze_folder>
+"""
+
+import os
+import sys
+import json
+import hashlib
+import logging
+
+import numpy as np
+
+from napthaville.global_methods import read_file_to_list
+
+
+logger = logging.getLogger(__name__)
+
+
+COMPILED_FILE = "compiled_maze.npz"
+# Bump when the layout of the artifact changes.
+COMPILED_VERSION = 1
+LEVELS = ["world", "sector", "arena", "game_object", "spawning_location"]
+BLOCK_FILES = {
+    "world": "world_blocks.csv",
+    "sector": "sector_blocks.csv",
+    "arena": "arena_blocks.csv",
+    "game_object": "game_object_blocks.csv",
+    "spawning_location": "spawning_location_blocks.csv",
+}
+MAZE_FILES = {
+    "collision": "collision_maze.csv",
+    "sector": "sector_maze.csv",
+    "arena": "arena_maze.csv",
+    "game_object": "game_object_maze.csv",
+    "spawning_location": "spawning_location_maze.csv",
+}
+
+
+def source_hash(maze_folder):
+    """
+    Returns the content hash of every file a compiled maze is built from, so
+    that an edit to any of them invalidates the artifact.
+    """
+    sha = hashlib.sha256(str(COMPILED_VERSION).encode())
+    paths = ["maze_meta_info.json"]
+    paths += [f"special_blocks/{name}" for name in BLOCK_FILES.values()]
+    paths += [f"maze/{name}" for name in MAZE_FILES.values()]
+    for path in paths:
+        sha.update(b"\0" + path.encode() + b"\0")
+        with open(f"{maze_folder}/{path}", "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha.update(chunk)
+    return sha.hexdigest()
+
+
+class CompiledMaze:
+    def __init__(self, meta_info, layers, layer_names, collision_raw):
+        # <meta_info> is the content of maze_meta_info.json.
+        self.meta_info = meta_info
+        self.maze_width = int(meta_info["maze_width"])
+        self.maze_height = int(meta_info["maze_height"])
+        # <layers> maps each level to a height x width int32 layer of codes
+        # into <layer_names[level]>, where code 0 is the empty string.
+        # <collision_raw> keeps the raw Tiled values of the collision layer.
+        # All of them are shared between <Maze> instances, so they are made
+        # read-only.
+        self.layers = layers
+        self.layer_names = layer_names
+        self.collision_raw = collision_raw
+        self.collision = collision_raw != "0"
+        for array in list(layers.values()) + [collision_raw, self.collision]:
+            array.flags.writeable = False
+
+        self._collision_maze = None
+        self._address_tiles = None
+        self._default_events = None
+
+    @classmethod
+    def from_matrix(cls, maze_folder):
+        """
+        Parses the Tiled CSV exports of a "matrix" folder.
+
+        INPUT:
+          maze_folder: The maze "matrix" folder.
+        OUTPUT:
+          The <CompiledMaze>.
+        """
+        # Reading in the meta information about the world. If you want tp see
+        # the example variables, check out the maze_meta_info.json file.
+        meta_info = json.load(open(f"{maze_folder}/maze_meta_info.json"))
+        width = int(meta_info["maze_width"])
+        height = int(meta_info["maze_height"])
+
+        # READING IN SPECIAL BLOCKS
+        # Special blocks are those that are colored in the Tiled map.
+
+        # Here is an example row for the arena block file:
+        # e.g., "25335, Double Studio, Studio, Common Room"
+        # And here is another example row for the game object block file:
+        # e.g, "25331, Double Studio, Studio, Bedroom 2, Painting"
+
+        # Notice that the first element here is the color marker digit from the
+        # Tiled export. Then we basically have the block path:
+        # World, Sector, Arena, Game Object -- again, these paths need to be
+        # unique within an instance of Reverie.
+        blocks_folder = f"{maze_folder}/special_blocks"
+        block_dicts = dict()
+        for level in LEVELS[1:]:
+            name = BLOCK_FILES[level]
+            rows = read_file_to_list(f"{blocks_folder}/{name}", header=False)
+            block_dicts[level] = {row[0]: row[-1] for row in rows}
+        wb = read_file_to_list(
+            f"{blocks_folder}/{BLOCK_FILES['world']}", header=False
+        )[0][-1]
+
+        # Reading in the matrices. The mazes are taken directly from the json
+        # exports of Tiled maps. They should be in csv format.
+        # Importantly, they are "not" in a 2-d matrix format -- they are single
+        # row matrices with the length of width x height of the maze. So we
+        # reshape them here into height x width layers.
+        # example format: ['0', '0', ... '25309', '0',...]
+        # 25309 is the collision bar number right now.
+        shape = (height, width)
+        size = width * height
+        raw = dict()
+        for level, name in MAZE_FILES.items():
+            raw[level] = read_file_to_list(
+                f"{maze_folder}/maze/{name}", header=False
+            )[0][:size]
+
+        layers = {"world": np.ones(shape, dtype=np.int32)}
+        layer_names = {"world": ["", wb]}
+        for level in LEVELS[1:]:
+            layer, names = _encode_layer(raw[level], block_dicts[level])
+            layers[level] = layer.reshape(shape)
+            layer_names[level] = names
+        collision_raw = np.asarray(raw["collision"]).reshape(shape)
+        return cls(meta_info, layers, layer_names, collision_raw)
+
+    def tile_path(self, tile, level):
+        """
+        Returns the string address of <tile> up to <level>, in the same form
+        as Maze.get_tile_path.
+        """
+        x, y = tile
+        path = []
+        for curr_level in LEVELS[:4]:
+            path += [self.layer_names[curr_level][self.layers[curr_level][y, x]]]
+            if curr_level == level:
+                break
+        return ":".join(path)
+
+    @property
+    def collision_maze(self):
+        """
+        The raw collision layer as a list of rows of strings, which is the
+        form the path finders take. It is built once per process, so that
+        path finding caches keyed on it stay warm across <Maze> instances.
+        """
+        if self._collision_maze is None:
+            self._collision_maze = self.collision_raw.tolist()
+        return self._collision_maze
+
+    @property
+    def default_events(self):
+        """
+        Each game object occupies an event in its tiles. Returns the default
+        event of every game object tile as {(x, y): event}.
+        """
+        if self._default_events is None:
+            self._default_events = dict()
+            for y, x in zip(*np.nonzero(self.layers["game_object"])):
+                x, y = int(x), int(y)
+                object_name = self.tile_path((x, y), "game_object")
+                self._default_events[(x, y)] = (object_name, None, None, None)
+        return self._default_events
+
+    @property
+    def address_tiles(self):
+        """
+        Reverse tile access: given a string address, the set of all tile
+        coordinates belonging to that address.
+        e.g., address_tiles['<spawn_loc>bedroom-2-a'] == {(58, 9)}
+        """
+        if self._address_tiles is None:
+            self._address_tiles = dict()
+            for add, flat in self._address_index():
+                self._address_tiles[add] = set(
+                    zip(
+                        (flat % self.maze_width).tolist(),
+                        (flat // self.maze_width).tolist(),
+                    )
+                )
+        return self._address_tiles
+
+    def _address_index(self):
+        """
+        Yields (address, flat tile indices) for every address of the map.
+        """
+        size = self.maze_width * self.maze_height
+        levels = LEVELS[:4]
+        # The codes of the levels so far are packed into one integer per tile
+        # so that each distinct address is found with one np.unique.
+        packed = np.zeros(size, dtype=np.int64)
+        for depth, level in enumerate(levels):
+            packed = packed * len(self.layer_names[level])
+            packed += self.layers[level].reshape(-1)
+            if depth == 0:
+                continue
+            # We only index a level for the tiles where that level is set.
+            keep = np.flatnonzero(self.layers[level].reshape(-1))
+            keys, inverse = np.unique(packed[keep], return_inverse=True)
+            order = np.argsort(inverse, kind="stable")
+            bounds = np.searchsorted(inverse[order], np.arange(len(keys) + 1))
+            for k in range(len(keys)):
+                flat = keep[order[bounds[k] : bounds[k + 1]]]
+                first = (int(flat[0] % self.maze_width), int(flat[0] // self.maze_width))
+                yield self.tile_path(first, level), flat
+        spawn = self.layers["spawning_location"].reshape(-1)
+        for code in np.unique(spawn[spawn > 0]):
+            add = f'<spawn_loc>{self.layer_names["spawning_location"][code]}'
+            yield add, np.flatnonzero(spawn == code)
+
+    def save(self, path, source_hash):
+        """
+        Writes the artifact. The address index is stored as one flat array of
+        tile indices plus offsets, so loading it needs no search.
+        """
+        addresses, chunks = [], []
+        for add, flat in self._address_index():
+            addresses.append(add)
+            chunks.append(flat.astype(np.int32))
+        offsets = np.cumsum([0] + [len(chunk) for chunk in chunks])
+        header = {
+            "version": COMPILED_VERSION,
+            "source_hash": source_hash,
+            "meta_info": self.meta_info,
+            "layer_names": self.layer_names,
+            "addresses": addresses,
+        }
+        # Writing to a temporary file first keeps concurrent readers from
+        # seeing a half-written artifact.
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                header=np.array(json.dumps(header)),
+                collision_raw=self.collision_raw,
+                address_tiles=np.concatenate(chunks or [np.zeros(0, np.int32)]),
+                address_offsets=offsets,
+                **{f"layer_{level}": self.layers[level] for level in LEVELS},
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, source_hash=None):
+        """
+        Loads an artifact written by <save>.
+
+        INPUT:
+          path: The .npz file.
+          source_hash: If given, the artifact must have been compiled from
+                       sources with this hash.
+        OUTPUT:
+          The <CompiledMaze>, or None if the artifact is stale.
+        """
+        with np.load(path) as data:
+            header = json.loads(str(data["header"]))
+            if header["version"] != COMPILED_VERSION:
+                return None
+            if source_hash and header["source_hash"] != source_hash:
+                return None
+            layers = {level: data[f"layer_{level}"] for level in LEVELS}
+            compiled = cls(
+                header["meta_info"], layers, header["layer_names"], data["collision_raw"]
+            )
+            tiles = data["address_tiles"]
+            offsets = data["address_offsets"]
+        width = compiled.maze_width
+        compiled._address_tiles = dict()
+        for k, add in enumerate(header["addresses"]):
+            flat = tiles[offsets[k] : offsets[k + 1]]
+            compiled._address_tiles[add] = set(
+                zip((flat % width).tolist(), (flat // width).tolist())
+            )
+        return compiled
+
+
+def compile_maze(maze_folder):
+    """
+    Parses a "matrix" folder and writes its artifact next to it.
+    """
+    compiled = CompiledMaze.from_matrix(maze_folder)
+    compiled.save(f"{maze_folder}/{COMPILED_FILE}", source_hash(maze_folder))
+    return compiled
+
+
+# <_compiled_mazes> holds one <CompiledMaze> per matrix folder, so every
+# <Maze> of the same folder shares its static layers.
+_compiled_mazes = dict()
+
+
+def get_compiled_maze(maze_folder):
+    """
+    Returns the <CompiledMaze> of a "matrix" folder. The first call in a
+    process loads the artifact (compiling it first if it is missing or
+    stale); later calls return the same instance.
+    """
+    if maze_folder in _compiled_mazes:
+        return _compiled_mazes[maze_folder]
+
+    path = f"{maze_folder}/{COMPILED_FILE}"
+    digest = source_hash(maze_folder)
+    compiled = None
+    if os.path.exists(path):
+        try:
+            compiled = CompiledMaze.load(path, digest)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Could not load compiled maze {path}: {e}")
+    if compiled is None:
+        compiled = CompiledMaze.from_matrix(maze_folder)
+        try:
+            compiled.save(path, digest)
+        except OSError as e:
+            # A read-only matrix folder still works, just without the artifact.
+            logger.warning(f"Could not write compiled maze {path}: {e}")
+    _compiled_mazes[maze_folder] = compiled
+    return compiled
+
+
+def _encode_layer(raw, blocks):
+    """
+    Turns a flat list of Tiled block ids into an integer layer of codes and
+    the list of names those codes stand for. Code 0 is the empty string, used
+    for block ids that are not in <blocks>.
+
+    INPUT:
+      raw: A flat list of block id strings, e.g., ['0', '25335', ...]
+      blocks: A dictionary from block id string to name.
+    OUTPUT:
+      (layer, names): a flat int32 array and the list of names.
+    """
+    names = [""]
+    name_codes = {"": 0}
+    block_codes = dict()
+    for block_id in set(raw):
+        name = blocks.get(block_id, "")
+        if name not in name_codes:
+            name_codes[name] = len(names)
+            names.append(name)
+        block_codes[block_id] = name_codes[name]
+    layer = np.fromiter(map(block_codes.__getitem__, raw), dtype=np.int32, count=len(raw))
+    return layer, names
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    compiled = compile_maze(sys.argv[1])
+    print(
+        f"Compiled {compiled.maze_width}x{compiled.maze_height} maze to "
+        f"{sys.argv[1]}/{COMPILED_FILE}"
+    )
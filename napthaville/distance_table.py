@@ -0,0 +1,315 @@
+"""
+File: distance_table.py
+Description: Precomputed all-pairs shortest path distances over the static
+collision layer of a maze. The table is built offline from the matrix folder,
+persisted next to it as a memory-mappable .npy file, and turns path finding
+into an O(path length) walk down the distance gradient.
+
+The table holds N x N uint16 distances for N walkable tiles, so it grows
+with the square of the map: the full Ville (about 14k walkable tiles) needs
+around 400 MB. Building is therefore opt-in above MAX_TILES walkable tiles;
+pass a larger max_tiles to build it anyway.
+
+Build it once per map with:
+  python -m napthaville.distance_table <maze_folder> [collision_block_char]
+      [max_tiles]
+"""
+
+import os
+import sys
+import json
+import hashlib
+import logging
+
+import numpy as np
+
+from napthaville.global_methods import read_file_to_list
+
+
+logger = logging.getLogger(__name__)
+
+
+# uint16 distances; this value marks a pair of tiles with no path between
+# them.
+UNREACHABLE = np.iinfo(np.uint16).max
+TABLE_FOLDER = "distance_table"
+# The default cap on walkable tiles for DistanceTable.build, about 128 MB of
+# distances.
+MAX_TILES = 8192
+
+
+def collision_hash(maze_folder, collision_block_char):
+    """
+    Returns the content hash that a distance table was built against. It
+    covers the raw collision_maze.csv bytes and the collision block value, so
+    any edit to the collision layer invalidates the table.
+    """
+    sha = hashlib.sha256()
+    with open(f"{maze_folder}/maze/collision_maze.csv", "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    sha.update(b"\0" + str(collision_block_char).encode())
+    return sha.hexdigest()
+
+
+class DistanceTable:
+    def __init__(self, distances, tile_index, width, height):
+        # <distances> is an N x N uint16 matrix over the walkable tiles, where
+        # distances[i][j] is the number of steps between tile i and tile j.
+        # <tile_index> maps a flat (y * width + x) tile index to its row in
+        # <distances>, or -1 for collision tiles.
+        self.distances = distances
+        self.tile_index = tile_index
+        self.width = width
+        self.height = height
+
+    @staticmethod
+    def _walkable(maze_folder, collision_block_char):
+        meta_info = json.load(open(f"{maze_folder}/maze_meta_info.json"))
+        width = int(meta_info["maze_width"])
+        height = int(meta_info["maze_height"])
+        collision_maze_raw = read_file_to_list(
+            f"{maze_folder}/maze/collision_maze.csv", header=False
+        )[0]
+        block = str(collision_block_char)
+        walkable = np.array([cell != block for cell in collision_maze_raw], dtype=bool)
+        return walkable[: width * height], width, height
+
+    @classmethod
+    def build(
+        cls, maze_folder, collision_block_char, batch_size=256, max_tiles=MAX_TILES
+    ):
+        """
+        Computes the table with a batched breadth-first search (one source per
+        row of the batch) and writes it under <maze_folder>/distance_table.
+
+        INPUT:
+          maze_folder: The maze "matrix" folder.
+          collision_block_char: The value that marks a collision tile.
+          batch_size: How many source tiles to expand at the same time.
+          max_tiles: Refuse to build a table over more walkable tiles than
+            this, since it takes 2 * N * N bytes on disk.
+        OUTPUT:
+          The <DistanceTable>, backed by the file that was just written.
+        """
+        walkable, width, height = cls._walkable(maze_folder, collision_block_char)
+        tiles = np.flatnonzero(walkable)
+        n = len(tiles)
+        if n >= UNREACHABLE:
+            raise ValueError(f"Too many walkable tiles for a uint16 table: {n}")
+        if n > max_tiles:
+            raise ValueError(
+                f"{n} walkable tiles need a {2 * n * n / 1e6:.0f} MB distance "
+                f"table, over the limit of {max_tiles} tiles; pass a larger "
+                f"max_tiles to build it anyway."
+            )
+        logger.info(f"Building a {2 * n * n / 1e6:.0f} MB distance table for {n} tiles")
+
+        tile_index = np.full(width * height, -1, dtype=np.int32)
+        tile_index[tiles] = np.arange(n, dtype=np.int32)
+
+        # The search runs on a 2D grid padded with a ring of collision tiles,
+        # so that expanding the frontier is four shifted slices per step.
+        open_grid = np.zeros((height + 2, width + 2), dtype=bool)
+        open_grid[1:-1, 1:-1] = walkable.reshape(height, width)
+        inner = (slice(None), slice(1, -1), slice(1, -1))
+
+        folder = f"{maze_folder}/{TABLE_FOLDER}"
+        os.makedirs(folder, exist_ok=True)
+        distances = np.lib.format.open_memmap(
+            f"{folder}/distances.npy", mode="w+", dtype=np.uint16, shape=(n, n)
+        )
+        for start in range(0, n, batch_size):
+            sources = tiles[start : start + batch_size]
+            b = len(sources)
+            frontier = np.zeros((b, height + 2, width + 2), dtype=bool)
+            frontier[np.arange(b), sources // width + 1, sources % width + 1] = True
+            visited = frontier.copy()
+            batch = np.full((b, height, width), UNREACHABLE, dtype=np.uint16)
+            batch[np.arange(b), sources // width, sources % width] = 0
+            step = 0
+            while True:
+                step += 1
+                reached = frontier[:, :-2, 1:-1] | frontier[:, 2:, 1:-1]
+                reached |= frontier[:, 1:-1, :-2]
+                reached |= frontier[:, 1:-1, 2:]
+                reached &= open_grid[1:-1, 1:-1]
+                reached &= ~visited[inner]
+                if not reached.any():
+                    break
+                batch[reached] = step
+                visited[inner] |= reached
+                frontier[inner] = reached
+            distances[start : start + b] = batch.reshape(b, -1)[:, tiles]
+        distances.flush()
+
+        np.save(f"{folder}/tile_index.npy", tile_index)
+        meta = {
+            "collision_hash": collision_hash(maze_folder, collision_block_char),
+            "collision_block_char": str(collision_block_char),
+            "width": width,
+            "height": height,
+            "num_tiles": n,
+        }
+        with open(f"{folder}/meta.json", "w") as outfile:
+            json.dump(meta, outfile)
+
+        return cls.load(maze_folder, collision_block_char)
+
+    @classmethod
+    def load(cls, maze_folder, collision_block_char):
+        """
+        Memory-maps a previously built table.
+
+        INPUT:
+          maze_folder: The maze "matrix" folder.
+          collision_block_char: The value that marks a collision tile.
+        OUTPUT:
+          The <DistanceTable>, or None if there is no table yet or if it was
+          built against a different collision layer.
+        """
+        folder = f"{maze_folder}/{TABLE_FOLDER}"
+        if not os.path.exists(f"{folder}/meta.json"):
+            return None
+        meta = json.load(open(f"{folder}/meta.json"))
+        if meta["collision_hash"] != collision_hash(maze_folder, collision_block_char):
+            logger.warning(f"Distance table in {folder} is stale; rebuild it.")
+            return None
+
+        distances = np.load(f"{folder}/distances.npy", mmap_mode="r")
+        tile_index = np.load(f"{folder}/tile_index.npy")
+        return cls(distances, tile_index, meta["width"], meta["height"])
+
+    def _row(self, tile):
+        x, y = int(tile[0]), int(tile[1])
+        if x < 0 or y < 0 or x >= self.width or y >= self.height:
+            return -1
+        return int(self.tile_index[y * self.width + x])
+
+    def distance(self, start, end):
+        """
+        Returns the number of steps from <start> to <end>, or None if either
+        tile is blocked or there is no path.
+        """
+        start_row, end_row = self._row(start), self._row(end)
+        if start_row < 0 or end_row < 0:
+            return None
+        dist = int(self.distances[end_row, start_row])
+        return None if dist == UNREACHABLE else dist
+
+    def path(self, start, end):
+        """
+        Walks from <start> to <end> by always stepping to a neighbor that is
+        one step closer to <end>.
+
+        INPUT:
+          start: The starting tile in (x, y) form.
+          end: The target tile in (x, y) form.
+        OUTPUT:
+          A list of (x, y) tiles from <start> to <end>, both included, or None
+          if <start> is not in the table (e.g., a persona standing on a
+          collision tile) so that the caller can fall back to a search. An
+          empty list if <end> cannot be reached.
+        """
+        start_row, end_row = self._row(start), self._row(end)
+        if start_row < 0:
+            return None
+        if end_row < 0:
+            return []
+        # Distances are symmetric, so the row of <end> holds the distance from
+        # every tile to <end> in one contiguous read.
+        to_end = self.distances[end_row]
+        remaining = int(to_end[start_row])
+        if remaining == UNREACHABLE:
+            return []
+
+        x, y = int(start[0]), int(start[1])
+        path = [(x, y)]
+        while remaining > 0:
+            for nx, ny in [(x, y - 1), (x - 1, y), (x, y + 1), (x + 1, y)]:
+                row = self._row((nx, ny))
+                if row >= 0 and int(to_end[row]) == remaining - 1:
+                    x, y = nx, ny
+                    break
+            path.append((x, y))
+            remaining -= 1
+        return path
+
+    def nearest(self, start, ends):
+        """
+        Picks the element of <ends> with the shortest distance from <start>
+        and returns it with its path, mirroring path_finder_nearest. Returns
+        None if <start> is not in the table.
+        """
+        start_row = self._row(start)
+        if start_row < 0:
+            return None
+        closest_end, closest_dist = None, UNREACHABLE
+        for end in ends:
+            end_row = self._row(end)
+            if end_row < 0:
+                continue
+            dist = int(self.distances[end_row, start_row])
+            if dist < closest_dist:
+                closest_end, closest_dist = end, dist
+        if closest_end is None:
+            return None, []
+        return closest_end, self.path(start, closest_end)
+
+
+# <_distance_tables> caches loaded tables so that the content hash is only
+# checked once per process. <_missing_tables> remembers the state of meta.json
+# for folders without a usable table, so that a table built later while the
+# process runs is picked up without hashing the collision layer on every call.
+_distance_tables = dict()
+_missing_tables = dict()
+
+
+def _meta_state(maze_folder):
+    try:
+        stat = os.stat(f"{maze_folder}/{TABLE_FOLDER}/meta.json")
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def get_distance_table(maze, collision_block_char):
+    """
+    Returns the precomputed <DistanceTable> for a <Maze> instance, or None if
+    the offline stage has not been run for its matrix folder.
+    """
+    maze_folder = getattr(maze, "maze_folder", None)
+    if not maze_folder:
+        return None
+    key = (maze_folder, str(collision_block_char))
+    if key in _distance_tables:
+        return _distance_tables[key]
+
+    state = _meta_state(maze_folder)
+    if key in _missing_tables and _missing_tables[key] == state:
+        return None
+    try:
+        table = DistanceTable.load(maze_folder, collision_block_char)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not load distance table for {maze_folder}: {e}")
+        table = None
+    if table is None:
+        _missing_tables[key] = state
+    else:
+        _missing_tables.pop(key, None)
+        _distance_tables[key] = table
+    return table
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    maze_folder = sys.argv[1]
+    collision_block_char = sys.argv[2] if len(sys.argv) > 2 else "32125"
+    max_tiles = int(sys.argv[3]) if len(sys.argv) > 3 else MAX_TILES
+    table = DistanceTable.build(maze_folder, collision_block_char, max_tiles=max_tiles)
+    print(
+        f"Built distance table for {table.distances.shape[0]} walkable tiles in "
+        f"{maze_folder}/{TABLE_FOLDER}"
+    )
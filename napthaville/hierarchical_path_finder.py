@@ -0,0 +1,290 @@
+"""
+File: hierarchical_path_finder.py
+Description: A hierarchical (HPA*-style) path planner for large maps. The
+walkable tiles are split into regions along arena boundaries (and, inside
+very large arenas, along a coarse grid of clusters). Adjacent regions are
+connected through entrance tiles, which form a small abstract graph. A path is
+planned over that graph first and then refined with cached searches that never
+leave a single region.
+"""
+
+import heapq
+from collections import OrderedDict, deque
+
+from napthaville.path_finder import get_collision_grid
+
+
+# Maps smaller than this (in tiles) are searched directly; the Ville is
+# 140 x 100 = 14,000 tiles.
+HIERARCHICAL_MIN_TILES = 40000
+
+
+class HierarchicalPathFinder:
+    def __init__(self, maze, collision_block_char, cluster_size=20):
+        """
+        Builds the abstract graph for a <Maze> instance.
+
+        INPUT:
+          maze: An instance of <Maze>.
+          collision_block_char: The value that marks a collision tile.
+          cluster_size: The side length (in tiles) of the grid that splits
+                        arenas (and areas without an arena) into regions.
+        """
+        self.grid = get_collision_grid(maze.collision_maze, collision_block_char)
+        grid = self.grid
+        width = grid.width
+
+        # <region> maps each walkable flat tile index to its region id. A
+        # region is a connected set of tiles in the same arena and cluster.
+        n = len(grid.walkable)
+        self.region = [-1] * n
+        region_key = [None] * n
+        for i in range(n):
+            if grid.walkable[i]:
+                x, y = i % width, i // width
+                region_key[i] = (
+                    maze.get_tile_path((x, y), "arena"),
+                    x // cluster_size,
+                    y // cluster_size,
+                )
+        num_regions = 0
+        for i in range(n):
+            if not grid.walkable[i] or self.region[i] >= 0:
+                continue
+            self.region[i] = num_regions
+            queue = deque([i])
+            while queue:
+                curr = queue.popleft()
+                for nxt in grid.neighbors(curr):
+                    if self.region[nxt] < 0 and region_key[nxt] == region_key[i]:
+                        self.region[nxt] = num_regions
+                        queue.append(nxt)
+            num_regions += 1
+
+        # Entrances. Every run of adjacent tile pairs along the border of two
+        # regions becomes one entrance, placed in the middle of the run.
+        borders = dict()
+        for i in range(n):
+            if not grid.walkable[i]:
+                continue
+            x, y = i % width, i // width
+            right, down = i + 1, i + width
+            if x < width - 1 and grid.walkable[right]:
+                if self.region[right] != self.region[i]:
+                    key = ("v", x, self.region[i], self.region[right])
+                    borders.setdefault(key, []).append((y, i, right))
+            if down < n and grid.walkable[down]:
+                if self.region[down] != self.region[i]:
+                    key = ("h", y, self.region[i], self.region[down])
+                    borders.setdefault(key, []).append((x, i, down))
+
+        # <entrances> maps a region id to its entrance tiles, and
+        # <inter_edges> maps an entrance tile to the entrance tiles right
+        # across the border (each one step away).
+        self.entrances = dict()
+        self.inter_edges = dict()
+        for pairs in borders.values():
+            pairs.sort()
+            run = [pairs[0]]
+            for pair in pairs[1:] + [None]:
+                if pair is not None and pair[0] == run[-1][0] + 1:
+                    run.append(pair)
+                    continue
+                _, a, b = run[len(run) // 2]
+                self.entrances.setdefault(self.region[a], set()).add(a)
+                self.entrances.setdefault(self.region[b], set()).add(b)
+                self.inter_edges.setdefault(a, set()).add(b)
+                self.inter_edges.setdefault(b, set()).add(a)
+                run = [pair]
+
+        # <intra_edges> is filled lazily, one entrance at a time: it maps an
+        # entrance tile to {other entrance in the region: path}.
+        self.intra_edges = dict()
+
+    def _region_search(self, source, targets):
+        """
+        BFS from <source> that never leaves its region. Returns a dictionary
+        mapping each reachable index in <targets> to the path (a list of flat
+        indices) from <source> to it.
+        """
+        grid = self.grid
+        region = self.region[source]
+        parents = {source: source}
+        queue = deque([source])
+        found = dict()
+        remaining = set(targets)
+        if source in remaining:
+            found[source] = [source]
+            remaining.discard(source)
+        while queue and remaining:
+            curr = queue.popleft()
+            for nxt in grid.neighbors(curr):
+                if nxt in parents or self.region[nxt] != region:
+                    continue
+                parents[nxt] = curr
+                queue.append(nxt)
+                if nxt in remaining:
+                    path = [nxt]
+                    while parents[path[-1]] != path[-1]:
+                        path.append(parents[path[-1]])
+                    path.reverse()
+                    found[nxt] = path
+                    remaining.discard(nxt)
+        return found
+
+    def _intra(self, entrance):
+        if entrance not in self.intra_edges:
+            others = self.entrances.get(self.region[entrance], set())
+            edges = self._region_search(entrance, others)
+            edges.pop(entrance, None)
+            self.intra_edges[entrance] = edges
+        return self.intra_edges[entrance]
+
+    def find_nearest(self, start, ends):
+        """
+        Plans a path to the closest reachable tile among <ends>. Paths are
+        optimal within a region and near-optimal across regions.
+
+        INPUT:
+          start: The starting tile in (x, y) form.
+          ends: An iterable of candidate target tiles in (x, y) form.
+        OUTPUT:
+          A (closest_end, path) tuple in the same form as
+          path_finder_nearest, or (None, []) if no target can be reached.
+        """
+        grid = self.grid
+        start_i = grid.index(start)
+        if start_i is None:
+            return None, []
+        goals = dict()
+        for end in ends:
+            end_i = grid.index(end)
+            if end_i is not None and (grid.walkable[end_i] or end_i == start_i):
+                goals.setdefault(end_i, end)
+        if not goals:
+            return None, []
+        if start_i in goals:
+            return goals[start_i], [grid.tile(start_i)]
+        if not grid.walkable[start_i]:
+            # A persona standing on a collision tile belongs to no region.
+            return None, []
+
+        # Targets in the start region are reached without leaving it.
+        start_region = self.region[start_i]
+        start_entrances = self.entrances.get(start_region, set())
+        local_goals = [g for g in goals if self.region[g] == start_region]
+        from_start = self._region_search(start_i, start_entrances | set(local_goals))
+        local_paths = [from_start[g] for g in local_goals if g in from_start]
+
+        # For the other targets, we connect each one to the entrances of its
+        # own region. <to_goal[entrance]> lists (goal, path to goal).
+        to_goal = dict()
+        for goal in goals:
+            if self.region[goal] == start_region:
+                continue
+            goal_entrances = self.entrances.get(self.region[goal], set())
+            for entrance, path in self._region_search(goal, goal_entrances).items():
+                path.reverse()
+                to_goal.setdefault(entrance, []).append((goal, path))
+
+        width = grid.width
+        goal_xys = [(g % width, g // width) for g in goals]
+
+        def heuristic(index):
+            x, y = index % width, index // width
+            return min(abs(x - gx) + abs(y - gy) for gx, gy in goal_xys)
+
+        # Abstract A*. Nodes are entrance tiles plus one node per target,
+        # encoded as -1 - index so that heap entries stay comparable.
+        # <parents> remembers the tile path that led to each node.
+        best = None
+        if local_paths:
+            best = min(local_paths, key=len)
+        best_cost = len(best) - 1 if best else float("inf")
+
+        costs = dict()
+        parents = dict()
+        frontier = []
+        for entrance in start_entrances:
+            if entrance in from_start:
+                cost = len(from_start[entrance]) - 1
+                costs[entrance] = cost
+                parents[entrance] = (None, from_start[entrance])
+                heapq.heappush(frontier, (cost + heuristic(entrance), cost, entrance))
+
+        found = None
+        while frontier:
+            f, cost, node = heapq.heappop(frontier)
+            if f >= best_cost:
+                break
+            if node < 0:
+                found = -1 - node
+                best_cost = cost
+                break
+            if cost > costs.get(node, float("inf")):
+                continue
+            for goal, path in to_goal.get(node, []):
+                goal_node = -1 - goal
+                goal_cost = cost + len(path) - 1
+                if goal_cost < costs.get(goal_node, float("inf")):
+                    costs[goal_node] = goal_cost
+                    parents[goal_node] = (node, path)
+                    heapq.heappush(frontier, (goal_cost, goal_cost, goal_node))
+            for nxt in self.inter_edges.get(node, ()):
+                if cost + 1 < costs.get(nxt, float("inf")):
+                    costs[nxt] = cost + 1
+                    parents[nxt] = (node, [node, nxt])
+                    heapq.heappush(frontier, (cost + 1 + heuristic(nxt), cost + 1, nxt))
+            for nxt, path in self._intra(node).items():
+                nxt_cost = cost + len(path) - 1
+                if nxt_cost < costs.get(nxt, float("inf")):
+                    costs[nxt] = nxt_cost
+                    parents[nxt] = (node, path)
+                    heapq.heappush(frontier, (nxt_cost + heuristic(nxt), nxt_cost, nxt))
+
+        if found is None:
+            if best is None:
+                return None, []
+            return goals[best[-1]], [grid.tile(i) for i in best]
+
+        # Refinement: stitch the stored segments back together.
+        segments = []
+        node = -1 - found
+        while node is not None:
+            prev, path = parents[node]
+            segments.append(path)
+            node = prev
+        segments.reverse()
+        path = list(segments[0])
+        for segment in segments[1:]:
+            path += segment[1:]
+        return goals[found], [grid.tile(i) for i in path]
+
+    def find_path(self, start, end):
+        """
+        Plans a path from <start> to <end>, in the same form as path_finder.
+        """
+        return self.find_nearest(start, [end])[1]
+
+
+_hierarchical_path_finders = OrderedDict()
+_HIERARCHICAL_CACHE_SIZE = 4
+
+
+def get_hierarchical_path_finder(maze, collision_block_char):
+    """
+    Returns the <HierarchicalPathFinder> for a <Maze> instance, building the
+    abstract graph only the first time its collision maze is seen.
+    """
+    key = (id(maze.collision_maze), str(collision_block_char))
+    if key in _hierarchical_path_finders:
+        cached_maze, planner = _hierarchical_path_finders[key]
+        if cached_maze is maze.collision_maze:
+            _hierarchical_path_finders.move_to_end(key)
+            return planner
+
+    planner = HierarchicalPathFinder(maze, collision_block_char)
+    _hierarchical_path_finders[key] = (maze.collision_maze, planner)
+    while len(_hierarchical_path_finders) > _HIERARCHICAL_CACHE_SIZE:
+        _hierarchical_path_finders.popitem(last=False)
+    return planner
@@ -8,7 +8,9 @@ world in a 2-dimensional matrix.
 
 import json
 import math
-from napthaville.global_methods import read_file_to_list
+from collections.abc import Mapping
+
+from napthaville.compiled_maze import get_compiled_maze
 
 
 # file_path = Path(__file__).resolve()
@@ -20,9 +22,37 @@ class Maze:
     def __init__(self, maze_name, maze_folder):
         # READING IN THE BASIC META INFORMATION ABOUT THE MAP
         self.maze_name = maze_name
-        # Reading in the meta information about the world. If you want tp see the
-        # example variables, check out the maze_meta_info.json file.
-        meta_info = json.load(open(f"{maze_folder}/maze_meta_info.json"))
+        # <maze_folder> is the "matrix" folder the map was loaded from. Offline
+        # artifacts such as the distance table are stored next to it.
+        self.maze_folder = maze_folder
+        # The static part of the map is parsed from the matrix folder once per
+        # process (and compiled to an artifact next to it), then shared by
+        # every Maze of that folder. See napthaville/compiled_maze.py.
+        self._attach(get_compiled_maze(maze_folder))
+
+        # <self.events> is a sparse dictionary from (x, y) to the set of all
+        # events taking place in that tile. Each game object occupies an event
+        # in the tile. We are setting up the default event value here.
+        # e.g., self.events[(58, 9)] ==
+        #         {('double studio:double studio:bedroom 2:bed',
+        #           None, None, None)}
+        self.events = {
+            tile: {event} for tile, event in self.compiled.default_events.items()
+        }
+
+        # <self.base_maze_ipfs_hash> is the stored maze state this maze was
+        # loaded from, and <self.base_events> are its events at that point.
+        # Event patches are computed against them. A maze that was not loaded
+        # from a stored state is patched against the default events.
+        self.base_maze_ipfs_hash = None
+        self.base_events = None
+
+    def _attach(self, compiled):
+        """
+        Points this maze at the static layers of a <CompiledMaze>.
+        """
+        self.compiled = compiled
+        meta_info = compiled.meta_info
         # <maze_width> and <maze_height> denote the number of tiles make up the
         # height and width of the map.
         self.maze_width = int(meta_info["maze_width"])
@@ -34,186 +64,97 @@ class Maze:
         # e.g., "planning to stay at home all day and never go out of her home"
         self.special_constraint = meta_info["special_constraint"]
 
-        # READING IN SPECIAL BLOCKS
-        # Special blocks are those that are colored in the Tiled map.
-
-        # Here is an example row for the arena block file:
-        # e.g., "25335, Double Studio, Studio, Common Room"
-        # And here is another example row for the game object block file:
-        # e.g, "25331, Double Studio, Studio, Bedroom 2, Painting"
-
-        # Notice that the first element here is the color marker digit from the
-        # Tiled export. Then we basically have the block path:
-        # World, Sector, Arena, Game Object -- again, these paths need to be
-        # unique within an instance of Reverie.
-        blocks_folder = f"{maze_folder}/special_blocks"
-
-        _wb = blocks_folder + "/world_blocks.csv"
-        wb_rows = read_file_to_list(_wb, header=False)
-        wb = wb_rows[0][-1]
-
-        _sb = blocks_folder + "/sector_blocks.csv"
-        sb_rows = read_file_to_list(_sb, header=False)
-        sb_dict = dict()
-        for i in sb_rows:
-            sb_dict[i[0]] = i[-1]
-
-        _ab = blocks_folder + "/arena_blocks.csv"
-        ab_rows = read_file_to_list(_ab, header=False)
-        ab_dict = dict()
-        for i in ab_rows:
-            ab_dict[i[0]] = i[-1]
-
-        _gob = blocks_folder + "/game_object_blocks.csv"
-        gob_rows = read_file_to_list(_gob, header=False)
-        gob_dict = dict()
-        for i in gob_rows:
-            gob_dict[i[0]] = i[-1]
-
-        _slb = blocks_folder + "/spawning_location_blocks.csv"
-        slb_rows = read_file_to_list(_slb, header=False)
-        slb_dict = dict()
-        for i in slb_rows:
-            slb_dict[i[0]] = i[-1]
-
-        # [SECTION 3] Reading in the matrices
-        # This is your typical two dimensional matrices. It's made up of 0s and
-        # the number that represents the color block from the blocks folder.
-        maze_folder = f"{maze_folder}/maze"
-
-        _cm = maze_folder + "/collision_maze.csv"
-        collision_maze_raw = read_file_to_list(_cm, header=False)[0]
-        _sm = maze_folder + "/sector_maze.csv"
-        sector_maze_raw = read_file_to_list(_sm, header=False)[0]
-        _am = maze_folder + "/arena_maze.csv"
-        arena_maze_raw = read_file_to_list(_am, header=False)[0]
-        _gom = maze_folder + "/game_object_maze.csv"
-        game_object_maze_raw = read_file_to_list(_gom, header=False)[0]
-        _slm = maze_folder + "/spawning_location_maze.csv"
-        spawning_location_maze_raw = read_file_to_list(_slm, header=False)[0]
-
-        # Loading the maze. The mazes are taken directly from the json exports of
-        # Tiled maps. They should be in csv format.
-        # Importantly, they are "not" in a 2-d matrix format -- they are single
-        # row matrices with the length of width x height of the maze. So we need
-        # to convert here.
-        # We can do this all at once since the dimension of all these matrices are
-        # identical (e.g., 70 x 40).
-        # example format: [['0', '0', ... '25309', '0',...], ['0',...]...]
-        # 25309 is the collision bar number right now.
-        self.collision_maze = []
-        sector_maze = []
-        arena_maze = []
-        game_object_maze = []
-        spawning_location_maze = []
-        for i in range(0, len(collision_maze_raw), meta_info["maze_width"]):
-            tw = meta_info["maze_width"]
-            self.collision_maze += [collision_maze_raw[i : i + tw]]
-            sector_maze += [sector_maze_raw[i : i + tw]]
-            arena_maze += [arena_maze_raw[i : i + tw]]
-            game_object_maze += [game_object_maze_raw[i : i + tw]]
-            spawning_location_maze += [spawning_location_maze_raw[i : i + tw]]
-
-        # Once we are done loading in the maze, we now set up self.tiles. This is
-        # a matrix accessed by row:col where each access point is a dictionary
-        # that contains all the things that are taking place in that tile.
-        # More specifically, it contains information about its "world," "sector,"
-        # "arena," "game_object," "spawning_location," as well as whether it is a
-        # collision block, and a set of all events taking place in it.
-        # e.g., self.tiles[32][59] = {'world': 'double studio',
-        #            'sector': '', 'arena': '', 'game_object': '',
-        #            'spawning_location': '', 'collision': False, 'events': set()}
+        # Rather than one dictionary per tile, the maze is stored as a
+        # structure of arrays. Each of the "world," "sector," "arena,"
+        # "game_object," and "spawning_location" levels is a height x width
+        # integer layer of codes into <self.layer_names[level]>, where code 0
+        # is the empty string. <self.collision> is a boolean layer.
+        # e.g., self.layer_names["arena"][self.layers["arena"][9][58]]
+        #         == 'bedroom 2'
+        self.layers = compiled.layers
+        self.layer_names = compiled.layer_names
+        self.collision = compiled.collision
+        self._collision_maze = None
+
+        # <self.tiles> keeps the old row:col access pattern working. Each
+        # access point is a read-only view of the layers for that tile, except
+        # for "events," which is the live event set of the tile.
         # e.g., self.tiles[9][58] = {'world': 'double studio',
         #         'sector': 'double studio', 'arena': 'bedroom 2',
         #         'game_object': 'bed', 'spawning_location': 'bedroom-2-a',
         #         'collision': False,
         #         'events': {('double studio:double studio:bedroom 2:bed',
         #                    None, None)}}
-        self.tiles = []
-        for i in range(self.maze_height):
-            row = []
-            for j in range(self.maze_width):
-                tile_details = dict()
-                tile_details["world"] = wb
-
-                tile_details["sector"] = ""
-                if sector_maze[i][j] in sb_dict:
-                    tile_details["sector"] = sb_dict[sector_maze[i][j]]
-
-                tile_details["arena"] = ""
-                if arena_maze[i][j] in ab_dict:
-                    tile_details["arena"] = ab_dict[arena_maze[i][j]]
-
-                tile_details["game_object"] = ""
-                if game_object_maze[i][j] in gob_dict:
-                    tile_details["game_object"] = gob_dict[game_object_maze[i][j]]
-
-                tile_details["spawning_location"] = ""
-                if spawning_location_maze[i][j] in slb_dict:
-                    tile_details["spawning_location"] = slb_dict[
-                        spawning_location_maze[i][j]
-                    ]
-
-                tile_details["collision"] = False
-                if self.collision_maze[i][j] != "0":
-                    tile_details["collision"] = True
-
-                tile_details["events"] = set()
-
-                row += [tile_details]
-            self.tiles += [row]
-        # Each game object occupies an event in the tile. We are setting up the
-        # default event value here.
-        for i in range(self.maze_height):
-            for j in range(self.maze_width):
-                if self.tiles[i][j]["game_object"]:
-                    object_name = ":".join(
-                        [
-                            self.tiles[i][j]["world"],
-                            self.tiles[i][j]["sector"],
-                            self.tiles[i][j]["arena"],
-                            self.tiles[i][j]["game_object"],
-                        ]
-                    )
-                    go_event = (object_name, None, None, None)
-                    self.tiles[i][j]["events"].add(go_event)
+        self.tiles = _TileGrid(self)
 
         # Reverse tile access.
         # <self.address_tiles> -- given a string address, we return a set of all
         # tile coordinates belonging to that address (this is opposite of
         # self.tiles that give you the string address given a coordinate). This is
         # an optimization component for finding paths for the personas' movement.
+        # It is shared with the other mazes of the folder and must not be
+        # modified.
         # self.address_tiles['<spawn_loc>bedroom-2-a'] == {(58, 9)}
         # self.address_tiles['double studio:recreation:pool table']
         #   == {(29, 14), (31, 11), (30, 14), (32, 11), ...},
-        self.address_tiles = dict()
-        for i in range(self.maze_height):
-            for j in range(self.maze_width):
-                addresses = []
-                if self.tiles[i][j]["sector"]:
-                    add = f'{self.tiles[i][j]["world"]}:'
-                    add += f'{self.tiles[i][j]["sector"]}'
-                    addresses += [add]
-                if self.tiles[i][j]["arena"]:
-                    add = f'{self.tiles[i][j]["world"]}:'
-                    add += f'{self.tiles[i][j]["sector"]}:'
-                    add += f'{self.tiles[i][j]["arena"]}'
-                    addresses += [add]
-                if self.tiles[i][j]["game_object"]:
-                    add = f'{self.tiles[i][j]["world"]}:'
-                    add += f'{self.tiles[i][j]["sector"]}:'
-                    add += f'{self.tiles[i][j]["arena"]}:'
-                    add += f'{self.tiles[i][j]["game_object"]}'
-                    addresses += [add]
-                if self.tiles[i][j]["spawning_location"]:
-                    add = f'<spawn_loc>{self.tiles[i][j]["spawning_location"]}'
-                    addresses += [add]
-
-                for add in addresses:
-                    if add in self.address_tiles:
-                        self.address_tiles[add].add((j, i))
-                    else:
-                        self.address_tiles[add] = set([(j, i)])
+        self.address_tiles = compiled.address_tiles
+
+    @property
+    def collision_maze(self):
+        """
+        The raw collision layer as a list of rows of strings, which is the
+        form the path finders take. It is shared by the mazes of a folder, so
+        that path finding caches keyed on it stay warm.
+        """
+        if self._collision_maze is None:
+            return self.compiled.collision_maze
+        return self._collision_maze
+
+    @collision_maze.setter
+    def collision_maze(self, collision_maze):
+        self._collision_maze = collision_maze
+
+    def tile_events(self, tile):
+        """
+        Returns the live event set of a tile, for changing it, creating an
+        empty one in the sparse event index if the tile has none yet. Tiles
+        that still share a frozen event set with the maze this one was copied
+        from get their own copy here, on first write. Only the methods that
+        change events call this; reads go through <events>.get.
+        """
+        key = (int(tile[0]), int(tile[1]))
+        events = self.events.get(key)
+        if events is None:
+            events = self.events[key] = set()
+        elif type(events) is frozenset:
+            events = self.events[key] = set(events)
+        return events
+
+    def freeze_events(self):
+        """
+        Turns every event set into a frozenset, so that copies can share
+        them. The maze itself can still be changed; writes go through
+        <tile_events>, which copies a tile's set before changing it.
+        """
+        self.events = {
+            tile: frozenset(events) for tile, events in self.events.items() if events
+        }
+
+    def copy(self):
+        """
+        Returns a copy of this maze that shares the static layers, the base
+        state and (after <freeze_events>) the per-tile event sets with it.
+        Changing the events of either maze does not affect the other.
+        """
+        self.freeze_events()
+        maze = Maze.__new__(Maze)
+        maze.maze_name = self.maze_name
+        maze.maze_folder = self.maze_folder
+        maze._attach(self.compiled)
+        maze.events = dict(self.events)
+        maze.base_maze_ipfs_hash = self.base_maze_ipfs_hash
+        maze.base_events = self.base_events
+        return maze
 
     def turn_coordinate_to_tile(self, px_coordinate):
         """
@@ -252,7 +193,7 @@ class Maze:
         """
         x = tile[0]
         y = tile[1]
-        return self.tiles[y][x]
+        return _TileView(self, x, y)
 
     def get_tile_path(self, tile, level):
         """
@@ -270,23 +211,24 @@ class Maze:
         """
         x = tile[0]
         y = tile[1]
-        tile = self.tiles[y][x]
+        names = self.layer_names
+        layers = self.layers
 
-        path = f"{tile['world']}"
+        path = f"{names['world'][layers['world'][y, x]]}"
         if level == "world":
             return path
         else:
-            path += f":{tile['sector']}"
+            path += f":{names['sector'][layers['sector'][y, x]]}"
 
         if level == "sector":
             return path
         else:
-            path += f":{tile['arena']}"
+            path += f":{names['arena'][layers['arena'][y, x]]}"
 
         if level == "arena":
             return path
         else:
-            path += f":{tile['game_object']}"
+            path += f":{names['game_object'][layers['game_object'][y, x]]}"
 
         return path
 
@@ -342,7 +284,7 @@ class Maze:
         OUPUT:
           None
         """
-        self.tiles[tile[1]][tile[0]]["events"].add(curr_event)
+        self.tile_events(tile).add(curr_event)
 
     def remove_event_from_tile(self, curr_event, tile):
         """
@@ -356,18 +298,14 @@ class Maze:
         OUPUT:
           None
         """
-        curr_tile_ev_cp = self.tiles[tile[1]][tile[0]]["events"].copy()
-        for event in curr_tile_ev_cp:
-            if event == curr_event:
-                self.tiles[tile[1]][tile[0]]["events"].remove(event)
+        if curr_event in self.events.get((int(tile[0]), int(tile[1])), ()):
+            self.tile_events(tile).remove(curr_event)
 
     def turn_event_from_tile_idle(self, curr_event, tile):
-        curr_tile_ev_cp = self.tiles[tile[1]][tile[0]]["events"].copy()
-        for event in curr_tile_ev_cp:
-            if event == curr_event:
-                self.tiles[tile[1]][tile[0]]["events"].remove(event)
-                new_event = (event[0], None, None, None)
-                self.tiles[tile[1]][tile[0]]["events"].add(new_event)
+        if curr_event in self.events.get((int(tile[0]), int(tile[1])), ()):
+            events = self.tile_events(tile)
+            events.remove(curr_event)
+            events.add((curr_event[0], None, None, None))
 
     def remove_subject_events_from_tile(self, subject, tile):
         """
@@ -379,10 +317,92 @@ class Maze:
         OUPUT:
           None
         """
-        curr_tile_ev_cp = self.tiles[tile[1]][tile[0]]["events"].copy()
-        for event in curr_tile_ev_cp:
-            if event[0] == subject:
-                self.tiles[tile[1]][tile[0]]["events"].remove(event)
+        events = self.events.get((int(tile[0]), int(tile[1])), ())
+        subject_events = [event for event in events if event[0] == subject]
+        if subject_events:
+            self.tile_events(tile).difference_update(subject_events)
+
+    def set_base(self, base_maze_ipfs_hash):
+        """
+        Records the current events as the stored maze state
+        <base_maze_ipfs_hash>, so that later patches only carry what changed
+        since.
+
+        INPUT:
+          base_maze_ipfs_hash: The IPFS hash the current state is stored at.
+        OUTPUT:
+          None
+        """
+        self.base_maze_ipfs_hash = base_maze_ipfs_hash
+        self.base_events = {
+            tile: frozenset(events) for tile, events in self.events.items() if events
+        }
+
+    def event_patch(self):
+        """
+        Returns the events added and removed since the base state, per tile.
+        Events are stored as lists so that the patch is JSON serializable.
+
+        OUTPUT:
+          A patch dictionary, e.g.,
+          {"maze_name": "the_ville",
+           "base_maze_ipfs_hash": "Qm...",
+           "added": [[58, 9, ["Isabella Rodriguez", "is", "sleeping",
+                              "sleeping"]]],
+           "removed": [[58, 9, ["Isabella Rodriguez", None, None, None]]]}
+        """
+        if self.base_events is None:
+            base_events = {
+                tile: {event}
+                for tile, event in self.compiled.default_events.items()
+            }
+        else:
+            base_events = self.base_events
+
+        return {
+            "maze_name": self.maze_name,
+            "base_maze_ipfs_hash": self.base_maze_ipfs_hash,
+            **self.diff_events(base_events),
+        }
+
+    def diff_events(self, base_events):
+        """
+        Returns the events added and removed relative to <base_events>, per
+        tile, in a fixed order.
+
+        INPUT:
+          base_events: The events of another state of this maze, e.g.,
+                       another maze's <events>.
+        OUTPUT:
+          {"added": [[x, y, event], ...], "removed": [[x, y, event], ...]}
+        """
+        added, removed = [], []
+        for tile in sorted(set(self.events) | set(base_events)):
+            curr = self.events.get(tile, set())
+            base = base_events.get(tile, set())
+            for event in sorted(curr - base, key=repr):
+                added += [[tile[0], tile[1], list(event)]]
+            for event in sorted(base - curr, key=repr):
+                removed += [[tile[0], tile[1], list(event)]]
+        return {"added": added, "removed": removed}
+
+    def apply_event_patch(self, patch):
+        """
+        Applies a patch made by <event_patch> to the events of this maze,
+        which must be in the base state of the patch.
+
+        INPUT:
+          patch: A patch dictionary.
+        OUTPUT:
+          None
+        """
+        for x, y, event in patch["removed"]:
+            self.remove_event_from_tile(tuple(event), (x, y))
+        for x, y, event in patch["added"]:
+            self.add_event_from_tile(tuple(event), (x, y))
+
+    def to_patch_json(self):
+        return json.dumps(self.event_patch())
 
     def to_json(self):
         serialized_data = {
@@ -402,12 +422,12 @@ class Maze:
                         "spawning_location": tile["spawning_location"],
                         "collision": tile["collision"],
                         "events": list(
-                            tile["events"]
+                            self.events.get((x, y), ())
                         ),  # Convert set to list for JSON serialization
                     }
-                    for tile in row
+                    for x, tile in enumerate(row)
                 ]
-                for row in self.tiles
+                for y, row in enumerate(self.tiles)
             ],
             "address_tiles": {
                 key: list(value)  # Convert set to list for JSON serialization
@@ -418,36 +438,120 @@ class Maze:
 
     @classmethod
     def from_json(cls, json_string, maze_folder):
+        """
+        Loads a maze from either a full <to_json> dump or a patch made by
+        <to_patch_json> against the default events. A patch against another
+        stored state has to be applied to that state instead (see
+        napthaville_module.utils.retrieve_maze_from_ipfs).
+        """
         data = json.loads(json_string)
+        # The static layers come from the compiled <maze_folder>.
         maze = cls(data["maze_name"], maze_folder)
 
-        maze.maze_width = data["maze_width"]
-        maze.maze_height = data["maze_height"]
-        maze.sq_tile_size = data["sq_tile_size"]
-        maze.special_constraint = data["special_constraint"]
-        maze.collision_maze = data["collision_maze"]
-
-        maze.tiles = [
-            [
-                {
-                    "world": tile["world"],
-                    "sector": tile["sector"],
-                    "arena": tile["arena"],
-                    "game_object": tile["game_object"],
-                    "spawning_location": tile["spawning_location"],
-                    "collision": tile["collision"],
-                    "events": set(
+        if "tiles" not in data:
+            if data.get("base_maze_ipfs_hash"):
+                raise ValueError(
+                    "Maze patch against "
+                    f"{data['base_maze_ipfs_hash']} needs its base state"
+                )
+            maze.apply_event_patch(data)
+            return maze
+
+        # Only the events are taken from the serialized tiles.
+        maze.events = dict()
+        for y, row in enumerate(data["tiles"]):
+            for x, tile in enumerate(row):
+                if tile["events"]:
+                    maze.events[(x, y)] = set(
                         tuple(event) for event in tile["events"]
-                    ),  # Convert list back to set
-                }
-                for tile in row
-            ]
-            for row in data["tiles"]
-        ]
-
-        maze.address_tiles = {
-            key: set(tuple(coord) for coord in value)  # Convert list back to set
-            for key, value in data["address_tiles"].items()
-        }
+                    )  # Convert list back to set
 
         return maze
+
+
+class _TileView(Mapping):
+    """
+    A read-only, dictionary-like view of a single tile, with the same keys
+    as the tile dictionaries this class used to store. The "events" value is
+    a read-only set of the tile's events; events are changed through
+    Maze.add_event_from_tile and the like, so that reading a tile never adds
+    to the sparse event index.
+    """
+
+    __slots__ = ("_maze", "_x", "_y")
+    _keys = (
+        "world",
+        "sector",
+        "arena",
+        "game_object",
+        "spawning_location",
+        "collision",
+        "events",
+    )
+
+    def __init__(self, maze, x, y):
+        self._maze = maze
+        self._x = int(x)
+        self._y = int(y)
+
+    def __getitem__(self, key):
+        maze = self._maze
+        if key == "events":
+            return frozenset(maze.events.get((self._x, self._y), ()))
+        if key == "collision":
+            return bool(maze.collision[self._y, self._x])
+        if key not in maze.layers:
+            raise KeyError(key)
+        return maze.layer_names[key][maze.layers[key][self._y, self._x]]
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class _TileRow:
+    __slots__ = ("_maze", "_y")
+
+    def __init__(self, maze, y):
+        self._maze = maze
+        self._y = y
+
+    def __getitem__(self, x):
+        if x < 0:
+            x += self._maze.maze_width
+        return _TileView(self._maze, x, self._y)
+
+    def __len__(self):
+        return self._maze.maze_width
+
+    def __iter__(self):
+        for x in range(self._maze.maze_width):
+            yield _TileView(self._maze, x, self._y)
+
+
+class _TileGrid:
+    """
+    Row:col access to the tiles of a <Maze>, i.e., maze.tiles[y][x].
+    """
+
+    __slots__ = ("_maze",)
+
+    def __init__(self, maze):
+        self._maze = maze
+
+    def __getitem__(self, y):
+        if y < 0:
+            y += self._maze.maze_height
+        return _TileRow(self._maze, y)
+
+    def __len__(self):
+        return self._maze.maze_height
+
+    def __iter__(self):
+        for y in range(self._maze.maze_height):
+            yield _TileRow(self._maze, y)
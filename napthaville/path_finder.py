@@ -6,6 +6,9 @@ Description: Implements various path finding functions for generative agents.
 Some of the functions are defunct.
 """
 
+import heapq
+from collections import OrderedDict, deque
+
 import numpy as np
 
 
@@ -163,20 +166,270 @@ def path_finder_v2(a, start, end, collision_block_char, verbose=False):
     return the_path
 
 
-def path_finder(maze, start, end, collision_block_char, verbose=False):
-    # EMERGENCY PATCH
-    start = (start[1], start[0])
-    end = (end[1], end[0])
-    # END EMERGENCY PATCH
-
-    path = path_finder_v2(maze, start, end, collision_block_char, verbose)
+class CollisionGrid:
+    """
+    A walkability grid that is built once from a collision maze and then
+    reused by every search on that maze.
+
+    The grid is stored as a flat bytearray indexed by <row * width + col>, so
+    the search loops only do integer arithmetic. Cells are compared to the
+    collision block as strings: <maze.collision_maze> holds the raw CSV
+    strings while callers such as execute() pass the block id as an int.
+    """
+
+    def __init__(self, maze, collision_block_char):
+        self.height = len(maze)
+        self.width = len(maze[0]) if maze else 0
+        block = str(collision_block_char)
+        self.walkable = bytearray(self.width * self.height)
+        for i, row in enumerate(maze):
+            offset = i * self.width
+            for j, cell in enumerate(row):
+                if str(cell) != block:
+                    self.walkable[offset + j] = 1
+
+    def index(self, tile):
+        """
+        Turns an (x, y) tile coordinate into its flat index, or returns None
+        when the tile is outside of the grid.
+        """
+        x, y = int(tile[0]), int(tile[1])
+        if x < 0 or y < 0 or x >= self.width or y >= self.height:
+            return None
+        return y * self.width + x
+
+    def tile(self, index):
+        return (index % self.width, index // self.width)
+
+    def neighbors(self, index):
+        width = self.width
+        walkable = self.walkable
+        col = index % width
+        if index >= width and walkable[index - width]:
+            yield index - width
+        if col > 0 and walkable[index - 1]:
+            yield index - 1
+        if index + width < len(walkable) and walkable[index + width]:
+            yield index + width
+        if col < width - 1 and walkable[index + 1]:
+            yield index + 1
+
+    def trace(self, parents, end):
+        path = [end]
+        while parents[path[-1]] != path[-1]:
+            path.append(parents[path[-1]])
+        path.reverse()
+        return [self.tile(i) for i in path]
+
+
+# <_collision_grids> keeps the most recently used grids keyed by the identity
+# of the collision maze they were built from. We hold on to the maze itself
+# as well so that its id cannot be recycled while the entry is alive.
+_collision_grids = OrderedDict()
+_COLLISION_GRID_CACHE_SIZE = 8
+
+
+def get_collision_grid(maze, collision_block_char):
+    """
+    Returns the <CollisionGrid> for the collision maze, building it only the
+    first time this maze and collision block are seen.
+
+    INPUT:
+      maze: The collision maze (a list of rows, e.g., maze.collision_maze).
+      collision_block_char: The value that marks a collision tile.
+    OUTPUT:
+      A <CollisionGrid> instance.
+    """
+    key = (id(maze), str(collision_block_char))
+    if key in _collision_grids:
+        cached_maze, grid = _collision_grids[key]
+        if cached_maze is maze:
+            _collision_grids.move_to_end(key)
+            return grid
+
+    grid = CollisionGrid(maze, collision_block_char)
+    _collision_grids[key] = (maze, grid)
+    while len(_collision_grids) > _COLLISION_GRID_CACHE_SIZE:
+        _collision_grids.popitem(last=False)
+    return grid
+
+
+def path_finder_bfs(maze, start, end, collision_block_char, verbose=False):
+    """
+    Breadth-first search from <start> to <end> over the collision maze. Each
+    tile is visited at most once, so this is O(W*H) per search in the worst
+    case rather than per wavefront step as in path_finder_v2.
+
+    INPUT:
+      maze: The collision maze (a list of rows).
+      start: The starting tile in (x, y) form.
+      end: The target tile in (x, y) form.
+      collision_block_char: The value that marks a collision tile.
+    OUTPUT:
+      A list of (x, y) tiles from <start> to <end>, both included. An empty
+      list if <end> cannot be reached.
+    """
+    grid = get_collision_grid(maze, collision_block_char)
+    start_i = grid.index(start)
+    end_i = grid.index(end)
+    if start_i is None or end_i is None:
+        return []
+    if start_i == end_i:
+        return [grid.tile(start_i)]
+    if not grid.walkable[end_i]:
+        return []
 
-    new_path = []
-    for i in path:
-        new_path += [(i[1], i[0])]
-    path = new_path
+    parents = {start_i: start_i}
+    queue = deque([start_i])
+    while queue:
+        curr = queue.popleft()
+        for nxt in grid.neighbors(curr):
+            if nxt in parents:
+                continue
+            parents[nxt] = curr
+            if nxt == end_i:
+                return grid.trace(parents, end_i)
+            queue.append(nxt)
+
+    if verbose:
+        print(f"path_finder_bfs: {end} is not reachable from {start}")
+    return []
+
+
+def path_finder_astar(maze, start, end, collision_block_char, verbose=False):
+    """
+    A* search from <start> to <end> over the collision maze, guided by the
+    Manhattan distance (which is exact on an open 4-connected grid). Returns
+    paths of the same length as path_finder_bfs while expanding far fewer
+    tiles when the target is close.
+
+    INPUT:
+      maze: The collision maze (a list of rows).
+      start: The starting tile in (x, y) form.
+      end: The target tile in (x, y) form.
+      collision_block_char: The value that marks a collision tile.
+    OUTPUT:
+      A list of (x, y) tiles from <start> to <end>, both included. An empty
+      list if <end> cannot be reached.
+    """
+    grid = get_collision_grid(maze, collision_block_char)
+    start_i = grid.index(start)
+    end_i = grid.index(end)
+    if start_i is None or end_i is None:
+        return []
+    if start_i == end_i:
+        return [grid.tile(start_i)]
+    if not grid.walkable[end_i]:
+        return []
 
-    return path
+    width = grid.width
+    end_x, end_y = end_i % width, end_i // width
+
+    def heuristic(index):
+        return abs(index % width - end_x) + abs(index // width - end_y)
+
+    parents = {start_i: start_i}
+    costs = {start_i: 0}
+    # Ties on f are broken towards the smaller heuristic, which keeps the
+    # search hugging the straight line to the target.
+    frontier = [(heuristic(start_i), heuristic(start_i), start_i)]
+    while frontier:
+        _, _, curr = heapq.heappop(frontier)
+        if curr == end_i:
+            return grid.trace(parents, end_i)
+        next_cost = costs[curr] + 1
+        for nxt in grid.neighbors(curr):
+            if next_cost < costs.get(nxt, next_cost + 1):
+                costs[nxt] = next_cost
+                parents[nxt] = curr
+                h = heuristic(nxt)
+                heapq.heappush(frontier, (next_cost + h, h, nxt))
+
+    if verbose:
+        print(f"path_finder_astar: {end} is not reachable from {start}")
+    return []
+
+
+def path_finder_nearest(
+    maze, start, ends, collision_block_char, verbose=False, distance_table=None
+):
+    """
+    Finds the nearest reachable tile among <ends> and the path to it in a
+    single A* search. The heuristic is the Manhattan distance to the closest
+    goal, which stays admissible for any number of goals.
+
+    INPUT:
+      maze: The collision maze (a list of rows).
+      start: The starting tile in (x, y) form.
+      ends: An iterable of candidate target tiles in (x, y) form.
+      collision_block_char: The value that marks a collision tile.
+      distance_table: An optional precomputed <DistanceTable> for this maze.
+                      When given, the answer is read off the table instead of
+                      searching.
+    OUTPUT:
+      A (closest_end, path) tuple where <closest_end> is the element of <ends>
+      that was reached and <path> runs from <start> to it, both included.
+      (None, []) if none of <ends> can be reached.
+    """
+    if distance_table is not None:
+        ret = distance_table.nearest(start, ends)
+        if ret is not None:
+            return ret
+
+    grid = get_collision_grid(maze, collision_block_char)
+    start_i = grid.index(start)
+    if start_i is None:
+        return None, []
+
+    goals = dict()
+    for end in ends:
+        end_i = grid.index(end)
+        if end_i is None or end_i in goals:
+            continue
+        if end_i == start_i:
+            return end, [grid.tile(start_i)]
+        if grid.walkable[end_i]:
+            goals[end_i] = end
+    if not goals:
+        return None, []
+
+    width = grid.width
+    goal_xys = [(i % width, i // width) for i in goals]
+
+    def heuristic(index):
+        x, y = index % width, index // width
+        return min(abs(x - gx) + abs(y - gy) for gx, gy in goal_xys)
+
+    parents = {start_i: start_i}
+    costs = {start_i: 0}
+    frontier = [(heuristic(start_i), heuristic(start_i), start_i)]
+    while frontier:
+        _, _, curr = heapq.heappop(frontier)
+        if curr in goals:
+            return goals[curr], grid.trace(parents, curr)
+        next_cost = costs[curr] + 1
+        for nxt in grid.neighbors(curr):
+            if next_cost < costs.get(nxt, next_cost + 1):
+                costs[nxt] = next_cost
+                parents[nxt] = curr
+                h = heuristic(nxt)
+                heapq.heappush(frontier, (next_cost + h, h, nxt))
+
+    if verbose:
+        print(f"path_finder_nearest: none of {list(ends)} is reachable from {start}")
+    return None, []
+
+
+def path_finder(
+    maze, start, end, collision_block_char, verbose=False, distance_table=None
+):
+    # A precomputed <DistanceTable> turns the search into a walk along the
+    # table; we only search when the start tile is not covered by it.
+    if distance_table is not None:
+        path = distance_table.path(start, end)
+        if path is not None:
+            return path
+    return path_finder_astar(maze, start, end, collision_block_char, verbose)
 
 
 def closest_coordinate(curr_coordinate, target_coordinates):
@@ -6,7 +6,12 @@ Description: This defines the "Act" module for generative agents.
 """
 
 import random
-from napthaville.path_finder import path_finder
+from napthaville.path_finder import path_finder, path_finder_nearest
+from napthaville.distance_table import get_distance_table
+from napthaville.hierarchical_path_finder import (
+    HIERARCHICAL_MIN_TILES,
+    get_hierarchical_path_finder,
+)
 
 
 collision_block_id = 32125
@@ -45,34 +50,42 @@ def execute(persona, maze, persona_names_curr_tile, plan):
         print("aldhfoaf/????")
         print(plan)
 
+        # <distance_table> is the offline all-pairs table for this maze, or
+        # None if it has not been built, in which case we search instead.
+        distance_table = get_distance_table(maze, collision_block_id)
+        # Without a table, large custom maps are planned hierarchically over
+        # their arenas rather than with a flat search.
+        hierarchical = None
+        if (
+            distance_table is None
+            and maze.maze_width * maze.maze_height >= HIERARCHICAL_MIN_TILES
+        ):
+            hierarchical = get_hierarchical_path_finder(maze, collision_block_id)
+
         if "<persona>" in plan:
             # Executing persona-persona interaction.
             target_p_tile = persona_names_curr_tile[plan.split("<persona>")[-1].strip()]
-            potential_path = path_finder(
-                maze.collision_maze,
-                persona.scratch.curr_tile,
-                target_p_tile,
-                collision_block_id,
-            )
-            if len(potential_path) <= 2:
-                target_tiles = [potential_path[0]]
-            else:
-                potential_1 = path_finder(
-                    maze.collision_maze,
-                    persona.scratch.curr_tile,
-                    potential_path[int(len(potential_path) / 2)],
-                    collision_block_id,
+            if hierarchical:
+                potential_path = hierarchical.find_path(
+                    persona.scratch.curr_tile, target_p_tile
                 )
-                potential_2 = path_finder(
+            else:
+                potential_path = path_finder(
                     maze.collision_maze,
                     persona.scratch.curr_tile,
-                    potential_path[int(len(potential_path) / 2) + 1],
+                    target_p_tile,
                     collision_block_id,
+                    distance_table=distance_table,
                 )
-                if len(potential_1) <= len(potential_2):
-                    target_tiles = [potential_path[int(len(potential_path) / 2)]]
-                else:
-                    target_tiles = [potential_path[int(len(potential_path) / 2 + 1)]]
+            if not potential_path:
+                target_tiles = [persona.scratch.curr_tile]
+            elif len(potential_path) <= 2:
+                target_tiles = [potential_path[0]]
+            else:
+                # We meet the other persona half way. Both midpoint candidates
+                # lie on a shortest path from our tile, so the first one is
+                # always the closer of the two and needs no extra search.
+                target_tiles = [potential_path[int(len(potential_path) / 2)]]
 
         elif "<waiting>" in plan:
             # Executing interaction where the persona has decided to wait before
@@ -127,25 +140,22 @@ def execute(persona, maze, persona_names_curr_tile, plan):
         target_tiles = new_target_tiles
 
         # Now that we've identified the target tile, we find the shortest path to
-        # one of the target tiles.
-        curr_tile = persona.scratch.curr_tile
-        collision_maze = maze.collision_maze
-        closest_target_tile = None
-        path = None
-        for i in target_tiles:
-            # path_finder takes a collision_mze and the curr_tile coordinate as
-            # an input, and returns a list of coordinate tuples that becomes the
-            # path.
-            # e.g., [(0, 1), (1, 1), (1, 2), (1, 3), (1, 4)...]
-            curr_path = path_finder(
-                maze.collision_maze, curr_tile, i, collision_block_id
+        # the closest of the target tiles. path_finder_nearest searches for all
+        # of them at once and returns a list of coordinate tuples that becomes
+        # the path.
+        # e.g., [(0, 1), (1, 1), (1, 2), (1, 3), (1, 4)...]
+        if hierarchical:
+            closest_target_tile, path = hierarchical.find_nearest(
+                persona.scratch.curr_tile, target_tiles
+            )
+        else:
+            closest_target_tile, path = path_finder_nearest(
+                maze.collision_maze,
+                persona.scratch.curr_tile,
+                target_tiles,
+                collision_block_id,
+                distance_table=distance_table,
             )
-            if not closest_target_tile:
-                closest_target_tile = i
-                path = curr_path
-            elif len(curr_path) < len(path):
-                closest_target_tile = i
-                path = curr_path
 
         if not path:
             path = persona.scratch.planned_path
@@ -8,10 +8,16 @@ Description: This defines the "Perceive" module for generative agents.
 import math
 from operator import itemgetter
 from napthaville.global_methods import *
-from napthaville.persona.prompt_template.gpt_structure2 import get_embedding
+from napthaville.persona.prompt_template.gpt_structure2 import (
+    get_embedding,
+    async_get_embeddings,
+    run_concurrently,
+)
 from napthaville.persona.prompt_template.run_gpt_prompt2 import (
     run_gpt_prompt_chat_poignancy,
     run_gpt_prompt_event_poignancy,
+    async_run_gpt_prompt_chat_poignancy,
+    async_run_gpt_prompt_event_poignancy,
 )
 
 
@@ -27,6 +33,81 @@ def generate_poig_score(persona, event_type, description):
         ]
 
 
+def describe_event(p_event):
+    """
+    Given a perceived event (s, p, o, desc) from the maze, returns its triple,
+    the description stored in memory and the text that gets embedded.
+    """
+    s, p, o, desc = p_event
+    if not p:
+        # If the object is not present, then we default the event to "idle".
+        p = "is"
+        o = "idle"
+        desc = "idle"
+    desc = f"{s.split(':')[-1]} is {desc}"
+
+    desc_embedding_in = desc
+    if "(" in desc:
+        desc_embedding_in = desc_embedding_in.split("(")[1].split(")")[0].strip()
+    return (s, p, o), desc, desc_embedding_in
+
+
+def new_events(persona, perceived_events):
+    """
+    The perceived events that are new to the persona, as perceive is going to
+    add them: (triple, embedded text) pairs.
+    """
+    latest_events = persona.a_mem.get_summarized_latest_events(
+        persona.scratch.retention
+    )
+    for p_event in perceived_events:
+        p_event, _, desc_embedding_in = describe_event(p_event)
+        if p_event in latest_events:
+            continue
+        latest_events.add(p_event)
+        yield p_event, desc_embedding_in
+
+
+def prefetch(persona, perceived_events):
+    """
+    Requests together what perceive is going to need for the events that are
+    new to the persona, and for its own chat: their embeddings, in one batch,
+    and their poignancy scores, rather than one prompt after another. Texts
+    that are already in the persona's memory are not embedded again.
+
+    OUTPUT:
+      A dictionary from embedded text to embedding, and one from (event
+      type, description) to poignancy. Prompts that failed are left out.
+    """
+    texts = []
+    keys = []
+    for p_event, desc_embedding_in in new_events(persona, perceived_events):
+        texts += [desc_embedding_in]
+        keys += [("event", desc_embedding_in)]
+        if p_event[0] == f"{persona.name}" and p_event[1] == "chat with":
+            texts += [persona.scratch.act_description]
+            keys += [("chat", persona.scratch.act_description)]
+    texts = [
+        text for text in dict.fromkeys(texts) if text not in persona.a_mem.embeddings
+    ]
+    keys = [key for key in dict.fromkeys(keys) if "is idle" not in key[1]]
+    prompts = {
+        "event": async_run_gpt_prompt_event_poignancy,
+        "chat": async_run_gpt_prompt_chat_poignancy,
+    }
+    embeddings, *outputs = run_concurrently(
+        [async_get_embeddings(texts)]
+        + [
+            prompts[event_type](persona, description)
+            for event_type, description in keys
+        ]
+    )
+    return (
+        dict(zip(texts, embeddings)),
+        {key: output[0] for key, output in zip(keys, outputs) if output},
+    )
+
+
 def perceive(persona, maze):
     """
     Perceives events around the persona and saves it to the memory, both events
@@ -114,15 +195,10 @@ def perceive(persona, maze):
     # <ret_events> is a list of <ConceptNode> instances from the persona's
     # associative memory.
     ret_events = []
+    prefetched, poignancies = prefetch(persona, perceived_events)
     for p_event in perceived_events:
-        s, p, o, desc = p_event
-        if not p:
-            # If the object is not present, then we default the event to "idle".
-            p = "is"
-            o = "idle"
-            desc = "idle"
-        desc = f"{s.split(':')[-1]} is {desc}"
-        p_event = (s, p, o)
+        p_event, desc, desc_embedding_in = describe_event(p_event)
+        s, p, o = p_event
 
         # We retrieve the latest persona.scratch.retention events. If there is
         # something new that is happening (that is, p_event not in latest_events),
@@ -142,19 +218,20 @@ def perceive(persona, maze):
             keywords.update([sub, obj])
 
             # Get event embedding
-            desc_embedding_in = desc
-            if "(" in desc:
-                desc_embedding_in = (
-                    desc_embedding_in.split("(")[1].split(")")[0].strip()
-                )
             if desc_embedding_in in persona.a_mem.embeddings:
                 event_embedding = persona.a_mem.embeddings[desc_embedding_in]
+            elif desc_embedding_in in prefetched:
+                event_embedding = prefetched[desc_embedding_in]
             else:
                 event_embedding = get_embedding(desc_embedding_in)
             event_embedding_pair = (desc_embedding_in, event_embedding)
 
             # Get event poignancy.
-            event_poignancy = generate_poig_score(persona, "event", desc_embedding_in)
+            event_poignancy = poignancies.get(("event", desc_embedding_in))
+            if event_poignancy is None:
+                event_poignancy = generate_poig_score(
+                    persona, "event", desc_embedding_in
+                )
 
             # If we observe the persona's self chat, we include that in the memory
             # of the persona here.
@@ -165,12 +242,18 @@ def perceive(persona, maze):
                     chat_embedding = persona.a_mem.embeddings[
                         persona.scratch.act_description
                     ]
+                elif persona.scratch.act_description in prefetched:
+                    chat_embedding = prefetched[persona.scratch.act_description]
                 else:
                     chat_embedding = get_embedding(persona.scratch.act_description)
                 chat_embedding_pair = (persona.scratch.act_description, chat_embedding)
-                chat_poignancy = generate_poig_score(
-                    persona, "chat", persona.scratch.act_description
+                chat_poignancy = poignancies.get(
+                    ("chat", persona.scratch.act_description)
                 )
+                if chat_poignancy is None:
+                    chat_poignancy = generate_poig_score(
+                        persona, "chat", persona.scratch.act_description
+                    )
                 chat_node = persona.a_mem.add_chat(
                     persona.scratch.curr_time,
                     None,
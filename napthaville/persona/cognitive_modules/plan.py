@@ -587,7 +587,7 @@ def revise_identity(persona):
     persona.scratch.daily_plan_req = new_daily_req
 
 
-def _long_term_planning(persona, new_day, save_folder):
+def _long_term_planning(persona, new_day, save_folder=None):
     """
     Formulates the persona's daily long-term plan if it is the start of a new
     day. This basically has two components: first, we create the wake-up hour,
@@ -650,15 +650,16 @@ def _long_term_planning(persona, new_day, save_folder):
         None,
     )
 
-    # save all memory
-    persona.save(save_folder)
+    # save all memory, unless the caller does
+    if save_folder:
+        persona.save(save_folder)
 
     # print("Sleeping for 20 seconds...")
     # time.sleep(10)
     # print("Done sleeping!")
 
 
-def _determine_action(persona, maze, save_folder):
+def _determine_action(persona, maze, save_folder=None):
     """
     Creates the next action sequence for the persona.
     The main goal of this function is to run "add_new_action" on the persona's
@@ -793,7 +794,8 @@ def _determine_action(persona, maze, save_folder):
         act_obj_event,
     )
 
-    persona.save(save_folder)
+    if save_folder:
+        persona.save(save_folder)
 
 
 def _choose_retrieved(persona, retrieved):
@@ -1274,6 +1276,9 @@ def _chat_react(
     logger.info(f"to_return: {to_return}")
 
     logger.info(f"init_persona.a_mem: {init_persona.a_mem}")
+    if sims_folder is None:
+        # The caller saves the persona.
+        return to_return
     init_persona.a_mem.save(
         f"{os.getenv('BASE_OUTPUT_DIR')}/{sims_folder}/bootstrap_memory/associative_memory"
     )
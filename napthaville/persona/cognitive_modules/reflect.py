@@ -14,8 +14,11 @@ from napthaville.persona.prompt_template.run_gpt_prompt2 import (
     run_gpt_prompt_chat_poignancy,  #
     run_gpt_prompt_planning_thought_on_convo,  #
     run_gpt_prompt_memo_on_convo,  #
+    async_run_gpt_prompt_planning_thought_on_convo,
+    async_run_gpt_prompt_memo_on_convo,
 )
-from napthaville.persona.cognitive_modules.retrieve import new_retrieve, get_embedding
+from napthaville.persona.prompt_template.gpt_structure2 import run_concurrently
+from napthaville.persona.cognitive_modules.retrieve import new_retrieve, get_embeddings
 
 
 def generate_focal_points(persona, n=3):
@@ -111,8 +114,10 @@ def run_reflect(persona):
     # <retrieved> has keys of focal points, and values of the associated Nodes.
     retrieved = new_retrieve(persona, focal_points)
 
-    # For each of the focal points, generate thoughts and save it in the
-    # agent's memory.
+    # For each of the focal points, generate thoughts. Their embeddings are
+    # requested together once all of them are known, and the thoughts are
+    # then saved in the agent's memory in the order they were generated.
+    new_thoughts = []
     for focal_pt, nodes in retrieved.items():
         xx = [i.embedding_key for i in nodes]
         for xxx in xx:
@@ -120,25 +125,31 @@ def run_reflect(persona):
 
         thoughts = generate_insights_and_evidence(persona, nodes, 5)
         for thought, evidence in thoughts.items():
-            created = persona.scratch.curr_time
-            expiration = persona.scratch.curr_time + datetime.timedelta(days=30)
             s, p, o = generate_action_event_triple(thought, persona)
-            keywords = set([s, p, o])
             thought_poignancy = generate_poig_score(persona, "thought", thought)
-            thought_embedding_pair = (thought, get_embedding(thought))
+            new_thoughts += [(thought, evidence, (s, p, o), thought_poignancy)]
 
-            persona.a_mem.add_thought(
-                created,
-                expiration,
-                s,
-                p,
-                o,
-                thought,
-                keywords,
-                thought_poignancy,
-                thought_embedding_pair,
-                evidence,
-            )
+    thought_embeddings = get_embeddings([thought for thought, *_ in new_thoughts])
+    for (thought, evidence, (s, p, o), thought_poignancy), embedding in zip(
+        new_thoughts, thought_embeddings
+    ):
+        created = persona.scratch.curr_time
+        expiration = persona.scratch.curr_time + datetime.timedelta(days=30)
+        keywords = set([s, p, o])
+        thought_embedding_pair = (thought, embedding)
+
+        persona.a_mem.add_thought(
+            created,
+            expiration,
+            s,
+            p,
+            o,
+            thought,
+            keywords,
+            thought_poignancy,
+            thought_embedding_pair,
+            evidence,
+        )
 
 
 def reflection_trigger(persona):
@@ -230,10 +241,24 @@ def reflect(persona):
                 persona.a_mem.get_last_chat(persona.scratch.chatting_with).node_id
             ]
 
-            planning_thought = generate_planning_thought_on_convo(persona, all_utt)
+            # The planning thought and the memo on the conversation do not
+            # depend on each other, so both prompts go out together.
+            print("GNS FUNCTION: <generate_planning_thought_on_convo>")
+            print("GNS FUNCTION: <generate_memo_on_convo>")
+            (planning_thought, _), (memo_thought, _) = run_concurrently(
+                [
+                    async_run_gpt_prompt_planning_thought_on_convo(persona, all_utt),
+                    async_run_gpt_prompt_memo_on_convo(persona, all_utt),
+                ]
+            )
             planning_thought = (
                 f"For {persona.scratch.name}'s planning: {planning_thought}"
             )
+            memo_thought = f"{persona.scratch.name} {memo_thought}"
+            # Both thoughts are embedded in one request.
+            planning_embedding, memo_embedding = get_embeddings(
+                [planning_thought, memo_thought]
+            )
 
             created = persona.scratch.curr_time
             expiration = persona.scratch.curr_time + datetime.timedelta(days=30)
@@ -242,7 +267,7 @@ def reflect(persona):
             thought_poignancy = generate_poig_score(
                 persona, "thought", planning_thought
             )
-            thought_embedding_pair = (planning_thought, get_embedding(planning_thought))
+            thought_embedding_pair = (planning_thought, planning_embedding)
 
             persona.a_mem.add_thought(
                 created,
@@ -257,15 +282,12 @@ def reflect(persona):
                 evidence,
             )
 
-            memo_thought = generate_memo_on_convo(persona, all_utt)
-            memo_thought = f"{persona.scratch.name} {memo_thought}"
-
             created = persona.scratch.curr_time
             expiration = persona.scratch.curr_time + datetime.timedelta(days=30)
             s, p, o = generate_action_event_triple(memo_thought, persona)
             keywords = set([s, p, o])
             thought_poignancy = generate_poig_score(persona, "thought", memo_thought)
-            thought_embedding_pair = (memo_thought, get_embedding(memo_thought))
+            thought_embedding_pair = (memo_thought, memo_embedding)
 
             persona.a_mem.add_thought(
                 created,
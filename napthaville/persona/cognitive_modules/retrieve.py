@@ -5,9 +5,13 @@ File: retrieve.py
 Description: This defines the "Retrieve" module for generative agents.
 """
 
+import numpy as np
 from numpy import dot
 from numpy.linalg import norm
-from napthaville.persona.prompt_template.gpt_structure2 import get_embedding
+from napthaville.persona.prompt_template.gpt_structure2 import (
+    get_embedding,
+    get_embeddings,
+)
 
 
 def retrieve(persona, perceived):
@@ -24,29 +28,45 @@ def retrieve(persona, perceived):
     OUTPUT:
       retrieved: a dictionary of dictionary. The first layer specifies an event,
                 while the latter layer specifies the "curr_event", "events",
-                and "thoughts" that are relevant.
+                and "thoughts" that are relevant, as <ConceptNode> dicts.
+    """
+    retrieved = dict()
+    for event_desc, rel_ctx in retrieve_nodes(persona, perceived).items():
+        retrieved[event_desc] = {
+            "curr_event": rel_ctx["curr_event"].to_dict(),
+            "events": [node.to_dict() for node in rel_ctx["events"]],
+            "thoughts": [node.to_dict() for node in rel_ctx["thoughts"]],
+        }
+    return retrieved
+
+
+def retrieve_nodes(persona, perceived):
+    """
+    <retrieve>, keeping the <ConceptNode>s themselves, for callers that plan
+    on them in the same process.
+
+    INPUT:
+      perceived: a list of event <ConceptNode>s.
+    OUTPUT:
+      retrieved: a dictionary of dictionary. The first layer specifies an event,
+                while the latter layer specifies the "curr_event", "events",
+                and "thoughts" <ConceptNode>s that are relevant.
     """
     # We rerieve events and thoughts separately.
     retrieved = dict()
     for event in perceived:
         retrieved[event.description] = dict()
-        retrieved[event.description]["curr_event"] = event.to_dict()
+        retrieved[event.description]["curr_event"] = event
 
         relevant_events = persona.a_mem.retrieve_relevant_events(
             event.subject, event.predicate, event.object
         )
-        # Convert set of ConceptNodes to list of dicts
-        relevant_events = [node.to_dict() for node in list(relevant_events)]
-
-        retrieved[event.description]["events"] = relevant_events
+        retrieved[event.description]["events"] = list(relevant_events)
 
         relevant_thoughts = persona.a_mem.retrieve_relevant_thoughts(
             event.subject, event.predicate, event.object
         )
-        # Convert set of ConceptNodes to list of dicts
-        relevant_thoughts = [node.to_dict() for node in list(relevant_thoughts)]
-
-        retrieved[event.description]["thoughts"] = relevant_thoughts
+        retrieved[event.description]["thoughts"] = list(relevant_thoughts)
 
     return retrieved
 
@@ -205,6 +225,15 @@ def new_retrieve(persona, focal_points, n_count=30):
     thoughts for which we are retrieving), we retrieve a set of nodes for each
     of the focal points and return a dictionary.
 
+    The scores are the same as in the per-node version (see extract_recency,
+    extract_importance and extract_relevance), but computed over the parallel
+    arrays of the associative memory: the relevance of every node to every
+    focal point is one matrix multiply against the unit-length embedding
+    matrix, and the top n_count nodes are found with argpartition. Past
+    ANN_EXACT_THRESHOLD memories, relevance comes from the ANN index: only
+    the nodes whose embeddings are near a focal point are scored and ranked
+    for it, and there may be fewer than n_count of them.
+
     INPUT:
       persona: The current persona object whose memory we are retrieving.
       focal_points: A list of focal points (string description of the events or
@@ -218,64 +247,114 @@ def new_retrieve(persona, focal_points, n_count=30):
       persona = <persona> object
       focal_points = ["How are you?", "Jane is swimming in the pond"]
     """
-    # <retrieved> is the main dictionary that we are returning
+    a_mem = persona.a_mem
+    arrays = a_mem.node_arrays
+    n = arrays.size
+
+    # Getting all nodes from the agent's memory (both thoughts and events)
+    # except the idle ones, in the order seq_event + seq_thought lists them
+    # (latest event first, then latest thought first). That order is the
+    # tie-break of the stable sort by last accessed time below.
+    cand = np.flatnonzero(~arrays.is_idle[:n])
+    if len(cand) == 0:
+        return {focal_pt: [] for focal_pt in focal_points}
+    order = arrays.is_thought[cand] * (n + 1) - arrays.kind_index[cand]
+    cand = cand[np.argsort(order, kind="stable")]
+
+    # Computing the component scores and normalizing them. Importance does not
+    # depend on the focal point; relevance of all focal points is one matmul.
+    importance = _normalize(arrays.poignancy[cand])
+    # <selected> holds, for each focal point, the positions in cand of the
+    # nodes ranked for it, and <relevance> their relevance: all of them
+    # without the ANN index, those it finds near the focal point with it.
+    focal_embeddings = get_embeddings(focal_points)
+    store, index = a_mem.embeddings, a_mem.ann_index
+    if index.covers(store):
+        by_row = np.argsort(arrays.rows[cand], kind="stable")
+        sorted_rows = arrays.rows[cand][by_row]
+        selected, relevance = [], []
+        for rows, sims in index.search(store, focal_embeddings):
+            positions, sims = _nodes_of_rows(by_row, sorted_rows, rows, sims)
+            selected.append(positions)
+            relevance.append(_normalize(sims.astype(np.float64)) if len(sims) else sims)
+    else:
+        relevance = store.cosine(focal_embeddings)[:, arrays.rows[cand]]
+        relevance = _normalize(relevance.astype(np.float64), axis=1)
+        selected = [slice(None)] * len(focal_points)
+
+    # Recency is decay**i where i is the rank of the node by last accessed
+    # time (oldest first). As the access times change after every focal
+    # point, it is recomputed for each.
+    decay = persona.scratch.recency_decay
+    recency_vals = _normalize(decay ** np.arange(1, len(cand) + 1, dtype=np.float64))
+
+    # Note to self: test out different weights. [1, 1, 1] tends to work
+    # decently, but in the future, these weights should likely be learned,
+    # perhaps through an RL-like process.
+    # gw = [1, 1, 1]
+    # gw = [1, 2, 1]
+    gw = [0.5, 3, 2]
     retrieved = dict()
-    for focal_pt in focal_points:
-        # Getting all nodes from the agent's memory (both thoughts and events) and
-        # sorting them by the datetime of creation.
-        # You could also imagine getting the raw conversation, but for now.
-        nodes = [
-            [i.last_accessed, i]
-            for i in persona.a_mem.seq_event + persona.a_mem.seq_thought
-            if "idle" not in i.embedding_key
-        ]
-        nodes = sorted(nodes, key=lambda x: x[0])
-        nodes = [i for created, i in nodes]
-        print(f"Nodes: {nodes}")
-        # Calculating the component dictionaries and normalizing them.
-        recency_out = extract_recency(persona, nodes)
-        recency_out = normalize_dict_floats(recency_out, 0, 1)
-        importance_out = extract_importance(persona, nodes)
-        importance_out = normalize_dict_floats(importance_out, 0, 1)
-        relevance_out = extract_relevance(persona, nodes, focal_pt)
-        relevance_out = normalize_dict_floats(relevance_out, 0, 1)
-
-        # Computing the final scores that combines the component values.
-        # Note to self: test out different weights. [1, 1, 1] tends to work
-        # decently, but in the future, these weights should likely be learned,
-        # perhaps through an RL-like process.
-        # gw = [1, 1, 1]
-        # gw = [1, 2, 1]
-        gw = [0.5, 3, 2]
-        master_out = dict()
-        for key in recency_out.keys():
-            master_out[key] = (
-                persona.scratch.recency_w * recency_out[key] * gw[0]
-                + persona.scratch.relevance_w * relevance_out[key] * gw[1]
-                + persona.scratch.importance_w * importance_out[key] * gw[2]
-            )
-
-        master_out = top_highest_x_values(master_out, len(master_out.keys()))
-        for key, val in master_out.items():
-            print(persona.a_mem.id_to_node[key].embedding_key, val)
-            print(
-                persona.scratch.recency_w * recency_out[key] * 1,
-                persona.scratch.relevance_w * relevance_out[key] * 1,
-                persona.scratch.importance_w * importance_out[key] * 1,
-            )
-
-        # Extracting the highest x values.
-        # <master_out> has the key of node.id and value of float. Once we get the
-        # highest x values, we want to translate the node.id into nodes and return
-        # the list of nodes.
-        master_out = top_highest_x_values(master_out, n_count)
-        master_nodes = [
-            persona.a_mem.id_to_node[key] for key in list(master_out.keys())
-        ]
-
-        for n in master_nodes:
-            n.last_accessed = persona.scratch.curr_time
-
-        retrieved[focal_pt] = master_nodes
+    static = persona.scratch.importance_w * importance * gw[2]
+    for count, focal_pt in enumerate(focal_points):
+        ranked = np.argsort(arrays.last_accessed[cand], kind="stable")
+        rank = np.empty(len(cand), dtype=np.int64)
+        rank[ranked] = np.arange(len(cand))
+
+        sel = selected[count]
+        master_out = (
+            persona.scratch.recency_w * recency_vals[rank[sel]] * gw[0]
+            + persona.scratch.relevance_w * relevance[count] * gw[1]
+            + static[sel]
+        )
+
+        # Extracting the highest x values, ties going to the node ranked first.
+        top = _top_k(master_out, rank[sel], n_count)
+        master_idx = cand[sel][top]
+        arrays.touch(master_idx, persona.scratch.curr_time)
+        retrieved[focal_pt] = [arrays.nodes[i] for i in master_idx]
 
     return retrieved
+
+
+def _nodes_of_rows(by_row, sorted_rows, rows, sims):
+    """
+    The positions in cand of the nodes whose embedding is one of the store
+    <rows>, and the similarity of each, from <sims>. Nodes can share an
+    embedding row. <by_row> orders cand by row; <sorted_rows> are the rows of
+    cand in that order.
+    """
+    lo = np.searchsorted(sorted_rows, rows, side="left")
+    counts = np.searchsorted(sorted_rows, rows, side="right") - lo
+    starts = np.repeat(lo - (np.cumsum(counts) - counts), counts)
+    positions = by_row[starts + np.arange(counts.sum())]
+    return positions, np.repeat(sims, counts)
+
+
+def _normalize(vals, axis=None):
+    """
+    Vectorised normalize_dict_floats to the range [0, 1]: a constant input
+    maps to 0.5.
+    """
+    min_val = vals.min(axis=axis, keepdims=True)
+    range_val = vals.max(axis=axis, keepdims=True) - min_val
+    safe = np.where(range_val == 0, 1, range_val)
+    return np.where(range_val == 0, 0.5, (vals - min_val) / safe)
+
+
+def _top_k(scores, rank, k):
+    """
+    Indices of the k highest scores in descending order, ties broken by the
+    lower rank, as a stable sort by score over the nodes in rank order would.
+    """
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if k < len(scores):
+        threshold = np.partition(scores, len(scores) - k)[len(scores) - k]
+        above = np.flatnonzero(scores > threshold)
+        tied = np.flatnonzero(scores == threshold)
+        tied = tied[np.argsort(rank[tied], kind="stable")][: k - len(above)]
+        top = np.concatenate([above, tied])
+    else:
+        top = np.arange(len(scores))
+    return top[np.lexsort((rank[top], -scores[top]))]
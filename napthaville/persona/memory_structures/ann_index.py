@@ -0,0 +1,187 @@
+"""
+File: ann_index.py
+Description: An inverted-file (IVF) approximate nearest-neighbour index over
+the rows of an <EmbeddingStore>, in pure NumPy. The unit-length embeddings are
+clustered with spherical k-means; a query only scores the rows of the
+<n_probe> clusters whose centroids are closest to it, and only those rows are
+candidates for it. Below <exact_threshold> rows the index is not used and
+every row is scored.
+"""
+
+import os
+
+import numpy as np
+
+ANN_INDEX_FILE = "ann_index.npz"
+# Memories with fewer embeddings than this are always searched exactly.
+ANN_EXACT_THRESHOLD = int(os.getenv("ANN_EXACT_THRESHOLD", "20000"))
+# The recall vs latency knob: how many clusters a query looks at.
+ANN_N_PROBE = int(os.getenv("ANN_N_PROBE", "16"))
+ANN_KMEANS_ITERS = 10
+ANN_TRAIN_SAMPLE_PER_LIST = 32
+
+
+class IVFIndex:
+    def __init__(self, n_probe=ANN_N_PROBE, exact_threshold=ANN_EXACT_THRESHOLD):
+        """
+        INPUT:
+          n_probe: The number of clusters each query scores. Higher is slower
+                   and closer to the exact result.
+          exact_threshold: The store size below which queries are exact.
+        """
+        self.n_probe = n_probe
+        self.exact_threshold = exact_threshold
+        # <centroids> is None until the index is trained. <assign> maps a row
+        # of the store to its cluster; <lists> holds the rows of each cluster.
+        # A row that moved to another cluster (its embedding was overwritten)
+        # stays in its old list and is filtered out with <assign> on search.
+        self.centroids = None
+        self.assign = np.zeros(0, dtype=np.int32)
+        self.lists = []
+        self.trained_size = 0
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    def _assign(self, unit):
+        assign = np.empty(len(unit), dtype=np.int32)
+        for start in range(0, len(unit), 8192):
+            sims = unit[start : start + 8192] @ self.centroids.T
+            assign[start : start + 8192] = sims.argmax(axis=1)
+        return assign
+
+    def train(self, store, seed=0):
+        """
+        Clusters every row of <store> with spherical k-means on a sample and
+        assigns all rows to their nearest centroid.
+        """
+        unit = store.unit
+        n = len(unit)
+        n_lists = max(1, int(np.sqrt(n)))
+        rng = np.random.default_rng(seed)
+        sample_size = min(n, n_lists * ANN_TRAIN_SAMPLE_PER_LIST)
+        sample = unit[rng.choice(n, sample_size, replace=False)]
+
+        centroids = sample[rng.choice(sample_size, n_lists, replace=False)].copy()
+        for _ in range(ANN_KMEANS_ITERS):
+            labels = (sample @ centroids.T).argmax(axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            norms = np.linalg.norm(sums, axis=1)
+            # Empty clusters are reseeded with a random sample row.
+            empty = norms == 0
+            sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+            norms[empty] = 1
+            centroids = sums / norms[:, None]
+        self.centroids = centroids.astype(np.float32)
+
+        self.assign = np.zeros(max(n, 64), dtype=np.int32)
+        self.assign[:n] = self._assign(unit)
+        self._rebuild_lists(n)
+        self.trained_size = n
+
+    def _rebuild_lists(self, n):
+        n_lists = len(self.centroids)
+        order = np.argsort(self.assign[:n], kind="stable")
+        bounds = np.searchsorted(self.assign[:n][order], np.arange(n_lists + 1))
+        self.lists = [order[bounds[i] : bounds[i + 1]].tolist() for i in range(n_lists)]
+
+    def add(self, store, rows):
+        """
+        Adds or updates the given rows of <store>. The index is trained once
+        the store reaches the exact threshold and retrained whenever it has
+        doubled since, so the clusters follow the data.
+        """
+        if not self.trained:
+            if store.size >= self.exact_threshold:
+                self.train(store)
+            return
+        if store.size >= 2 * self.trained_size:
+            self.train(store)
+            return
+
+        if store.size > len(self.assign):
+            assign = np.zeros(max(store.size, 2 * len(self.assign)), dtype=np.int32)
+            assign[: len(self.assign)] = self.assign
+            self.assign = assign
+        rows = np.asarray(rows, dtype=np.int64)
+        clusters = self._assign(store.unit[rows])
+        for row, cluster in zip(rows.tolist(), clusters.tolist()):
+            self.assign[row] = cluster
+            self.lists[cluster].append(row)
+
+    def covers(self, store):
+        """
+        Whether queries over <store> go through the index, rather than
+        scoring every row.
+        """
+        return self.trained and store.size >= self.exact_threshold
+
+    def search(self, store, queries):
+        """
+        Scores each query against the rows of the <n_probe> clusters closest
+        to it only.
+
+        INPUT:
+          store: The <EmbeddingStore> the index was built over.
+          queries: A list of query vectors.
+        OUTPUT:
+          A list with, for each query, the sorted rows of the store it was
+          scored against and their cosine similarity to it, as a pair of
+          arrays.
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(len(queries), -1)
+        norms = np.linalg.norm(queries, axis=1)
+        queries = queries / np.where(norms > 0, norms, 1)[:, None]
+        n_probe = min(self.n_probe, len(self.centroids))
+        probes = np.argpartition(
+            -(queries @ self.centroids.T), n_probe - 1, axis=1
+        )[:, :n_probe]
+
+        unit = store.unit
+        results = []
+        for q, query in enumerate(queries):
+            rows = np.concatenate(
+                [np.asarray(self.lists[c], dtype=np.int64) for c in probes[q]]
+            )
+            rows = np.unique(rows[np.isin(self.assign[rows], probes[q])])
+            results.append((rows, unit[rows] @ query))
+        return results
+
+    def save(self, path, store):
+        if not self.trained:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        with open(path, "wb") as outfile:
+            np.savez(
+                outfile,
+                centroids=self.centroids,
+                assign=self.assign[: store.size],
+                trained_size=self.trained_size,
+            )
+
+    @classmethod
+    def load(cls, path, store, **kwargs):
+        """
+        Loads the index saved at <path> for <store>. Rows of the store the
+        saved index does not cover are added to it; without a saved index,
+        one is trained if the store is past the exact threshold.
+        """
+        index = cls(**kwargs)
+        if not os.path.exists(path):
+            if store.size >= index.exact_threshold:
+                index.train(store)
+            return index
+
+        data = np.load(path)
+        index.centroids = data["centroids"]
+        index.trained_size = int(data["trained_size"])
+        saved = data["assign"][: store.size]
+        index.assign = np.zeros(max(store.size, 64), dtype=np.int32)
+        index.assign[: len(saved)] = saved
+        index._rebuild_lists(len(saved))
+        if len(saved) < store.size:
+            index.add(store, np.arange(len(saved), store.size))
+        return index
@@ -8,9 +8,22 @@ Note (May 1, 2023) -- this class is the Memory Stream module in the generative
 agents paper.
 """
 
+import os
 import json
 from datetime import datetime
 
+import numpy as np
+
+from napthaville.persona.memory_structures.embedding_store import EmbeddingStore
+from napthaville.persona.memory_structures.ann_index import ANN_INDEX_FILE, IVFIndex
+
+EPOCH = datetime(1970, 1, 1)
+JOURNAL_FILE = "journal.jsonl"
+# The journal is compacted into nodes.json once it has more entries than the
+# snapshot has nodes (and at least this many), so a save costs O(1) amortised
+# per change.
+JOURNAL_COMPACT_MIN = 1000
+
 
 class ConceptNode:
     def __init__(
@@ -119,6 +132,81 @@ class ConceptNode:
         return cls(**data)
 
 
+class NodeArrays:
+    """
+    Parallel arrays over the event and thought nodes, in insertion order, that
+    hold what new_retrieve scores: the embedding row of each node in the
+    <EmbeddingStore>, its poignancy and the time it was last accessed (in
+    seconds since EPOCH). <kind_index> is the node's position in its own
+    sequence (type_count - 1) and <is_thought> tells the two sequences apart,
+    which is enough to recover the seq_event + seq_thought order.
+    """
+
+    def __init__(self):
+        # <touched> holds the indices whose last accessed time changed since
+        # the memory was last saved.
+        self.nodes = []
+        self.node_index = dict()
+        self.touched = set()
+        self.size = 0
+        self._capacity = 0
+        self.rows = np.zeros(0, dtype=np.int64)
+        self.poignancy = np.zeros(0, dtype=np.float64)
+        self.last_accessed = np.zeros(0, dtype=np.float64)
+        self.kind_index = np.zeros(0, dtype=np.int64)
+        self.is_thought = np.zeros(0, dtype=bool)
+        self.is_idle = np.zeros(0, dtype=bool)
+
+    def _grow(self):
+        capacity = max(64, 2 * self._capacity)
+        for name in [
+            "rows",
+            "poignancy",
+            "last_accessed",
+            "kind_index",
+            "is_thought",
+            "is_idle",
+        ]:
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[: self.size] = old[: self.size]
+            setattr(self, name, new)
+        self._capacity = capacity
+
+    def append(self, node, row, is_thought):
+        if self.size == self._capacity:
+            self._grow()
+        i = self.size
+        self.nodes.append(node)
+        self.node_index[node.node_id] = i
+        self.rows[i] = row
+        self.poignancy[i] = node.poignancy
+        self.last_accessed[i] = (node.last_accessed - EPOCH).total_seconds()
+        self.kind_index[i] = node.type_count - 1
+        self.is_thought[i] = is_thought
+        self.is_idle[i] = "idle" in node.embedding_key
+        self.size += 1
+
+    def touch(self, indices, curr_time):
+        """
+        Sets the last accessed time of the nodes at <indices> to curr_time.
+        """
+        self.last_accessed[indices] = (curr_time - EPOCH).total_seconds()
+        for i in indices:
+            self.nodes[i].last_accessed = curr_time
+        self.touched.update(int(i) for i in indices)
+
+    def restore(self, node, last_accessed):
+        """
+        Sets the last accessed time of a node being loaded. Unlike touch, it
+        is not a change to save. Takes nodes of any type.
+        """
+        node.last_accessed = last_accessed
+        i = self.node_index.get(node.node_id)
+        if i is not None:
+            self.last_accessed[i] = (last_accessed - EPOCH).total_seconds()
+
+
 class AssociativeMemory:
     def __init__(self, f_saved):
         self.id_to_node = dict()
@@ -134,122 +222,343 @@ class AssociativeMemory:
         self.kw_strength_event = dict()
         self.kw_strength_thought = dict()
 
-        self.embeddings = json.load(open(f_saved + "/embeddings.json"))
+        # The embedding store and its ANN index are opened the first time
+        # they are used (see <embeddings>), so loading the nodes does not
+        # read any embedding. Until then the rows of the nodes are -1.
+        self.f_saved = f_saved
+        self._embeddings = None
+        self._ann_index = None
+        # <embeddings_changed> is True once an embedding or the ANN index
+        # changed since the memory was loaded or last saved.
+        self.embeddings_changed = False
+        self.node_arrays = NodeArrays()
 
         nodes_load = json.load(open(f_saved + "/nodes.json"))
+        self.snapshot_nodes = len(nodes_load)
         for count in range(len(nodes_load.keys())):
             node_id = f"node_{str(count+1)}"
-            node_details = nodes_load[node_id]
-
-            node_count = node_details["node_count"]
-            type_count = node_details["type_count"]
-            node_type = node_details["type"]
-            depth = node_details["depth"]
-
-            created = datetime.strptime(node_details["created"], "%Y-%m-%d %H:%M:%S")
-            expiration = None
-            if node_details["expiration"]:
-                expiration = datetime.strptime(
-                    node_details["expiration"], "%Y-%m-%d %H:%M:%S"
-                )
-
-            s = node_details["subject"]
-            p = node_details["predicate"]
-            o = node_details["object"]
-
-            description = node_details["description"]
-            embedding_pair = (
-                node_details["embedding_key"],
-                self.embeddings[node_details["embedding_key"]],
-            )
-            poignancy = node_details["poignancy"]
-            keywords = set(node_details["keywords"])
-            filling = node_details["filling"]
-
-            if node_type == "event":
-                self.add_event(
-                    created,
-                    expiration,
-                    s,
-                    p,
-                    o,
-                    description,
-                    keywords,
-                    poignancy,
-                    embedding_pair,
-                    filling,
-                )
-            elif node_type == "chat":
-                self.add_chat(
-                    created,
-                    expiration,
-                    s,
-                    p,
-                    o,
-                    description,
-                    keywords,
-                    poignancy,
-                    embedding_pair,
-                    filling,
-                )
-            elif node_type == "thought":
-                self.add_thought(
-                    created,
-                    expiration,
-                    s,
-                    p,
-                    o,
-                    description,
-                    keywords,
-                    poignancy,
-                    embedding_pair,
-                    filling,
-                )
+            self.load_node(nodes_load[node_id])
 
         kw_strength_load = json.load(open(f_saved + "/kw_strength.json"))
+        # kw_strength.json is written after nodes.json and records how many
+        # nodes it counts. A compaction cut short between the two leaves
+        # strengths that miss the newest nodes of the snapshot.
+        counted = kw_strength_load.get("node_count", self.snapshot_nodes)
+        missed = [
+            self.id_to_node[f"node_{str(count)}"]
+            for count in range(counted + 1, self.snapshot_nodes + 1)
+        ]
         if kw_strength_load["kw_strength_event"]:
             self.kw_strength_event = kw_strength_load["kw_strength_event"]
+            for node in missed:
+                if node.type == "event":
+                    self.strengthen_keywords(self.kw_strength_event, node)
         if kw_strength_load["kw_strength_thought"]:
             self.kw_strength_thought = kw_strength_load["kw_strength_thought"]
+            for node in missed:
+                if node.type == "thought":
+                    self.strengthen_keywords(self.kw_strength_thought, node)
+
+        # The journal holds what changed since the nodes.json snapshot. Adding
+        # its nodes also brings the keyword strengths up to date.
+        self.journal_size = self.replay_journal(f_saved + "/" + JOURNAL_FILE)
+        self.journaled_nodes = len(self.id_to_node)
+
+    @property
+    def embeddings(self):
+        """
+        The <EmbeddingStore> of the memory, opened on first use.
+        """
+        if self._embeddings is None:
+            self.load_embeddings()
+        return self._embeddings
+
+    @embeddings.setter
+    def embeddings(self, embeddings):
+        # The rows of the nodes are looked up in the store loaded first.
+        if self._embeddings is None:
+            self.load_embeddings()
+        self._embeddings = embeddings
+
+    @property
+    def ann_index(self):
+        """
+        The <IVFIndex> over the embeddings, loaded with them.
+        """
+        if self._embeddings is None:
+            self.load_embeddings()
+        return self._ann_index
+
+    @ann_index.setter
+    def ann_index(self, ann_index):
+        if self._embeddings is None:
+            self.load_embeddings()
+        self._ann_index = ann_index
+
+    def load_embeddings(self):
+        """
+        Opens the embedding store the memory was loaded with and its ANN
+        index, and looks up the row of every node in it.
+        """
+        embeddings = EmbeddingStore.load(self.f_saved)
+        arrays = self.node_arrays
+        arrays.rows[: arrays.size] = [
+            embeddings.row(node.embedding_key) for node in arrays.nodes
+        ]
+        f_ann_index = self.f_saved + "/" + ANN_INDEX_FILE
+        ann_index = IVFIndex.load(f_ann_index, embeddings)
+        # An index trained on load is saved, so it is not trained again.
+        if ann_index.trained and not os.path.exists(f_ann_index):
+            self.embeddings_changed = True
+        self._embeddings, self._ann_index = embeddings, ann_index
+
+    def load_node(self, node_details):
+        node_type = node_details["type"]
+        depth = node_details["depth"]
+
+        created = datetime.strptime(node_details["created"], "%Y-%m-%d %H:%M:%S")
+        expiration = None
+        if node_details["expiration"]:
+            expiration = datetime.strptime(
+                node_details["expiration"], "%Y-%m-%d %H:%M:%S"
+            )
+
+        s = node_details["subject"]
+        p = node_details["predicate"]
+        o = node_details["object"]
+
+        description = node_details["description"]
+        # The embedding is already in the store.
+        embedding_pair = (node_details["embedding_key"], None)
+        poignancy = node_details["poignancy"]
+        keywords = set(node_details["keywords"])
+        filling = node_details["filling"]
+
+        if node_type == "event":
+            add = self.add_event
+        elif node_type == "chat":
+            add = self.add_chat
+        elif node_type == "thought":
+            add = self.add_thought
+        else:
+            return None
+        node = add(
+            created,
+            expiration,
+            s,
+            p,
+            o,
+            description,
+            keywords,
+            poignancy,
+            embedding_pair,
+            filling,
+        )
+        if node_details.get("last_accessed"):
+            last_accessed = datetime.strptime(
+                node_details["last_accessed"], "%Y-%m-%d %H:%M:%S"
+            )
+            self.node_arrays.restore(node, last_accessed)
+        return node
+
+    def replay_journal(self, f_journal):
+        """
+        Applies the entries of the journal at f_journal.
+
+        INPUT:
+          f_journal: The path of the journal. It does not have to exist.
+        OUTPUT:
+          The number of entries applied.
+        """
+        if not os.path.exists(f_journal):
+            return 0
+        count = 0
+        offset = 0
+        with open(f_journal, "rb") as infile:
+            for line in infile:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A save that was cut short leaves a partial last line. It
+                    # is cut off so the next entries are appended after the
+                    # last complete one.
+                    os.truncate(f_journal, offset)
+                    break
+                offset += len(line)
+                # A compaction cut short before it removed the journal leaves
+                # entries the snapshot already holds. Their nodes are skipped,
+                # and as access times only move forward, an older one is too.
+                if entry["op"] == "node":
+                    if entry["node"]["node_count"] > len(self.id_to_node):
+                        self.load_node(entry["node"])
+                elif entry["op"] == "accessed":
+                    last_accessed = datetime.strptime(
+                        entry["last_accessed"], "%Y-%m-%d %H:%M:%S"
+                    )
+                    for node_id in entry["node_ids"]:
+                        node = self.id_to_node[node_id]
+                        if last_accessed > node.last_accessed:
+                            self.node_arrays.restore(node, last_accessed)
+                count += 1
+        return count
+
+    def node_details(self, node):
+        r = dict()
+        r["node_count"] = node.node_count
+        r["type_count"] = node.type_count
+        r["type"] = node.type
+        r["depth"] = node.depth
+
+        r["created"] = node.created.strftime("%Y-%m-%d %H:%M:%S")
+        r["expiration"] = None
+        if node.expiration:
+            r["expiration"] = node.expiration.strftime("%Y-%m-%d %H:%M:%S")
+        r["last_accessed"] = node.last_accessed.strftime("%Y-%m-%d %H:%M:%S")
+
+        r["subject"] = node.subject
+        r["predicate"] = node.predicate
+        r["object"] = node.object
+
+        r["description"] = node.description
+        r["embedding_key"] = node.embedding_key
+        r["poignancy"] = node.poignancy
+        r["keywords"] = list(node.keywords)
+        r["filling"] = node.filling
+        return r
 
     def save(self, out_json):
+        """
+        Saves the memory to the folder out_json. Saving to the folder it was
+        loaded from appends the nodes added and the access times changed since
+        the last save to the journal there, and compacts the journal into a
+        new snapshot once it has more entries than the snapshot has nodes. Any
+        other folder gets a full snapshot.
+        """
+        same_folder = os.path.exists(self.f_saved) and os.path.samefile(
+            self.f_saved, out_json
+        )
+        if same_folder and not self.pending_entries() and not self.embeddings_changed:
+            return
+
+        os.makedirs(out_json, exist_ok=True)
+        # The embeddings go first: journal entries refer to them by key. They
+        # only need writing if they were loaded; otherwise the folder already
+        # holds them.
+        if not same_folder or self._embeddings is not None:
+            self.embeddings.save(out_json)
+
+        if not same_folder:
+            self.write_snapshot(out_json)
+        elif self.journal_size + self.pending_entries() > max(
+            JOURNAL_COMPACT_MIN, self.snapshot_nodes
+        ):
+            self.compact()
+        else:
+            self.append_journal()
+
+        if not same_folder or self._embeddings is not None:
+            self.ann_index.save(out_json + "/" + ANN_INDEX_FILE, self.embeddings)
+        if same_folder:
+            self.embeddings_changed = False
+
+    def pending_entries(self):
+        return len(self.id_to_node) - self.journaled_nodes + len(
+            self.node_arrays.touched
+        )
+
+    def append_journal(self):
+        entries = []
+        for count in range(self.journaled_nodes + 1, len(self.id_to_node) + 1):
+            node = self.id_to_node[f"node_{str(count)}"]
+            entries += [{"op": "node", "node": self.node_details(node)}]
+
+        accessed = dict()
+        for i in sorted(self.node_arrays.touched):
+            node = self.node_arrays.nodes[i]
+            # Nodes added since the last save already carry their access time.
+            if node.node_count > self.journaled_nodes:
+                continue
+            last_accessed = node.last_accessed.strftime("%Y-%m-%d %H:%M:%S")
+            accessed.setdefault(last_accessed, []).append(node.node_id)
+        for last_accessed, node_ids in accessed.items():
+            entries += [
+                {"op": "accessed", "last_accessed": last_accessed, "node_ids": node_ids}
+            ]
+
+        if entries:
+            with open(self.f_saved + "/" + JOURNAL_FILE, "a") as outfile:
+                outfile.write("".join(json.dumps(entry) + "\n" for entry in entries))
+        self.journal_size += len(entries)
+        self.journaled_nodes = len(self.id_to_node)
+        self.node_arrays.touched.clear()
+
+    def compact(self):
+        """
+        Folds the journal into a new nodes.json and kw_strength.json snapshot
+        in the folder the memory was loaded from.
+        """
+        self.write_snapshot(self.f_saved)
+        self.snapshot_nodes = len(self.id_to_node)
+        self.journal_size = 0
+        self.journaled_nodes = len(self.id_to_node)
+        self.node_arrays.touched.clear()
+
+    def write_snapshot(self, out_json):
+        """
+        Writes nodes.json, then kw_strength.json, then removes the journal.
+        Each file is replaced whole, and loading copes with a crash between
+        any two of the steps (see __init__ and replay_journal).
+        """
         r = dict()
         for count in range(len(self.id_to_node.keys()), 0, -1):
             node_id = f"node_{str(count)}"
-            node = self.id_to_node[node_id]
-
-            r[node_id] = dict()
-            r[node_id]["node_count"] = node.node_count
-            r[node_id]["type_count"] = node.type_count
-            r[node_id]["type"] = node.type
-            r[node_id]["depth"] = node.depth
-
-            r[node_id]["created"] = node.created.strftime("%Y-%m-%d %H:%M:%S")
-            r[node_id]["expiration"] = None
-            if node.expiration:
-                r[node_id]["expiration"] = node.expiration.strftime("%Y-%m-%d %H:%M:%S")
-
-            r[node_id]["subject"] = node.subject
-            r[node_id]["predicate"] = node.predicate
-            r[node_id]["object"] = node.object
-
-            r[node_id]["description"] = node.description
-            r[node_id]["embedding_key"] = node.embedding_key
-            r[node_id]["poignancy"] = node.poignancy
-            r[node_id]["keywords"] = list(node.keywords)
-            r[node_id]["filling"] = node.filling
-
-        with open(out_json + "/nodes.json", "w") as outfile:
+            r[node_id] = self.node_details(self.id_to_node[node_id])
+
+        with open(out_json + "/nodes.json.tmp", "w") as outfile:
             json.dump(r, outfile)
+        os.replace(out_json + "/nodes.json.tmp", out_json + "/nodes.json")
 
+        # The keyword strengths at the time of the snapshot; the journal
+        # replays on top of them.
         r = dict()
         r["kw_strength_event"] = self.kw_strength_event
         r["kw_strength_thought"] = self.kw_strength_thought
-        with open(out_json + "/kw_strength.json", "w") as outfile:
+        r["node_count"] = len(self.id_to_node)
+        with open(out_json + "/kw_strength.json.tmp", "w") as outfile:
             json.dump(r, outfile)
-
-        with open(out_json + "/embeddings.json", "w") as outfile:
-            json.dump(self.embeddings, outfile)
+        os.replace(out_json + "/kw_strength.json.tmp", out_json + "/kw_strength.json")
+
+        if os.path.exists(out_json + "/" + JOURNAL_FILE):
+            os.remove(out_json + "/" + JOURNAL_FILE)
+
+    def set_embedding(self, embedding_key, embedding):
+        """
+        Stores the embedding under embedding_key and keeps the ANN index up to
+        date. Returns its row in the embedding store. An embedding of None
+        refers to the one already stored under embedding_key.
+        """
+        if embedding is None:
+            # The row is looked up when the store is opened.
+            if self._embeddings is None:
+                return -1
+            return self.embeddings.row(embedding_key)
+        row = self.embeddings.set_many([embedding_key], [embedding])[0]
+        self.ann_index.add(self.embeddings, [row])
+        self.embeddings_changed = True
+        return row
+
+    def strengthen_keywords(self, kw_strength, node):
+        """
+        Counts the keywords of an event or thought node in kw_strength, the
+        strengths of its type. Idle nodes do not count.
+        """
+        if f"{node.predicate} {node.object}" != "is idle":
+            for kw in node.keywords:
+                kw = kw.lower()
+                if kw in kw_strength:
+                    kw_strength[kw] += 1
+                else:
+                    kw_strength[kw] = 1
 
     def add_event(
         self,
@@ -309,14 +618,10 @@ class AssociativeMemory:
         self.id_to_node[node_id] = node
 
         # Adding in the kw_strength
-        if f"{p} {o}" != "is idle":
-            for kw in keywords:
-                if kw in self.kw_strength_event:
-                    self.kw_strength_event[kw] += 1
-                else:
-                    self.kw_strength_event[kw] = 1
+        self.strengthen_keywords(self.kw_strength_event, node)
 
-        self.embeddings[embedding_pair[0]] = embedding_pair[1]
+        row = self.set_embedding(*embedding_pair)
+        self.node_arrays.append(node, row, is_thought=False)
 
         return node
 
@@ -375,14 +680,10 @@ class AssociativeMemory:
         self.id_to_node[node_id] = node
 
         # Adding in the kw_strength
-        if f"{p} {o}" != "is idle":
-            for kw in keywords:
-                if kw in self.kw_strength_thought:
-                    self.kw_strength_thought[kw] += 1
-                else:
-                    self.kw_strength_thought[kw] = 1
+        self.strengthen_keywords(self.kw_strength_thought, node)
 
-        self.embeddings[embedding_pair[0]] = embedding_pair[1]
+        row = self.set_embedding(*embedding_pair)
+        self.node_arrays.append(node, row, is_thought=True)
 
         return node
 
@@ -435,7 +736,7 @@ class AssociativeMemory:
                 self.kw_to_chat[kw] = [node]
         self.id_to_node[node_id] = node
 
-        self.embeddings[embedding_pair[0]] = embedding_pair[1]
+        self.set_embedding(*embedding_pair)
 
         return node
 
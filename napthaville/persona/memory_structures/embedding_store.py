@@ -0,0 +1,286 @@
+"""
+File: embedding_store.py
+Description: Keeps the embeddings of a persona's associative memory in one
+contiguous float32 matrix with unit-length rows, so that the relevance of
+every memory to a set of focal points is a single matrix multiply.
+
+On disk the matrix is a raw float32 file next to a small JSON index of the
+keys and the row norms. The file is memory-mapped copy-on-write on load, so
+changes only reach the disk on save, where new rows are appended to it. Run
+this module on persona folders to migrate their embeddings.json; the original
+is kept as embeddings.json.bak once the new store has been checked against it:
+
+  python -m napthaville.persona.memory_structures.embedding_store <folder>...
+"""
+
+import os
+import sys
+import json
+import logging
+from collections.abc import Mapping
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+EMBEDDINGS_FILE = "embeddings.f32"
+EMBEDDINGS_NORMS_FILE = "embeddings_norms.npy"
+EMBEDDINGS_INDEX_FILE = "embeddings_index.json"
+LEGACY_EMBEDDINGS_FILE = "embeddings.json"
+
+
+class EmbeddingStore(Mapping):
+    def __init__(self, embeddings=None, dim=None):
+        """
+        INPUT:
+          embeddings: An optional {embedding_key: vector} dictionary, e.g.,
+                      the content of embeddings.json.
+          dim: The embedding size. Taken from the first vector if not given.
+        """
+        # <key_to_row> maps an embedding key to its row. <unit> holds the
+        # L2-normalised vectors and <norms> their original lengths, so the
+        # original vector of row i is unit[i] * norms[i]. Both are allocated
+        # with spare capacity; only the first <size> rows are in use.
+        # <folder> is the folder the store was opened from or last saved to,
+        # and the first <saved_rows> rows of its EMBEDDINGS_FILE match <unit>;
+        # <overwritten> is True once one of those rows has changed since.
+        self.key_to_row = dict()
+        self.keys = []
+        self.dim = dim
+        self.size = 0
+        self.folder = None
+        self.saved_rows = 0
+        self.overwritten = False
+        self._unit = None
+        self._norms = None
+        if embeddings:
+            self.update(embeddings)
+
+    @classmethod
+    def open(cls, folder):
+        """
+        Memory-maps the embedding store saved in <folder>. The map is
+        copy-on-write: rows set later are only written to the file by save().
+        """
+        index = json.load(open(f"{folder}/{EMBEDDINGS_INDEX_FILE}"))
+        store = cls(dim=index["dim"])
+        store.keys = index["keys"]
+        store.key_to_row = {key: row for row, key in enumerate(store.keys)}
+        store.size = len(store.keys)
+        if store.dim is None:
+            return store
+
+        store.folder = folder
+        store.saved_rows = store.size
+        store._norms = np.load(f"{folder}/{EMBEDDINGS_NORMS_FILE}")
+        if store.size:
+            # Older stores may hold spare zero rows at the end of the file, so
+            # only the rows in use are mapped.
+            store._unit = np.memmap(
+                f"{folder}/{EMBEDDINGS_FILE}",
+                dtype=np.float32,
+                mode="c",
+                shape=(store.size, store.dim),
+            )
+        return store
+
+    @classmethod
+    def load(cls, folder):
+        """
+        Opens the binary store in <folder>, or reads the legacy embeddings.json
+        if the folder has not been migrated yet.
+        """
+        if os.path.exists(f"{folder}/{EMBEDDINGS_INDEX_FILE}"):
+            return cls.open(folder)
+        return cls(json.load(open(f"{folder}/{LEGACY_EMBEDDINGS_FILE}")))
+
+    def _reserve(self, n):
+        # Growing a mapped store copies it to memory; the new rows are
+        # appended to the file on save.
+        if self._unit is None:
+            self._unit = np.zeros((max(n, 64), self.dim), dtype=np.float32)
+            self._norms = np.zeros(max(n, 64), dtype=np.float32)
+        elif n > len(self._unit):
+            capacity = max(n, 2 * len(self._unit))
+            unit = np.zeros((capacity, self.dim), dtype=np.float32)
+            unit[: self.size] = self._unit[: self.size]
+            norms = np.zeros(capacity, dtype=np.float32)
+            norms[: self.size] = self._norms[: self.size]
+            self._unit, self._norms = unit, norms
+
+    def update(self, embeddings):
+        keys = list(embeddings.keys())
+        if not keys:
+            return
+        vectors = np.asarray([embeddings[key] for key in keys], dtype=np.float32)
+        self.set_many(keys, vectors)
+
+    def set_many(self, keys, vectors):
+        """
+        Adds or overwrites many embeddings at once.
+
+        INPUT:
+          keys: A list of embedding keys.
+          vectors: A len(keys) x dim array-like of embeddings.
+        OUTPUT:
+          rows: The row of each key.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(keys), -1)
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        rows = []
+        for key in keys:
+            if key not in self.key_to_row:
+                self.key_to_row[key] = len(self.keys)
+                self.keys.append(key)
+            rows.append(self.key_to_row[key])
+        if rows and min(rows) < self.saved_rows:
+            self.overwritten = True
+        self._reserve(len(self.keys))
+        self.size = len(self.keys)
+
+        norms = np.linalg.norm(vectors, axis=1)
+        safe = np.where(norms > 0, norms, 1).astype(np.float32)
+        self._unit[rows] = vectors / safe[:, None]
+        self._norms[rows] = norms
+        return rows
+
+    def __setitem__(self, key, vector):
+        self.set_many([key], [vector])
+
+    def __getitem__(self, key):
+        row = self.key_to_row[key]
+        return (self._unit[row] * self._norms[row]).tolist()
+
+    def __contains__(self, key):
+        return key in self.key_to_row
+
+    def __iter__(self):
+        return iter(self.keys)
+
+    def __len__(self):
+        return self.size
+
+    def row(self, key):
+        return self.key_to_row[key]
+
+    @property
+    def unit(self):
+        """
+        The size x dim matrix of unit-length embeddings.
+        """
+        if self._unit is None:
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        return self._unit[: self.size]
+
+    def cosine(self, queries):
+        """
+        Cosine similarity of every stored embedding to each query.
+
+        INPUT:
+          queries: A list of query vectors (e.g., focal point embeddings).
+        OUTPUT:
+          A len(queries) x size float32 matrix.
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(len(queries), -1)
+        norms = np.linalg.norm(queries, axis=1)
+        queries = queries / np.where(norms > 0, norms, 1)[:, None]
+        return queries @ self.unit.T
+
+    def save(self, folder):
+        """
+        Saves the store to <folder>. If the store was opened from or last
+        saved to that folder and none of the saved rows changed, only the new
+        rows are appended to the matrix file.
+        """
+        os.makedirs(folder, exist_ok=True)
+        same_folder = self.folder is not None and os.path.samefile(self.folder, folder)
+        if self.dim is not None:
+            path = f"{folder}/{EMBEDDINGS_FILE}"
+            if same_folder and not self.overwritten:
+                # The file is never truncated below <saved_rows>, which may be
+                # mapped.
+                with open(path, "r+b") as outfile:
+                    outfile.seek(self.saved_rows * self.dim * 4)
+                    outfile.write(self.unit[self.saved_rows :].tobytes())
+                    outfile.truncate()
+            else:
+                # Written to a temporary file first, as a store may map the
+                # file it replaces.
+                self.unit.tofile(path + ".tmp")
+                os.replace(path + ".tmp", path)
+
+            with open(f"{folder}/{EMBEDDINGS_NORMS_FILE}.tmp", "wb") as outfile:
+                np.save(outfile, self._norms[: self.size])
+            os.replace(
+                f"{folder}/{EMBEDDINGS_NORMS_FILE}.tmp",
+                f"{folder}/{EMBEDDINGS_NORMS_FILE}",
+            )
+        with open(f"{folder}/{EMBEDDINGS_INDEX_FILE}.tmp", "w") as outfile:
+            json.dump({"dim": self.dim, "keys": self.keys}, outfile)
+        os.replace(
+            f"{folder}/{EMBEDDINGS_INDEX_FILE}.tmp",
+            f"{folder}/{EMBEDDINGS_INDEX_FILE}",
+        )
+
+        self.folder = folder
+        self.saved_rows = self.size
+        self.overwritten = False
+
+    def to_dict(self):
+        vectors = self.unit * self._norms[: self.size, None]
+        return dict(zip(self.keys, vectors.tolist()))
+
+
+def matches(store, embeddings):
+    """
+    Checks that <store> holds the same keys and, up to float32 precision,
+    the same vectors as the {embedding_key: vector} dictionary <embeddings>.
+    """
+    if sorted(store.keys) != sorted(embeddings.keys()):
+        return False
+    if not store.keys:
+        return True
+    expected = np.asarray([embeddings[key] for key in store.keys], dtype=np.float64)
+    actual = store.unit * store._norms[: store.size, None]
+    return expected.shape == actual.shape and np.allclose(
+        actual, expected, rtol=1e-5, atol=1e-6
+    )
+
+
+def migrate(folder):
+    """
+    Converts every embeddings.json under <folder> to the binary store. The
+    new store is read back and compared with embeddings.json, which is then
+    kept as embeddings.json.bak. If they differ, the binary index is removed
+    again so that the folder keeps loading from embeddings.json.
+
+    INPUT:
+      folder: A persona or simulation folder.
+    OUTPUT:
+      The list of migrated associative memory folders.
+    """
+    migrated = []
+    for root, _, files in os.walk(folder):
+        if LEGACY_EMBEDDINGS_FILE not in files:
+            continue
+        legacy = f"{root}/{LEGACY_EMBEDDINGS_FILE}"
+        embeddings = json.load(open(legacy))
+        EmbeddingStore(embeddings).save(root)
+        if not matches(EmbeddingStore.open(root), embeddings):
+            logger.warning(f"Migrated embeddings in {root} do not match; kept {legacy}")
+            os.remove(f"{root}/{EMBEDDINGS_INDEX_FILE}")
+            continue
+        os.replace(legacy, legacy + ".bak")
+        migrated.append(root)
+    return migrated
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    for folder in sys.argv[1:]:
+        for migrated in migrate(folder):
+            print(f"migrated {migrated}")
@@ -245,6 +245,16 @@ class Scratch:
         OUTPUT:
           None
         """
+        with open(out_json, "w") as outfile:
+            json.dump(self.saved_state(), outfile, indent=2)
+
+    def saved_state(self):
+        """
+        The scratch as <save> writes it.
+
+        OUTPUT:
+          A JSON serializable dictionary.
+        """
         scratch = dict()
         scratch["vision_r"] = self.vision_r
         scratch["att_bandwidth"] = self.att_bandwidth
@@ -315,9 +325,7 @@ class Scratch:
 
         scratch["act_path_set"] = self.act_path_set
         scratch["planned_path"] = self.planned_path
-
-        with open(out_json, "w") as outfile:
-            json.dump(scratch, outfile, indent=2)
+        return scratch
 
     def get_f_daily_schedule_index(self, advance=0):
         """
@@ -9,6 +9,9 @@ the term we used internally back in 2022, taking from our Social Simulacra
 paper.
 """
 
+import os
+import json
+
 from napthaville.persona.memory_structures.spatial_memory import MemoryTree
 from napthaville.persona.memory_structures.associative_memory import AssociativeMemory
 from napthaville.persona.memory_structures.scratch import Scratch
@@ -29,45 +32,128 @@ class Persona:
 
         # PERSONA MEMORY
         # If there is already memory in folder_mem_saved, we load that. Otherwise,
-        # we create new memory instances.
+        # we create new memory instances. Each memory is only loaded the first
+        # time it is used, so a task that only needs the scratch only reads
+        # scratch.json.
         # <s_mem> is the persona's spatial memory.
-        f_s_mem_saved = f"{folder_mem_saved}/bootstrap_memory/spatial_memory.json"
-        self.s_mem = MemoryTree(f_s_mem_saved)
-        # <s_mem> is the persona's associative memory.
-        f_a_mem_saved = f"{folder_mem_saved}/bootstrap_memory/associative_memory"
-        self.a_mem = AssociativeMemory(f_a_mem_saved)
+        # <a_mem> is the persona's associative memory.
         # <scratch> is the persona's scratch (short term memory) space.
-        scratch_saved = f"{folder_mem_saved}/bootstrap_memory/scratch.json"
-        self.scratch = Scratch(scratch_saved)
+        self.folder_mem_saved = folder_mem_saved
+        self._s_mem = None
+        self._a_mem = None
+        self._scratch = None
+        # <saved_states> holds the state of the spatial memory and scratch
+        # when they were loaded or last saved, to tell whether they changed.
+        # The associative memory keeps track of its own changes.
+        self.saved_states = dict()
+
+    @property
+    def s_mem(self):
+        if self._s_mem is None:
+            f_s_mem_saved = (
+                f"{self.folder_mem_saved}/bootstrap_memory/spatial_memory.json"
+            )
+            self._s_mem = MemoryTree(f_s_mem_saved)
+            self.saved_states["s_mem"] = json.dumps(self._s_mem.tree)
+        return self._s_mem
+
+    @s_mem.setter
+    def s_mem(self, s_mem):
+        self._s_mem = s_mem
+        self.saved_states.pop("s_mem", None)
+
+    @property
+    def a_mem(self):
+        if self._a_mem is None:
+            f_a_mem_saved = (
+                f"{self.folder_mem_saved}/bootstrap_memory/associative_memory"
+            )
+            self._a_mem = AssociativeMemory(f_a_mem_saved)
+        return self._a_mem
+
+    @a_mem.setter
+    def a_mem(self, a_mem):
+        self._a_mem = a_mem
+
+    @property
+    def scratch(self):
+        if self._scratch is None:
+            scratch_saved = f"{self.folder_mem_saved}/bootstrap_memory/scratch.json"
+            self._scratch = Scratch(scratch_saved)
+            self.saved_states["scratch"] = json.dumps(self._scratch.saved_state())
+        return self._scratch
+
+    @scratch.setter
+    def scratch(self, scratch):
+        self._scratch = scratch
+        self.saved_states.pop("scratch", None)
 
     def save(self, save_folder):
         """
-        Save persona's current state (i.e., memory).
+        Save persona's current state (i.e., memory). Saving to the folder the
+        persona was loaded from only writes the memories that were loaded and
+        changed since; any other folder gets all of them.
 
         INPUT:
           save_folder: The folder where we wil be saving our persona's state.
         OUTPUT:
           None
         """
+        bootstrap_folder = f"{self.folder_mem_saved}/bootstrap_memory"
+        same_folder = os.path.exists(bootstrap_folder) and os.path.samefile(
+            bootstrap_folder, save_folder
+        )
+
         # Spatial memory contains a tree in a json format.
         # e.g., {"double studio":
         #         {"double studio":
         #           {"bedroom 2":
         #             ["painting", "easel", "closet", "bed"]}}}
-        f_s_mem = f"{save_folder}/spatial_memory.json"
-        self.s_mem.save(f_s_mem)
+        if not same_folder or self._s_mem is not None:
+            f_s_mem = f"{save_folder}/spatial_memory.json"
+            self._save_changed(
+                "s_mem",
+                json.dumps(self.s_mem.tree),
+                f_s_mem,
+                self.s_mem.save,
+                same_folder,
+            )
 
         # Associative memory contains a csv with the following rows:
         # [event.type, event.created, event.expiration, s, p, o]
         # e.g., event,2022-10-23 00:00:00,,Isabella Rodriguez,is,idle
-        f_a_mem = f"{save_folder}/associative_memory"
-        self.a_mem.save(f_a_mem)
+        # It only writes what changed since it was loaded or last saved.
+        if not same_folder or self._a_mem is not None:
+            f_a_mem = f"{save_folder}/associative_memory"
+            self.a_mem.save(f_a_mem)
 
         # Scratch contains non-permanent data associated with the persona. When
         # it is saved, it takes a json form. When we load it, we move the values
         # to Python variables.
-        f_scratch = f"{save_folder}/scratch.json"
-        self.scratch.save(f_scratch)
+        if not same_folder or self._scratch is not None:
+            f_scratch = f"{save_folder}/scratch.json"
+            self._save_changed(
+                "scratch",
+                json.dumps(self.scratch.saved_state()),
+                f_scratch,
+                self.scratch.save,
+                same_folder,
+            )
+
+    def _save_changed(self, key, state, f_saved, save, same_folder):
+        """
+        Calls save(f_saved) unless f_saved already holds <state>, the state
+        the memory <key> was loaded or last saved in.
+        """
+        if (
+            same_folder
+            and state == self.saved_states.get(key)
+            and os.path.exists(f_saved)
+        ):
+            return
+        save(f_saved)
+        if same_folder:
+            self.saved_states[key] = state
 
     def perceive(self, maze):
         """
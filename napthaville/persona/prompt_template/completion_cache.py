@@ -0,0 +1,169 @@
+"""
+File: completion_cache.py
+Description: A cache of LLM completions for the prompts whose answer only
+depends on the prompt text (e.g., the emoji of an action or the sector an
+action happens in). Entries are keyed on (model, final prompt, parameters),
+kept in a SQLite file shared by every process on the machine, expire after
+LLM_CACHE_TTL seconds and are evicted least recently used first past
+LLM_CACHE_SIZE. Prompt functions opt in by name, and hits and misses are
+counted per name.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# An empty LLM_CACHE_PATH turns the cache off.
+LLM_CACHE_PATH = os.getenv(
+    "LLM_CACHE_PATH",
+    os.path.join(
+        os.path.expanduser("~"), ".cache", "napthaville", "completions.sqlite"
+    ),
+)
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "100000"))
+
+
+def completion_key(model, prompt, params=None):
+    """
+    The cache key of a request. <params> are the request parameters that
+    change the answer; the prompt functions' <gpt_param> dictionaries are
+    deliberately left out of the key, because ChatGPT_request sends every
+    prompt with the model's default parameters and never reads them.
+    """
+    key = json.dumps([model, prompt, params or {}], sort_keys=True)
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+class CompletionCache:
+    def __init__(self, path=LLM_CACHE_PATH, ttl=LLM_CACHE_TTL, max_size=LLM_CACHE_SIZE):
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_pid = None
+        self._writes = 0
+        # <counts> maps a prompt function name to its [hits, misses].
+        self.counts = dict()
+
+    def _connect(self):
+        """
+        The SQLite connection of this process, opened on first use. A forked
+        worker opens its own.
+        """
+        if self._db is None or self._db_pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS completions ("
+                "key TEXT PRIMARY KEY, name TEXT, response TEXT, "
+                "created REAL, last_used REAL)"
+            )
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS completions_last_used "
+                "ON completions (last_used)"
+            )
+            db.commit()
+            self._db, self._db_pid = db, os.getpid()
+        return self._db
+
+    def _count(self, name, hit):
+        counts = self.counts.setdefault(name, [0, 0])
+        counts[0 if hit else 1] += 1
+
+    def get(self, name, model, prompt, params=None):
+        """
+        The cached response to prompt, or None.
+
+        INPUT:
+          name: The prompt function asking, for the stats.
+          model, prompt, params: What the request would send.
+        """
+        if not self.path:
+            return None
+        key = completion_key(model, prompt, params)
+        now = time.time()
+        with self._lock:
+            row = None
+            try:
+                db = self._connect()
+                row = db.execute(
+                    "SELECT response FROM completions WHERE key = ? AND created > ?",
+                    (key, now - self.ttl),
+                ).fetchone()
+                if row is not None:
+                    db.execute(
+                        "UPDATE completions SET last_used = ? WHERE key = ?",
+                        (now, key),
+                    )
+                    db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Completion cache read failed: {e}")
+            self._count(name, row is not None)
+            return row[0] if row is not None else None
+
+    def put(self, name, model, prompt, response, params=None):
+        if not self.path:
+            return
+        key = completion_key(model, prompt, params)
+        now = time.time()
+        with self._lock:
+            try:
+                db = self._connect()
+                db.execute(
+                    "INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?, ?)",
+                    (key, name, response, now, now),
+                )
+                self._writes += 1
+                # Evicting is a scan, so it is only done every so often: the
+                # expired entries go, then the least recently used ones until
+                # the table is 10% under its limit.
+                if self._writes % 1000 == 0:
+                    self._evict(db, now)
+                db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Completion cache write failed: {e}")
+
+    def _evict(self, db, now):
+        db.execute("DELETE FROM completions WHERE created <= ?", (now - self.ttl,))
+        (count,) = db.execute("SELECT COUNT(*) FROM completions").fetchone()
+        if count > self.max_size:
+            db.execute(
+                "DELETE FROM completions WHERE key IN (SELECT key FROM "
+                "completions ORDER BY last_used LIMIT ?)",
+                (count - int(self.max_size * 0.9),),
+            )
+
+    def clear_stats(self):
+        with self._lock:
+            self.counts = dict()
+
+    def stats(self):
+        with self._lock:
+            by_function = {
+                name: {
+                    "hits": hits,
+                    "misses": misses,
+                    "hit_rate": hits / (hits + misses),
+                }
+                for name, (hits, misses) in sorted(self.counts.items())
+            }
+            hits = sum(hits for hits, _ in self.counts.values())
+            lookups = sum(hits + misses for hits, misses in self.counts.values())
+            return {
+                "hits": hits,
+                "misses": lookups - hits,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "by_function": by_function,
+            }
+
+
+completion_cache = CompletionCache()
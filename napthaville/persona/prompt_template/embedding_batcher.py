@@ -0,0 +1,131 @@
+"""
+File: embedding_batcher.py
+Description: Coalesces embedding requests into as few API calls as possible.
+Texts submitted by any thread within EMBEDDING_BATCH_TICK seconds of each
+other go out together, in requests of up to EMBEDDING_BATCH_SIZE inputs (the
+provider's list limit). A text that is already in flight is not sent again.
+"""
+
+import os
+import time
+import asyncio
+import threading
+from concurrent.futures import Future
+
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "2048"))
+EMBEDDING_BATCH_TICK = float(os.getenv("EMBEDDING_BATCH_TICK", "0.005"))
+
+
+class EmbeddingBatcher:
+    def __init__(
+        self,
+        request,
+        max_batch=EMBEDDING_BATCH_SIZE,
+        tick=EMBEDDING_BATCH_TICK,
+        async_request=None,
+    ):
+        """
+        INPUT:
+          request: request(texts, model) returns the embeddings of texts, in
+                   order, with a single API call.
+          async_request: The same, as a coroutine, for embed_async.
+          max_batch: The most texts sent in one request.
+          tick: How long the first caller waits for others to join its batch.
+        """
+        self.request = request
+        self.async_request = async_request
+        self.max_batch = max_batch
+        self.tick = tick
+        self.requests = 0
+        self._lock = threading.Lock()
+        # <pending> holds the texts of each model waiting for the next flush,
+        # <in_flight> the future of every pending or sent text, and
+        # <flushing> the models a caller is already gathering a batch for.
+        self._pending = dict()
+        self._in_flight = dict()
+        self._flushing = set()
+
+    def _join(self, texts, model):
+        """
+        Adds the texts that are not in flight yet to the next batch. Returns
+        the future of every text, and whether the caller is the one to flush
+        the batch.
+        """
+        futures = []
+        with self._lock:
+            for text in texts:
+                future = self._in_flight.get((model, text))
+                if future is None:
+                    future = self._in_flight[(model, text)] = Future()
+                    self._pending.setdefault(model, []).append(text)
+                futures.append(future)
+            leader = model not in self._flushing
+            if leader:
+                self._flushing.add(model)
+        return futures, leader
+
+    def _take_batch(self, model):
+        with self._lock:
+            batch = self._pending.pop(model, [])
+            self._flushing.discard(model)
+        return [
+            batch[start : start + self.max_batch]
+            for start in range(0, len(batch), self.max_batch)
+        ]
+
+    def embed(self, texts, model):
+        """
+        The embeddings of texts, in order.
+        """
+        futures, leader = self._join(texts, model)
+        if leader:
+            if self.tick:
+                time.sleep(self.tick)
+            for chunk in self._take_batch(model):
+                self._send(chunk, model)
+
+        return [future.result() for future in futures]
+
+    async def embed_async(self, texts, model):
+        """
+        embed, for the event loop. Texts in flight from threads and from
+        coroutines are shared both ways.
+        """
+        futures, leader = self._join(texts, model)
+        if leader:
+            if self.tick:
+                await asyncio.sleep(self.tick)
+            await asyncio.gather(
+                *(self._send_async(chunk, model) for chunk in self._take_batch(model))
+            )
+
+        return [await asyncio.wrap_future(future) for future in futures]
+
+    def _send(self, texts, model):
+        self.requests += 1
+        try:
+            embeddings, error = self.request(texts, model), None
+        except Exception as e:
+            embeddings, error = None, e
+        self._resolve(texts, model, embeddings, error)
+
+    async def _send_async(self, texts, model):
+        self.requests += 1
+        try:
+            embeddings, error = await self.async_request(texts, model), None
+        except Exception as e:
+            embeddings, error = None, e
+        self._resolve(texts, model, embeddings, error)
+
+    def _resolve(self, texts, model, embeddings, error):
+        if error is None and len(embeddings) != len(texts):
+            error = ValueError(
+                f"Got {len(embeddings)} embeddings for {len(texts)} texts"
+            )
+        with self._lock:
+            futures = [self._in_flight.pop((model, text)) for text in texts]
+        for i, future in enumerate(futures):
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(embeddings[i])
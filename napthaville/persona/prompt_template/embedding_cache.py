@@ -0,0 +1,181 @@
+"""
+File: embedding_cache.py
+Description: A cache of text embeddings shared by every persona in a process
+and, through a SQLite file, by every process and simulation run on the
+machine. Entries are keyed by (model, normalised text) and evicted least
+recently used first, both in memory and on disk.
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# The number of embeddings kept in memory and on disk. An empty
+# EMBEDDING_CACHE_PATH turns the on-disk cache off.
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+EMBEDDING_CACHE_DISK_SIZE = int(os.getenv("EMBEDDING_CACHE_DISK_SIZE", "1000000"))
+EMBEDDING_CACHE_PATH = os.getenv(
+    "EMBEDDING_CACHE_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "napthaville", "embeddings.sqlite"),
+)
+
+
+def normalize_text(text):
+    """
+    The text an embedding is requested for, which is also its key in the
+    cache: newlines become spaces, and an empty text becomes "this is blank".
+    Other whitespace is kept, as it changes the embedding.
+    """
+    text = text.replace("\n", " ")
+    if not text:
+        text = "this is blank"
+    return text
+
+
+class EmbeddingCache:
+    def __init__(
+        self,
+        max_size=EMBEDDING_CACHE_SIZE,
+        path=EMBEDDING_CACHE_PATH,
+        max_disk_size=EMBEDDING_CACHE_DISK_SIZE,
+    ):
+        self.max_size = max_size
+        self.path = path
+        self.max_disk_size = max_disk_size
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_pid = None
+        self._disk_writes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _connect(self):
+        """
+        The SQLite connection of this process, opened on first use. A forked
+        worker opens its own.
+        """
+        if not self.path:
+            return None
+        if self._db is None or self._db_pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model TEXT, text TEXT, vector BLOB, last_used REAL, "
+                "PRIMARY KEY (model, text))"
+            )
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS embeddings_last_used "
+                "ON embeddings (last_used)"
+            )
+            db.commit()
+            self._db, self._db_pid = db, os.getpid()
+        return self._db
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+    def get(self, text, model):
+        """
+        The cached embedding of text, or None.
+        """
+        key = (model, normalize_text(text))
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return vector.tolist()
+
+            row = None
+            try:
+                db = self._connect()
+                if db is not None:
+                    row = db.execute(
+                        "SELECT vector FROM embeddings WHERE model = ? AND text = ?",
+                        key,
+                    ).fetchone()
+                    if row is not None:
+                        db.execute(
+                            "UPDATE embeddings SET last_used = ? "
+                            "WHERE model = ? AND text = ?",
+                            (time.time(), *key),
+                        )
+                        db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Embedding cache read failed: {e}")
+            if row is None:
+                self.misses += 1
+                return None
+            vector = np.frombuffer(row[0], dtype=np.float32)
+            self._remember(key, vector)
+            self.disk_hits += 1
+            return vector.tolist()
+
+    def put(self, text, model, embedding):
+        key = (model, normalize_text(text))
+        vector = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            self._remember(key, vector)
+            try:
+                db = self._connect()
+                if db is None:
+                    return
+                db.execute(
+                    "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)",
+                    (*key, vector.tobytes(), time.time()),
+                )
+                self._disk_writes += 1
+                # Evicting is a scan, so it is only checked every so often and
+                # brings the table 10% under its limit.
+                if self._disk_writes % 1000 == 0:
+                    self._evict(db)
+                db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Embedding cache write failed: {e}")
+
+    def _evict(self, db):
+        (count,) = db.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        if count > self.max_disk_size:
+            db.execute(
+                "DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM "
+                "embeddings ORDER BY last_used LIMIT ?)",
+                (count - int(self.max_disk_size * 0.9),),
+            )
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self.memory_hits = 0
+            self.disk_hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups
+                if lookups
+                else 0.0,
+                "size": len(self._memory),
+                "max_size": self.max_size,
+            }
+
+
+embedding_cache = EmbeddingCache()
@@ -5,28 +5,97 @@ File: gpt_structure.py
 Description: Wrapper functions for calling OpenAI APIs.
 """
 
+import os
 import json
-import time
 import logging
-from openai import OpenAI
+import asyncio
+import weakref
+import threading
+from openai import (
+    OpenAI,
+    AsyncOpenAI,
+    RateLimitError,
+    APIConnectionError,
+    InternalServerError,
+)
+
+from napthaville.persona.prompt_template.embedding_cache import (
+    embedding_cache,
+    normalize_text,
+)
+from napthaville.persona.prompt_template.embedding_batcher import EmbeddingBatcher
+from napthaville.persona.prompt_template.completion_cache import completion_cache
+from napthaville.persona.prompt_template.rate_limiter import (
+    chat_limiter,
+    gpt4_limiter,
+    embedding_limiter,
+    estimate_tokens,
+)
 
 
 logger = logging.getLogger(__name__)
 
 
-client = OpenAI()
+# Retries are left to limited_request, so that a 429 or an outage pauses
+# every caller, with backoff.
+client = OpenAI(max_retries=0)
 
+LLM_MAX_TRIES = int(os.getenv("LLM_MAX_TRIES", "6"))
+# What a chat completion is expected to add to the prompt's tokens, until the
+# response says.
+LLM_COMPLETION_TOKENS = int(os.getenv("LLM_COMPLETION_TOKENS", "256"))
 
-def temp_sleep(seconds=0.1):
-    time.sleep(seconds)
 
+def retry_after(error):
+    """
+    The seconds an error response asks to wait, if it says.
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
 
-def ChatGPT_single_request(prompt):
-    temp_sleep()
 
-    completion = client.chat.completions.create(
-        model="gpt-3.5-turbo", messages=[{"role": "user", "content": prompt}]
+def limited_request(limiter, tokens, create, **kwargs):
+    """
+    Makes a request once the limiter has room for it, retrying rate limits,
+    connection errors and server errors up to LLM_MAX_TRIES times, each
+    after the shared backoff.
+    ARGS:
+      limiter: the RateLimiter of the model.
+      tokens: the estimated tokens of the request.
+      create: the client method to call with kwargs.
+    RETURNS:
+      the response.
+    """
+    for attempt in range(LLM_MAX_TRIES):
+        limiter.acquire(tokens)
+        try:
+            response = create(**kwargs)
+        except (RateLimitError, APIConnectionError, InternalServerError) as e:
+            limiter.backoff(retry_after(e), rate_limited=isinstance(e, RateLimitError))
+            if attempt == LLM_MAX_TRIES - 1:
+                raise
+            continue
+        usage = getattr(response, "usage", None)
+        limiter.settle(tokens, getattr(usage, "total_tokens", None) or tokens)
+        return response
+
+
+def chat_request(model, prompt):
+    limiter = gpt4_limiter if model == "gpt-4" else chat_limiter
+    return limited_request(
+        limiter,
+        estimate_tokens(prompt) + LLM_COMPLETION_TOKENS,
+        client.chat.completions.create,
+        model=model,
+        messages=[{"role": "user", "content": prompt}],
     )
+
+
+def ChatGPT_single_request(prompt):
+    completion = chat_request("gpt-3.5-turbo", prompt)
     return completion.choices[0].message.content
 
 
@@ -47,12 +116,8 @@ def GPT4_request(prompt):
     RETURNS:
       a str of GPT-3's response.
     """
-    temp_sleep()
-
     try:
-        completion = client.chat.completions.create(
-            model="gpt-4", messages=[{"role": "user", "content": prompt}]
-        )
+        completion = chat_request("gpt-4", prompt)
         return completion.choices[0].message.content
 
     except:
@@ -72,12 +137,8 @@ def ChatGPT_request(prompt):
     RETURNS:
       a str of GPT-3's response.
     """
-    temp_sleep()
-
     try:
-        completion = client.chat.completions.create(
-            model="gpt-3.5-turbo", messages=[{"role": "user", "content": prompt}]
-        )
+        completion = chat_request("gpt-3.5-turbo", prompt)
         return completion.choices[0].message.content
 
     except:
@@ -86,6 +147,23 @@ def ChatGPT_request(prompt):
         return "ChatGPT ERROR"
 
 
+def cached_ChatGPT_request(prompt, cache=None):
+    """
+    ChatGPT_request, answered from the completion cache when <cache> names the
+    prompt function asking and the same prompt has been answered before. The
+    key is the model and the prompt only: <gpt_parameter> is not part of it,
+    as ChatGPT_request does not send it (see completion_key).
+
+    RETURNS:
+      The response, and whether it came from the cache.
+    """
+    if cache:
+        response = completion_cache.get(cache, "gpt-3.5-turbo", prompt)
+        if response is not None:
+            return response, True
+    return ChatGPT_request(prompt), False
+
+
 def GPT4_safe_generate_response(
     prompt,
     example_output,
@@ -127,6 +205,26 @@ def GPT4_safe_generate_response(
     return False
 
 
+def chat_json_prompt(prompt, example_output, special_instruction):
+    """
+    Wraps a prompt in the instructions to answer in {"output": ...} json.
+    """
+    # prompt = 'GPT-3 Prompt:\n"""\n' + prompt + '\n"""\n'
+    prompt = '"""\n' + prompt + '\n"""\n'
+    prompt += (
+        f"Output the response to the prompt above in json. {special_instruction}\n"
+    )
+    prompt += "Example output json:\n"
+    prompt += '{"output": "' + str(example_output) + '"}'
+    return prompt
+
+
+def parse_json_output(response):
+    response = response.strip()
+    end_index = response.rfind("}") + 1
+    return json.loads(response[:end_index])["output"]
+
+
 def ChatGPT_safe_generate_response(
     prompt,
     example_output,
@@ -136,14 +234,9 @@ def ChatGPT_safe_generate_response(
     func_validate=None,
     func_clean_up=None,
     verbose=False,
+    cache=None,
 ):
-    # prompt = 'GPT-3 Prompt:\n"""\n' + prompt + '\n"""\n'
-    prompt = '"""\n' + prompt + '\n"""\n'
-    prompt += (
-        f"Output the response to the prompt above in json. {special_instruction}\n"
-    )
-    prompt += "Example output json:\n"
-    prompt += '{"output": "' + str(example_output) + '"}'
+    prompt = chat_json_prompt(prompt, example_output, special_instruction)
 
     if verbose:
         print("CHAT GPT PROMPT")
@@ -151,16 +244,16 @@ def ChatGPT_safe_generate_response(
 
     for i in range(repeat):
         try:
-            curr_gpt_response = ChatGPT_request(prompt).strip()
-            end_index = curr_gpt_response.rfind("}") + 1
-            curr_gpt_response = curr_gpt_response[:end_index]
-            curr_gpt_response = json.loads(curr_gpt_response)["output"]
-
-            # print ("---ashdfaf")
-            # print (curr_gpt_response)
-            # print ("000asdfhia")
+            # Only responses that pass validation are cached, so the cache is
+            # only asked on the first attempt.
+            raw_response, cached = cached_ChatGPT_request(
+                prompt, cache if i == 0 else None
+            )
+            curr_gpt_response = parse_json_output(raw_response)
 
             if func_validate(curr_gpt_response, prompt=prompt):
+                if cache and not cached:
+                    completion_cache.put(cache, "gpt-3.5-turbo", prompt, raw_response)
                 return func_clean_up(curr_gpt_response, prompt=prompt)
 
             if verbose:
@@ -214,10 +307,15 @@ def GPT_request(prompt, gpt_parameter):
     RETURNS:
       a str of GPT-3's response.
     """
-    temp_sleep()
     try:
-        completion = client.completions.create(
-            engine="text-davinci-003", prompt=prompt, **gpt_parameter
+        completion = limited_request(
+            chat_limiter,
+            estimate_tokens(prompt)
+            + gpt_parameter.get("max_tokens", LLM_COMPLETION_TOKENS),
+            client.completions.create,
+            engine="text-davinci-003",
+            prompt=prompt,
+            **gpt_parameter,
         )
         return completion.choices[0].text
     except:
@@ -285,14 +383,23 @@ def safe_generate_response(
     func_validate=None,
     func_clean_up=None,
     verbose=False,
+    cache=None,
 ):
     if verbose:
         print(prompt)
 
     for i in range(repeat):
         try:
-            curr_gpt_response = ChatGPT_request(prompt)
+            # Only responses that pass validation are cached, so the cache is
+            # only asked on the first attempt.
+            curr_gpt_response, cached = cached_ChatGPT_request(
+                prompt, cache if i == 0 else None
+            )
             if func_validate(curr_gpt_response, prompt=prompt):
+                if cache and not cached:
+                    completion_cache.put(
+                        cache, "gpt-3.5-turbo", prompt, curr_gpt_response
+                    )
                 return func_clean_up(curr_gpt_response, prompt=prompt)
             if verbose:
                 print("---- repeat count: ", i, curr_gpt_response)
@@ -305,11 +412,263 @@ def safe_generate_response(
     return fail_safe_response
 
 
+def request_embeddings(texts, model="text-embedding-ada-002"):
+    res = limited_request(
+        embedding_limiter,
+        sum(estimate_tokens(text) for text in texts),
+        client.embeddings.create,
+        model=model,
+        input=texts,
+    )
+    return [d.embedding for d in sorted(res.data, key=lambda d: d.index)]
+
+
+async def async_request_embeddings(texts, model="text-embedding-ada-002"):
+    res = await async_limited_request(
+        embedding_limiter,
+        sum(estimate_tokens(text) for text in texts),
+        get_async_client().embeddings.create,
+        model=model,
+        input=texts,
+    )
+    return [d.embedding for d in sorted(res.data, key=lambda d: d.index)]
+
+
+embedding_batcher = EmbeddingBatcher(
+    request_embeddings, async_request=async_request_embeddings
+)
+
+
+def get_embeddings(texts, model="text-embedding-ada-002"):
+    """
+    Embeds a list of texts. Identical texts are only embedded once per
+    machine (see embedding_cache), and the rest go out in as few requests as
+    possible, together with those of other threads (see embedding_batcher).
+    """
+    embeddings = [embedding_cache.get(text, model) for text in texts]
+    missing = list(
+        dict.fromkeys(
+            normalize_text(text) for text, e in zip(texts, embeddings) if e is None
+        )
+    )
+    if missing:
+        fetched = dict(zip(missing, embedding_batcher.embed(missing, model)))
+        for text, embedding in fetched.items():
+            embedding_cache.put(text, model, embedding)
+        embeddings = [
+            e if e is not None else fetched[normalize_text(text)]
+            for text, e in zip(texts, embeddings)
+        ]
+    return embeddings
+
+
 def get_embedding(text, model="text-embedding-ada-002"):
-    text = text.replace("\n", " ")
-    if not text:
-        text = "this is blank"
-    res = client.embeddings.create(model=model, input=text)
+    return get_embeddings([text], model)[0]
+
+
+# ============================================================================
+# ########################[SECTION 2: ASYNC STRUCTURE] #######################
+# ============================================================================
+# The requests for prompts that are independent of each other, so that they
+# wait on the network together. They share the rate limiters, the caches and
+# the embedding batches of the synchronous ones.
+
+# The loop run_concurrently runs coroutines on, in a thread of its own, and
+# the pid of the process that started it.
+_loop = None
+_loop_pid = None
+_loop_lock = threading.Lock()
+# An AsyncOpenAI client is bound to the event loop it first runs on.
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    loop = asyncio.get_running_loop()
+    async_client = _async_clients.get(loop)
+    if async_client is None:
+        async_client = _async_clients[loop] = AsyncOpenAI(max_retries=0)
+    return async_client
+
+
+def _background_loop():
+    """
+    The event loop of run_concurrently, started on first use, and again in a
+    forked worker, which does not inherit its thread.
+    """
+    global _loop, _loop_pid
+    with _loop_lock:
+        if _loop is None or _loop_pid != os.getpid():
+            _loop, _loop_pid = asyncio.new_event_loop(), os.getpid()
+            threading.Thread(
+                target=_loop.run_forever, name="llm-requests", daemon=True
+            ).start()
+        return _loop
+
+
+async def _gather(coroutines):
+    return await asyncio.gather(*coroutines)
+
+
+def run_concurrently(coroutines):
+    """
+    Runs coroutines together from synchronous code and returns their results
+    in order. They run on one long-lived loop, whatever thread calls this, so
+    they share its AsyncOpenAI client and its connections from call to call.
+    """
+    coroutines = list(coroutines)
+    if not coroutines:
+        return []
+    future = asyncio.run_coroutine_threadsafe(_gather(coroutines), _background_loop())
+    return future.result()
+
+
+async def async_limited_request(limiter, tokens, create, **kwargs):
+    """
+    limited_request, for the event loop.
+    """
+    for attempt in range(LLM_MAX_TRIES):
+        await limiter.acquire_async(tokens)
+        try:
+            response = await create(**kwargs)
+        except (RateLimitError, APIConnectionError, InternalServerError) as e:
+            # The limiter's SQLite updates run off the loop, like acquire_async.
+            await asyncio.to_thread(
+                limiter.backoff,
+                retry_after(e),
+                rate_limited=isinstance(e, RateLimitError),
+            )
+            if attempt == LLM_MAX_TRIES - 1:
+                raise
+            continue
+        usage = getattr(response, "usage", None)
+        await asyncio.to_thread(
+            limiter.settle, tokens, getattr(usage, "total_tokens", None) or tokens
+        )
+        return response
+
+
+async def async_ChatGPT_request(prompt):
+    try:
+        completion = await async_limited_request(
+            chat_limiter,
+            estimate_tokens(prompt) + LLM_COMPLETION_TOKENS,
+            get_async_client().chat.completions.create,
+            model="gpt-3.5-turbo",
+            messages=[{"role": "user", "content": prompt}],
+        )
+        return completion.choices[0].message.content
+
+    except:
+        print("ChatGPT ERROR")
+        logger.error("ChatGPT ERROR")
+        return "ChatGPT ERROR"
+
+
+async def async_cached_ChatGPT_request(prompt, cache=None):
+    if cache:
+        response = completion_cache.get(cache, "gpt-3.5-turbo", prompt)
+        if response is not None:
+            return response, True
+    return await async_ChatGPT_request(prompt), False
+
+
+async def async_ChatGPT_safe_generate_response(
+    prompt,
+    example_output,
+    special_instruction,
+    repeat=3,
+    fail_safe_response="error",
+    func_validate=None,
+    func_clean_up=None,
+    verbose=False,
+    cache=None,
+):
+    prompt = chat_json_prompt(prompt, example_output, special_instruction)
+
+    if verbose:
+        print("CHAT GPT PROMPT")
+        print(prompt)
+
+    for i in range(repeat):
+        try:
+            raw_response, cached = await async_cached_ChatGPT_request(
+                prompt, cache if i == 0 else None
+            )
+            curr_gpt_response = parse_json_output(raw_response)
+
+            if func_validate(curr_gpt_response, prompt=prompt):
+                if cache and not cached:
+                    completion_cache.put(cache, "gpt-3.5-turbo", prompt, raw_response)
+                return func_clean_up(curr_gpt_response, prompt=prompt)
+
+            if verbose:
+                print("---- repeat count: \n", i, curr_gpt_response)
+                print(curr_gpt_response)
+                print("~~~~")
+
+        except:
+            pass
+
+    return False
+
+
+async def async_safe_generate_response(
+    prompt,
+    gpt_parameter,
+    repeat=5,
+    fail_safe_response="error",
+    func_validate=None,
+    func_clean_up=None,
+    verbose=False,
+    cache=None,
+):
+    if verbose:
+        print(prompt)
+
+    for i in range(repeat):
+        try:
+            curr_gpt_response, cached = await async_cached_ChatGPT_request(
+                prompt, cache if i == 0 else None
+            )
+            if func_validate(curr_gpt_response, prompt=prompt):
+                if cache and not cached:
+                    completion_cache.put(
+                        cache, "gpt-3.5-turbo", prompt, curr_gpt_response
+                    )
+                return func_clean_up(curr_gpt_response, prompt=prompt)
+            if verbose:
+                print("---- repeat count: ", i, curr_gpt_response)
+                print(curr_gpt_response)
+                print("~~~~")
+        except Exception as e:
+            if verbose:
+                print(f"Error occurred: {str(e)}")
+                print("Retrying...")
+    return fail_safe_response
+
+
+async def async_get_embeddings(texts, model="text-embedding-ada-002"):
+    """
+    get_embeddings, for the event loop.
+    """
+    embeddings = [embedding_cache.get(text, model) for text in texts]
+    missing = list(
+        dict.fromkeys(
+            normalize_text(text) for text, e in zip(texts, embeddings) if e is None
+        )
+    )
+    if missing:
+        fetched = dict(
+            zip(missing, await embedding_batcher.embed_async(missing, model))
+        )
+        for text, embedding in fetched.items():
+            embedding_cache.put(text, model, embedding)
+        embeddings = [
+            e if e is not None else fetched[normalize_text(text)]
+            for text, e in zip(texts, embeddings)
+        ]
+    return embeddings
+
 
-    # return [d.embedding for d in res.data]
-    return res.data[0].embedding
+async def async_get_embedding(text, model="text-embedding-ada-002"):
+    return (await async_get_embeddings([text], model))[0]
@@ -0,0 +1,232 @@
+"""
+File: rate_limiter.py
+Description: Token-bucket limits on the requests and tokens per minute sent to
+the LLM provider. The buckets live in a SQLite file, so every thread and
+process of a worker node draws from the same budget, and a 429 from any of
+them pauses all of them, for longer each time it happens again.
+"""
+
+import os
+import time
+import random
+import asyncio
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# An empty LLM_RATE_LIMIT_PATH keeps the buckets in the process.
+LLM_RATE_LIMIT_PATH = os.getenv(
+    "LLM_RATE_LIMIT_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "napthaville", "rate_limits.sqlite"),
+)
+CHAT_RPM = float(os.getenv("CHAT_RPM", "3500"))
+CHAT_TPM = float(os.getenv("CHAT_TPM", "160000"))
+GPT4_RPM = float(os.getenv("GPT4_RPM", "500"))
+GPT4_TPM = float(os.getenv("GPT4_TPM", "10000"))
+EMBEDDING_RPM = float(os.getenv("EMBEDDING_RPM", "3000"))
+EMBEDDING_TPM = float(os.getenv("EMBEDDING_TPM", "1000000"))
+# How long the first 429 pauses every caller, and the longest any does.
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "1"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "60"))
+
+
+def estimate_tokens(text):
+    """
+    A rough token count of text, about four characters a token in English.
+    The buckets are settled with the real usage once the response is in.
+    """
+    return len(text) // 4 + 1
+
+
+class RateLimiter:
+    def __init__(self, name, rpm, tpm, path=LLM_RATE_LIMIT_PATH):
+        """
+        INPUT:
+          name: The bucket, one per model, as the provider limits them.
+          rpm: Requests per minute.
+          tpm: Tokens per minute.
+          path: The SQLite file the bucket is kept in.
+        """
+        self.name = name
+        self.rpm = rpm
+        self.tpm = tpm
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_pid = None
+        # The bucket itself when there is no file: [requests, tokens,
+        # updated, blocked_until, backoff].
+        self._state = None
+        self.waited = 0.0
+        self.rate_limited = 0
+        self.failed = 0
+
+    def _connect(self):
+        """
+        The SQLite connection of this process, opened on first use. A forked
+        worker opens its own.
+        """
+        if self._db is None or self._db_pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            db = sqlite3.connect(
+                self.path, timeout=30, check_same_thread=False, isolation_level=None
+            )
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "name TEXT PRIMARY KEY, requests REAL, tokens REAL, "
+                "updated REAL, blocked_until REAL, backoff REAL)"
+            )
+            self._db, self._db_pid = db, os.getpid()
+        return self._db
+
+    def _update(self, change):
+        """
+        Applies change(state, now) to the bucket as one transaction, across
+        processes, and returns what it returns. The bucket is refilled for
+        the time since its last update first.
+        """
+        now = time.time()
+        with self._lock:
+            if not self.path:
+                if self._state is None:
+                    self._state = [self.rpm, self.tpm, now, 0.0, 0.0]
+                self._refill(self._state, now)
+                return change(self._state, now)
+
+            db = self._connect()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute(
+                    "SELECT requests, tokens, updated, blocked_until, backoff "
+                    "FROM buckets WHERE name = ?",
+                    (self.name,),
+                ).fetchone()
+                state = list(row) if row else [self.rpm, self.tpm, now, 0.0, 0.0]
+                self._refill(state, now)
+                result = change(state, now)
+                db.execute(
+                    "INSERT OR REPLACE INTO buckets VALUES (?, ?, ?, ?, ?, ?)",
+                    (self.name, *state),
+                )
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            return result
+
+    def _refill(self, state, now):
+        elapsed = max(0.0, now - state[2])
+        state[0] = min(self.rpm, state[0] + elapsed * self.rpm / 60)
+        state[1] = min(self.tpm, state[1] + elapsed * self.tpm / 60)
+        state[2] = now
+
+    def _reserve(self, tokens):
+        """
+        Takes one request of <tokens> tokens out of the buckets if they have
+        room for it. Otherwise, returns how long to wait before trying again.
+        """
+        # A request larger than the whole token budget waits for a full
+        # bucket rather than forever.
+        tokens = min(tokens, self.tpm)
+
+        def take(state, now):
+            if state[3] > now:
+                return state[3] - now
+            if state[0] >= 1 and state[1] >= tokens:
+                state[0] -= 1
+                state[1] -= tokens
+                return 0.0
+            return max(
+                (1 - state[0]) * 60 / self.rpm, (tokens - state[1]) * 60 / self.tpm
+            )
+
+        try:
+            return self._update(take)
+        except sqlite3.Error as e:
+            logger.warning(f"Rate limiter unavailable, not limiting: {e}")
+            return 0.0
+
+    def acquire(self, tokens):
+        """
+        Blocks until one request of about <tokens> tokens fits in the limits,
+        and takes it out of the buckets.
+        """
+        while True:
+            wait = self._reserve(tokens)
+            if wait <= 0:
+                return
+            self.waited += wait
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens):
+        """
+        acquire, for the event loop. The reservation is a SQLite transaction
+        that can wait on other processes for the lock, so it runs on a worker
+        thread; only the sleep between tries is on the loop.
+        """
+        while True:
+            wait = await asyncio.to_thread(self._reserve, tokens)
+            if wait <= 0:
+                return
+            self.waited += wait
+            await asyncio.sleep(wait)
+
+    def settle(self, estimated, used):
+        """
+        Corrects the token bucket once the real usage of a request is known.
+        A success also ends any backoff.
+        """
+
+        def correct(state, now):
+            state[1] = min(self.tpm, state[1] + estimated - used)
+            state[4] = 0.0
+
+        try:
+            self._update(correct)
+        except sqlite3.Error as e:
+            logger.warning(f"Rate limiter unavailable: {e}")
+
+    def backoff(self, retry_after=None, rate_limited=True):
+        """
+        Pauses every caller after a 429, or a connection or server error
+        (rate_limited False): for retry_after seconds when the provider says,
+        otherwise for twice as long as the last pause, with jitter so the
+        callers do not all come back at once.
+        """
+        if rate_limited:
+            self.rate_limited += 1
+        else:
+            self.failed += 1
+
+        def pause(state, now):
+            state[4] = min(LLM_BACKOFF_MAX, max(LLM_BACKOFF_BASE, state[4] * 2))
+            delay = retry_after if retry_after else state[4] * random.uniform(0.5, 1)
+            state[3] = max(state[3], now + delay)
+            # Whatever the bucket thought was left evidently was not.
+            state[0] = min(state[0], 0.0)
+            return delay
+
+        try:
+            delay = self._update(pause)
+            reason = "Rate limited" if rate_limited else "Request failed"
+            logger.warning(f"{reason} on {self.name}, pausing {delay:.1f}s")
+        except sqlite3.Error as e:
+            logger.warning(f"Rate limiter unavailable: {e}")
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "rpm": self.rpm,
+            "tpm": self.tpm,
+            "waited": self.waited,
+            "rate_limited": self.rate_limited,
+            "failed": self.failed,
+        }
+
+
+chat_limiter = RateLimiter("gpt-3.5-turbo", CHAT_RPM, CHAT_TPM)
+gpt4_limiter = RateLimiter("gpt-4", GPT4_RPM, GPT4_TPM)
+embedding_limiter = RateLimiter("text-embedding-ada-002", EMBEDDING_RPM, EMBEDDING_TPM)
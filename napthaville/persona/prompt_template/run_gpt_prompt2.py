@@ -8,9 +8,11 @@ import datetime
 from pathlib import Path
 from napthaville.persona.prompt_template.gpt_structure2 import (
     ChatGPT_safe_generate_response,
+    async_ChatGPT_safe_generate_response,
     generate_prompt,
     ChatGPT_safe_generate_response_OLD,
     safe_generate_response,
+    async_safe_generate_response,
 )
 from napthaville.persona.prompt_template.print_prompt import print_run_prompts
 
@@ -241,61 +243,49 @@ def run_gpt_generate_iterative_chat_utt(
     return output, [output, prompt, gpt_param, prompt_input, fail_safe]
 
 
-def run_gpt_prompt_event_poignancy(
-    persona, event_description, test_input=None, verbose=False
-):
-    def create_prompt_input(persona, event_description, test_input=None):
-        prompt_input = [
-            persona.scratch.name,
-            persona.scratch.get_str_iss(),
-            persona.scratch.name,
-            event_description,
-        ]
-        return prompt_input
-
-    def __func_clean_up(gpt_response, prompt=""):
-        gpt_response = int(gpt_response.strip())
-        return gpt_response
+POIGNANCY_GPT_PARAM = {
+    "engine": "text-davinci-002",
+    "max_tokens": 15,
+    "temperature": 0,
+    "top_p": 1,
+    "stream": False,
+    "frequency_penalty": 0,
+    "presence_penalty": 0,
+    "stop": None,
+}
 
-    def __func_validate(gpt_response, prompt=""):
-        try:
-            __func_clean_up(gpt_response, prompt)
-            return True
-        except:
-            return False
 
-    def get_fail_safe():
-        return 4
+def poignancy_request(persona, event_description, prompt_file):
+    """
+    The prompt input, and the arguments to ChatGPT_safe_generate_response (or
+    async_ChatGPT_safe_generate_response), of the event and chat poignancy
+    prompts, which only differ in their template.
+    """
 
-    def __chat_func_clean_up(gpt_response, prompt=""):  ############
-        gpt_response = int(gpt_response)
-        return gpt_response
+    def __chat_func_clean_up(gpt_response, prompt=""):
+        return int(gpt_response)
 
-    def __chat_func_validate(gpt_response, prompt=""):  ############
+    def __chat_func_validate(gpt_response, prompt=""):
         try:
-            __func_clean_up(gpt_response, prompt)
+            int(gpt_response.strip())
             return True
         except:
             return False
 
-    print("asdhfapsh8p9hfaiafdsi;ldfj as DEBUG 7")  ########
-    gpt_param = {
-        "engine": "text-davinci-002",
-        "max_tokens": 15,
-        "temperature": 0,
-        "top_p": 1,
-        "stream": False,
-        "frequency_penalty": 0,
-        "presence_penalty": 0,
-        "stop": None,
-    }
-    prompt_template = f"{parent_path}/v3_ChatGPT/poignancy_event_v1.txt"  ########
-    prompt_input = create_prompt_input(persona, event_description)  ########
+    prompt_template = f"{parent_path}/v3_ChatGPT/{prompt_file}"
+    prompt_input = [
+        persona.scratch.name,
+        persona.scratch.get_str_iss(),
+        persona.scratch.name,
+        event_description,
+    ]
     prompt = generate_prompt(prompt_input, prompt_template)
-    example_output = "5"  ########
-    special_instruction = "The output should ONLY contain ONE integer value on the scale of 1 to 10."  ########
-    fail_safe = get_fail_safe()  ########
-    output = ChatGPT_safe_generate_response(
+    example_output = "5"
+    special_instruction = (
+        "The output should ONLY contain ONE integer value on the scale of 1 to 10."
+    )
+    fail_safe = 4
+    return prompt_input, (
         prompt,
         example_output,
         special_instruction,
@@ -305,77 +295,61 @@ def run_gpt_prompt_event_poignancy(
         __chat_func_clean_up,
         True,
     )
+
+
+def poignancy_output(output, prompt_input, args):
     if output != False:
-        return output, [output, prompt, gpt_param, prompt_input, fail_safe]
+        prompt, fail_safe = args[0], args[4]
+        return output, [output, prompt, POIGNANCY_GPT_PARAM, prompt_input, fail_safe]
 
 
-def run_gpt_prompt_chat_poignancy(
+def run_gpt_prompt_event_poignancy(
     persona, event_description, test_input=None, verbose=False
 ):
-    def create_prompt_input(persona, event_description, test_input=None):
-        prompt_input = [
-            persona.scratch.name,
-            persona.scratch.get_str_iss(),
-            persona.scratch.name,
-            event_description,
-        ]
-        return prompt_input
+    print("asdhfapsh8p9hfaiafdsi;ldfj as DEBUG 7")  ########
+    prompt_input, args = poignancy_request(
+        persona, event_description, "poignancy_event_v1.txt"
+    )
+    output = ChatGPT_safe_generate_response(
+        *args, cache="run_gpt_prompt_event_poignancy"
+    )
+    return poignancy_output(output, prompt_input, args)
 
-    def __func_clean_up(gpt_response, prompt=""):
-        gpt_response = int(gpt_response.strip())
-        return gpt_response
 
-    def __func_validate(gpt_response, prompt=""):
-        try:
-            __func_clean_up(gpt_response, prompt)
-            return True
-        except:
-            return False
+def run_gpt_prompt_chat_poignancy(
+    persona, event_description, test_input=None, verbose=False
+):
+    print("asdhfapsh8p9hfaiafdsi;ldfj as DEBUG 9")  ########
+    prompt_input, args = poignancy_request(
+        persona, event_description, "poignancy_chat_v1.txt"
+    )
+    output = ChatGPT_safe_generate_response(*args)
+    return poignancy_output(output, prompt_input, args)
 
-    def get_fail_safe():
-        return 4
 
-    # ChatGPT Plugin ===========================================================
-    def __chat_func_clean_up(gpt_response, prompt=""):  ############
-        gpt_response = int(gpt_response)
-        return gpt_response
+async def async_run_gpt_prompt_event_poignancy(persona, event_description):
+    """
+    run_gpt_prompt_event_poignancy, for the event loop, so that the events a
+    persona perceives in a step are scored together.
+    """
+    prompt_input, args = poignancy_request(
+        persona, event_description, "poignancy_event_v1.txt"
+    )
+    output = await async_ChatGPT_safe_generate_response(
+        *args, cache="run_gpt_prompt_event_poignancy"
+    )
+    return poignancy_output(output, prompt_input, args)
 
-    def __chat_func_validate(gpt_response, prompt=""):  ############
-        try:
-            __func_clean_up(gpt_response, prompt)
-            return True
-        except:
-            return False
 
-    print("asdhfapsh8p9hfaiafdsi;ldfj as DEBUG 9")  ########
-    gpt_param = {
-        "engine": "text-davinci-002",
-        "max_tokens": 15,
-        "temperature": 0,
-        "top_p": 1,
-        "stream": False,
-        "frequency_penalty": 0,
-        "presence_penalty": 0,
-        "stop": None,
-    }
-    prompt_template = f"{parent_path}/v3_ChatGPT/poignancy_chat_v1.txt"  ########
-    prompt_input = create_prompt_input(persona, event_description)  ########
-    prompt = generate_prompt(prompt_input, prompt_template)
-    example_output = "5"  ########
-    special_instruction = "The output should ONLY contain ONE integer value on the scale of 1 to 10."  ########
-    fail_safe = get_fail_safe()  ########
-    output = ChatGPT_safe_generate_response(
-        prompt,
-        example_output,
-        special_instruction,
-        3,
-        fail_safe,
-        __chat_func_validate,
-        __chat_func_clean_up,
-        True,
+async def async_run_gpt_prompt_chat_poignancy(persona, event_description):
+    """
+    run_gpt_prompt_chat_poignancy, for the event loop.
+    """
+    prompt_input, args = poignancy_request(
+        persona, event_description, "poignancy_chat_v1.txt"
     )
-    if output != False:
-        return output, [output, prompt, gpt_param, prompt_input, fail_safe]
+    output = await async_ChatGPT_safe_generate_response(*args)
+    return poignancy_output(output, prompt_input, args)
 
 
 def run_gpt_prompt_wake_up_hour(persona, test_input=None, verbose=False):
@@ -966,7 +940,13 @@ def run_gpt_prompt_action_sector(
 
     fail_safe = get_fail_safe()
     output = safe_generate_response(
-        prompt, gpt_param, 5, fail_safe, __func_validate, __func_clean_up
+        prompt,
+        gpt_param,
+        5,
+        fail_safe,
+        __func_validate,
+        __func_clean_up,
+        cache="run_gpt_prompt_action_sector",
     )
     y = f"{maze.access_tile(persona.scratch.curr_tile)['world']}"
     x = [i.strip() for i in persona.s_mem.get_str_accessible_sectors(y).split(",")]
@@ -1063,7 +1043,13 @@ def run_gpt_prompt_action_arena(
 
     fail_safe = get_fail_safe()
     output = safe_generate_response(
-        prompt, gpt_param, 5, fail_safe, __func_validate, __func_clean_up
+        prompt,
+        gpt_param,
+        5,
+        fail_safe,
+        __func_validate,
+        __func_clean_up,
+        cache="run_gpt_prompt_action_arena",
     )
     print(output)
 
@@ -1120,7 +1106,13 @@ def run_gpt_prompt_action_game_object(
 
     fail_safe = get_fail_safe()
     output = safe_generate_response(
-        prompt, gpt_param, 5, fail_safe, __func_validate, __func_clean_up
+        prompt,
+        gpt_param,
+        5,
+        fail_safe,
+        __func_validate,
+        __func_clean_up,
+        cache="run_gpt_prompt_action_game_object",
     )
 
     x = [
@@ -1211,6 +1203,7 @@ def run_gpt_prompt_pronunciatio(action_description, persona, verbose=False):
         __chat_func_validate,
         __chat_func_clean_up,
         True,
+        cache="run_gpt_prompt_pronunciatio",
     )
     if output != False:
         return output, [output, prompt, gpt_param, prompt_input, fail_safe]
@@ -1256,7 +1249,13 @@ def run_gpt_prompt_event_triple(action_description, persona, verbose=False):
     prompt = generate_prompt(prompt_input, prompt_template)
     fail_safe = get_fail_safe(persona)  ########
     output = safe_generate_response(
-        prompt, gpt_param, 5, fail_safe, __func_validate, __func_clean_up
+        prompt,
+        gpt_param,
+        5,
+        fail_safe,
+        __func_validate,
+        __func_clean_up,
+        cache="run_gpt_prompt_event_triple",
     )
     output = (persona.name, output[0], output[1])
 
@@ -1308,7 +1307,13 @@ def run_gpt_prompt_event_triple(action_description, persona, verbose=False):
     prompt = generate_prompt(prompt_input, prompt_template)
     fail_safe = get_fail_safe(persona)  ########
     output = safe_generate_response(
-        prompt, gpt_param, 5, fail_safe, __func_validate, __func_clean_up
+        prompt,
+        gpt_param,
+        5,
+        fail_safe,
+        __func_validate,
+        __func_clean_up,
+        cache="run_gpt_prompt_event_triple",
     )
     output = (persona.name, output[0], output[1])
 
@@ -1389,6 +1394,7 @@ def run_gpt_prompt_act_obj_desc(act_game_object, act_desp, persona, verbose=Fals
         __chat_func_validate,
         __chat_func_clean_up,
         True,
+        cache="run_gpt_prompt_act_obj_desc",
     )
     if output != False:
         return output, [output, prompt, gpt_param, prompt_input, fail_safe]
@@ -1434,7 +1440,13 @@ def run_gpt_prompt_act_obj_event_triple(
     prompt = generate_prompt(prompt_input, prompt_template)
     fail_safe = get_fail_safe(act_game_object)
     output = safe_generate_response(
-        prompt, gpt_param, 5, fail_safe, __func_validate, __func_clean_up
+        prompt,
+        gpt_param,
+        5,
+        fail_safe,
+        __func_validate,
+        __func_clean_up,
+        cache="run_gpt_prompt_act_obj_event_triple",
     )
     output = (act_game_object, output[0], output[1])
 
@@ -2566,17 +2578,24 @@ def run_gpt_prompt_insight_and_guidance(
     return output, [output, prompt, gpt_param, prompt_input, fail_safe]
 
 
-def run_gpt_prompt_planning_thought_on_convo(
-    persona, all_utt, test_input=None, verbose=False
-):
-    def create_prompt_input(persona, all_utt, test_input=None):
-        prompt_input = [
-            all_utt,
-            persona.scratch.name,
-            persona.scratch.name,
-            persona.scratch.name,
-        ]
-        return prompt_input
+CONVO_GPT_PARAM = {
+    "engine": "text-davinci-003",
+    "max_tokens": 50,
+    "temperature": 0,
+    "top_p": 1,
+    "stream": False,
+    "frequency_penalty": 0,
+    "presence_penalty": 0,
+    "stop": None,
+}
+
+
+def convo_request(persona, all_utt, prompt_file):
+    """
+    The prompt template and input, and the arguments to safe_generate_response
+    (or async_safe_generate_response), of the planning thought and memo on a
+    conversation, which only differ in their template.
+    """
 
     def __func_clean_up(gpt_response, prompt=""):
         return gpt_response.split('"')[0].strip()
@@ -2588,88 +2607,96 @@ def run_gpt_prompt_planning_thought_on_convo(
         except:
             return False
 
-    def get_fail_safe():
-        return "..."
-
-    gpt_param = {
-        "engine": "text-davinci-003",
-        "max_tokens": 50,
-        "temperature": 0,
-        "top_p": 1,
-        "stream": False,
-        "frequency_penalty": 0,
-        "presence_penalty": 0,
-        "stop": None,
-    }
-    prompt_template = f"{parent_path}/v2/planning_thought_on_convo_v1.txt"
-    prompt_input = create_prompt_input(persona, all_utt)
+    prompt_template = f"{parent_path}/v2/{prompt_file}"
+    prompt_input = [
+        all_utt,
+        persona.scratch.name,
+        persona.scratch.name,
+        persona.scratch.name,
+    ]
     prompt = generate_prompt(prompt_input, prompt_template)
-
-    fail_safe = get_fail_safe()
-    output = safe_generate_response(
-        prompt, gpt_param, 5, fail_safe, __func_validate, __func_clean_up
+    fail_safe = "..."
+    return (
+        prompt_template,
+        prompt_input,
+        (prompt, CONVO_GPT_PARAM, 5, fail_safe, __func_validate, __func_clean_up),
     )
 
+
+def convo_output(output, persona, prompt_template, prompt_input, args, verbose):
+    prompt, gpt_param, _, fail_safe = args[:4]
     if verbose:
         print_run_prompts(
             prompt_template, persona, gpt_param, prompt_input, prompt, output
         )
-
     return output, [output, prompt, gpt_param, prompt_input, fail_safe]
 
 
-def run_gpt_prompt_memo_on_convo(persona, all_utt, test_input=None, verbose=False):
-    def create_prompt_input(persona, all_utt, test_input=None):
-        prompt_input = [
-            all_utt,
-            persona.scratch.name,
-            persona.scratch.name,
-            persona.scratch.name,
-        ]
-        return prompt_input
+def run_gpt_prompt_planning_thought_on_convo(
+    persona, all_utt, test_input=None, verbose=False
+):
+    prompt_template, prompt_input, args = convo_request(
+        persona, all_utt, "planning_thought_on_convo_v1.txt"
+    )
+    output = safe_generate_response(*args)
+    return convo_output(output, persona, prompt_template, prompt_input, args, verbose)
 
-    def __func_clean_up(gpt_response, prompt=""):
-        return gpt_response.split('"')[0].strip()
 
-    def __func_validate(gpt_response, prompt=""):
-        try:
-            __func_clean_up(gpt_response, prompt)
-            return True
-        except:
-            return False
+async def async_run_gpt_prompt_planning_thought_on_convo(
+    persona, all_utt, verbose=False
+):
+    """
+    run_gpt_prompt_planning_thought_on_convo, for the event loop, so that it
+    is generated together with the memo on the same conversation.
+    """
+    prompt_template, prompt_input, args = convo_request(
+        persona, all_utt, "planning_thought_on_convo_v1.txt"
+    )
+    output = await async_safe_generate_response(*args)
+    return convo_output(output, persona, prompt_template, prompt_input, args, verbose)
 
-    def get_fail_safe():
-        return "..."
 
-    # ChatGPT Plugin ===========================================================
+MEMO_GPT_PARAM = {
+    "engine": "text-davinci-002",
+    "max_tokens": 15,
+    "temperature": 0,
+    "top_p": 1,
+    "stream": False,
+    "frequency_penalty": 0,
+    "presence_penalty": 0,
+    "stop": None,
+}
+
+
+def memo_chat_request(persona, all_utt):
+    """
+    The prompt input, and the arguments to ChatGPT_safe_generate_response (or
+    async_ChatGPT_safe_generate_response), of the memo on a conversation.
+    When it fails, the memo falls back to convo_request.
+    """
+
     def __chat_func_clean_up(gpt_response, prompt=""):  ############
         return gpt_response.strip()
 
     def __chat_func_validate(gpt_response, prompt=""):  ############
         try:
-            __func_clean_up(gpt_response, prompt)
+            gpt_response.split('"')[0].strip()
             return True
         except:
             return False
 
-    print("asdhfapsh8p9hfaiafdsi;ldfj as DEBUG 15")  ########
-    gpt_param = {
-        "engine": "text-davinci-002",
-        "max_tokens": 15,
-        "temperature": 0,
-        "top_p": 1,
-        "stream": False,
-        "frequency_penalty": 0,
-        "presence_penalty": 0,
-        "stop": None,
-    }
     prompt_template = f"{parent_path}/v3_ChatGPT/memo_on_convo_v1.txt"  ########
-    prompt_input = create_prompt_input(persona, all_utt)  ########
+    prompt_input = [
+        all_utt,
+        persona.scratch.name,
+        persona.scratch.name,
+        persona.scratch.name,
+    ]
     prompt = generate_prompt(prompt_input, prompt_template)
     example_output = "Jane Doe was interesting to talk to."  ########
     special_instruction = "The output should ONLY contain a string that summarizes anything interesting that the agent may have noticed"  ########
-    fail_safe = get_fail_safe()  ########
-    output = ChatGPT_safe_generate_response(
+    fail_safe = "..."
+    return prompt_input, (
         prompt,
         example_output,
         special_instruction,
@@ -2679,32 +2706,35 @@ def run_gpt_prompt_memo_on_convo(persona, all_utt, test_input=None, verbose=Fals
         __chat_func_clean_up,
         True,
     )
-    if output != False:
-        return output, [output, prompt, gpt_param, prompt_input, fail_safe]
-    # ChatGPT Plugin ===========================================================
 
-    gpt_param = {
-        "engine": "text-davinci-003",
-        "max_tokens": 50,
-        "temperature": 0,
-        "top_p": 1,
-        "stream": False,
-        "frequency_penalty": 0,
-        "presence_penalty": 0,
-        "stop": None,
-    }
-    prompt_template = f"{parent_path}/v2/memo_on_convo_v1.txt"
-    prompt_input = create_prompt_input(persona, all_utt)
-    prompt = generate_prompt(prompt_input, prompt_template)
 
-    fail_safe = get_fail_safe()
-    output = safe_generate_response(
-        prompt, gpt_param, 5, fail_safe, __func_validate, __func_clean_up
+def run_gpt_prompt_memo_on_convo(persona, all_utt, test_input=None, verbose=False):
+    print("asdhfapsh8p9hfaiafdsi;ldfj as DEBUG 15")  ########
+    prompt_input, chat_args = memo_chat_request(persona, all_utt)
+    output = ChatGPT_safe_generate_response(*chat_args)
+    if output != False:
+        prompt, fail_safe = chat_args[0], chat_args[4]
+        return output, [output, prompt, MEMO_GPT_PARAM, prompt_input, fail_safe]
+
+    prompt_template, prompt_input, args = convo_request(
+        persona, all_utt, "memo_on_convo_v1.txt"
     )
+    output = safe_generate_response(*args)
+    return convo_output(output, persona, prompt_template, prompt_input, args, verbose)
 
-    if verbose:
-        print_run_prompts(
-            prompt_template, persona, gpt_param, prompt_input, prompt, output
-        )
 
-    return output, [output, prompt, gpt_param, prompt_input, fail_safe]
+async def async_run_gpt_prompt_memo_on_convo(persona, all_utt, verbose=False):
+    """
+    run_gpt_prompt_memo_on_convo, for the event loop.
+    """
+    prompt_input, chat_args = memo_chat_request(persona, all_utt)
+    output = await async_ChatGPT_safe_generate_response(*chat_args)
+    if output != False:
+        prompt, fail_safe = chat_args[0], chat_args[4]
+        return output, [output, prompt, MEMO_GPT_PARAM, prompt_input, fail_safe]
+
+    prompt_template, prompt_input, args = convo_request(
+        persona, all_utt, "memo_on_convo_v1.txt"
+    )
+    output = await async_safe_generate_response(*args)
+    return convo_output(output, persona, prompt_template, prompt_input, args, verbose)
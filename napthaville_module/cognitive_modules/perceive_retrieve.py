@@ -1,14 +1,11 @@
-import json
 import os
 import logging
 from datetime import datetime
 from napthaville.persona.cognitive_modules.perceive import perceive
-from napthaville.persona.cognitive_modules.retrieve import retrieve
-from napthaville.maze import Maze
-from napthaville.persona.persona import Persona
+from napthaville.persona.cognitive_modules.retrieve import retrieve, retrieve_nodes
+from napthaville_module.persona_cache import persona_cache
 from napthaville_module.utils import (
-    MAZE_FOLDER,
-    retrieve_maze_json_from_ipfs,
+    retrieve_maze_from_ipfs,
     setup_logging,
 )
 
@@ -24,47 +21,60 @@ def get_perceived_retrieved(task_params: dict):
     curr_time = datetime.strptime(task_params["curr_time"], "%B %d, %Y, %H:%M:%S")
     init_persona_name = task_params["init_persona_name"]
     persona_folder = f"{os.getenv('BASE_OUTPUT_DIR')}/{sims_folder}"
-    init_persona = Persona(init_persona_name, persona_folder)
+    init_persona = persona_cache.get(init_persona_name, persona_folder)
 
     # Retrieve maze_json from IPFS
     maze_ipfs_hash = task_params["maze_ipfs_hash"]
-    maze_json = retrieve_maze_json_from_ipfs(maze_ipfs_hash)
-    maze = Maze.from_json(maze_json, MAZE_FOLDER)
+    maze = retrieve_maze_from_ipfs(maze_ipfs_hash)
 
-    init_persona.scratch.curr_tile = curr_tile
+    perceived, new_day = perceive_step(init_persona, maze, curr_tile, curr_time)
+    retrieved = retrieve(persona=init_persona, perceived=perceived)
+
+    persona_cache.save(init_persona, persona_folder)
+
+    return {
+        "retrieved": retrieved,
+        "new_day": new_day,
+        "curr_time": curr_time.strftime("%B %d, %Y, %H:%M:%S"),
+    }
+
+
+def perceive_step(persona, maze, curr_tile, curr_time: datetime):
+    """
+    Moves the persona to curr_tile at curr_time, and has it perceive the maze.
 
-    logger.info(f"curr time {init_persona.scratch.curr_time}")
+    Returns:
+        The perceived event ConceptNodes, and whether curr_time starts the
+        persona's "First day", a "New day" or neither (False).
+    """
+    persona.scratch.curr_tile = curr_tile
+
+    logger.info(f"curr time {persona.scratch.curr_time}")
 
     new_day = False
-    if not init_persona.scratch.curr_time:
+    if not persona.scratch.curr_time:
         new_day = "First day"
-    elif init_persona.scratch.curr_time.strftime("%A %B %d") != curr_time.strftime(
+    elif persona.scratch.curr_time.strftime("%A %B %d") != curr_time.strftime(
         "%A %B %d"
     ):
         new_day = "New day"
 
     logger.info(f"new day {new_day}")
 
-    init_persona.scratch.curr_time = curr_time
+    persona.scratch.curr_time = curr_time
 
-    perceived = perceive(persona=init_persona, maze=maze)
-    logger.info(f"Perceived data for {init_persona_name}: {perceived}")
-    retrieved = retrieve(persona=init_persona, perceived=perceived)
+    perceived = perceive(persona=persona, maze=maze)
+    logger.info(f"Perceived data for {persona.name}: {perceived}")
+    return perceived, new_day
+
+
+def perceive_retrieve(persona, maze, curr_tile, curr_time: datetime):
+    """
+    get_perceived_retrieved on a loaded persona and maze, keeping the
+    retrieved ConceptNodes rather than their JSON.
 
-    init_persona.scratch.save(
-        f"{os.getenv('BASE_OUTPUT_DIR')}/{sims_folder}/bootstrap_memory/scratch.json"
-    )
-    init_persona.s_mem.save(
-        f"{os.getenv('BASE_OUTPUT_DIR')}/{sims_folder}/bootstrap_memory/spatial_memory.json"
-    )
-    init_persona.a_mem.save(
-        f"{os.getenv('BASE_OUTPUT_DIR')}/{sims_folder}/bootstrap_memory/associative_memory"
-    )
-
-    return json.dumps(
-        {
-            "retrieved": retrieved,
-            "new_day": new_day,
-            "curr_time": curr_time.strftime("%B %d, %Y, %H:%M:%S"),
-        }
-    )
+    Returns:
+        The retrieved dict, as retrieve_nodes returns it, and new_day.
+    """
+    perceived, new_day = perceive_step(persona, maze, curr_tile, curr_time)
+    return retrieve_nodes(persona=persona, perceived=perceived), new_day
@@ -0,0 +1,152 @@
+import math
+import logging
+from datetime import datetime
+from napthaville.persona.cognitive_modules.plan import _wait_react
+from napthaville.utils import scratch_to_dict
+from napthaville_module.persona_cache import persona_cache, persona_folder
+from napthaville_module.others.chat import generate_utterance
+from napthaville_module.cognitive_modules.perceive_retrieve import perceive_retrieve
+from napthaville_module.cognitive_modules.reflect_execute import reflect_execute
+from napthaville_module.cognitive_modules.plan import (
+    choose_reaction_mode,
+    focused_event_to_dict,
+    complete_plan_chat,
+    finish_plan,
+    finalise_target_chat,
+)
+from napthaville_module.utils import retrieve_maze_from_ipfs, setup_logging
+
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+def get_persona_step(task_params: dict):
+    """
+    Runs a whole step of one persona in this process: perceive, retrieve,
+    pick a reaction, plan, reflect and execute, on the same persona and maze
+    objects, so nothing is reloaded or sent through JSON between the stages
+    as it is with the fine-grained tasks.
+
+    A chat needs the persona chatted with. If it is in "sims_folders", the
+    chat runs here too; the caller must not be stepping that persona at the
+    same time, so local_simulation, which steps every persona at once, does
+    not pass it. Otherwise the step stops once the reaction is picked, and
+    the caller goes on with the fine-grained tasks (get_complete_plan_chat,
+    ..., get_reflect_execute) from what it returns.
+
+    Args:
+        task_params: "init_persona_name", "sims_folder", "curr_time",
+            "curr_tile", "maze_ipfs_hash", "personas" (the scratch of every
+            persona, by name) and "personas_curr_tiles", as the
+            fine-grained tasks take them, and optionally "sims_folders",
+            the sims folders of the personas it may chat with, by name.
+
+    Returns:
+        {"reaction_mode", "focused_event", "execution", "maze_delta"}.
+        "maze_delta" is the change the step made to the maze, as
+        Maze.diff_events returns it. A step stopped before a chat has no
+        "execution" (None) and returns "retrieved", "new_day" and
+        "curr_time", as get_perceived_retrieved does, instead.
+    """
+    init_persona_name = task_params["init_persona_name"]
+    folder = persona_folder(task_params["sims_folder"])
+    curr_time = datetime.strptime(task_params["curr_time"], "%B %d, %Y, %H:%M:%S")
+    personas = task_params["personas"]
+    sims_folders = task_params.get("sims_folders") or {}
+    persona = persona_cache.get(init_persona_name, folder)
+
+    maze = retrieve_maze_from_ipfs(task_params["maze_ipfs_hash"])
+    # Copies share the frozen per-tile event sets, so this keeps the events
+    # the step started from without copying them.
+    step_events = maze.copy().events
+
+    retrieved, new_day = perceive_retrieve(
+        persona, maze, task_params["curr_tile"], curr_time
+    )
+    # The retrieved nodes are only sent back for a chat run by the caller;
+    # choosing the focused event removes entries from the dict.
+    retrieved_json = {
+        event_desc: {
+            "curr_event": rel_ctx["curr_event"].to_dict(),
+            "events": [node.to_dict() for node in rel_ctx["events"]],
+            "thoughts": [node.to_dict() for node in rel_ctx["thoughts"]],
+        }
+        for event_desc, rel_ctx in retrieved.items()
+    }
+    reaction_mode, focused_event = choose_reaction_mode(
+        persona, maze, retrieved, new_day, personas
+    )
+    result = {
+        "reaction_mode": reaction_mode,
+        "focused_event": focused_event_to_dict(focused_event),
+    }
+
+    if reaction_mode and reaction_mode[:9] == "chat with":
+        target_persona_name = reaction_mode[9:].strip()
+        if target_persona_name not in sims_folders:
+            logger.info(f"{init_persona_name} will chat with {target_persona_name}")
+            persona_cache.save(persona, folder)
+            return {
+                **result,
+                "execution": None,
+                "maze_delta": maze.diff_events(step_events),
+                "retrieved": retrieved_json,
+                "new_day": new_day,
+                "curr_time": task_params["curr_time"],
+            }
+        target_folder = persona_folder(sims_folders[target_persona_name])
+        target_persona = persona_cache.get(target_persona_name, target_folder)
+        plan = chat_react_plan(maze, persona, target_persona)
+        persona_cache.save(target_persona, target_folder)
+    elif reaction_mode and reaction_mode[:4] == "wait":
+        _wait_react(persona, reaction_mode)
+        finish_plan(persona)
+        plan = persona.scratch.act_address
+    else:
+        finish_plan(persona)
+        plan = persona.scratch.act_address
+
+    execution = reflect_execute(
+        persona, maze, task_params["personas_curr_tiles"], plan
+    )
+    persona_cache.save(persona, folder)
+
+    return {
+        **result,
+        "execution": execution,
+        "maze_delta": maze.diff_events(step_events),
+    }
+
+
+def chat_react_plan(maze, persona, target_persona):
+    """
+    Has the two personas chat, and inserts the chat into both schedules.
+
+    Returns:
+        The persona's plan, its act address.
+    """
+    target_persona_name = target_persona.scratch.name
+    target_persona_description = target_persona.scratch.act_description
+    persona_description = persona.scratch.act_description
+
+    curr_chat = []
+    for i in range(8):
+        utt, _ = generate_utterance(
+            maze, persona, target_persona_name, target_persona_description, curr_chat
+        )
+        curr_chat += [[persona.scratch.name, utt]]
+        utt, _ = generate_utterance(
+            maze, target_persona, persona.scratch.name, persona_description, curr_chat
+        )
+        curr_chat += [[target_persona_name, utt]]
+        logger.info(f"Chat iteration {i+1} completed")
+
+    all_utt = "\n".join([f"{row[0]}: {row[1]}" for row in curr_chat])
+    convo_length = math.ceil(int(len(all_utt) / 8) / 30)
+
+    target_persona_return = complete_plan_chat(
+        persona, all_utt, convo_length, scratch_to_dict(target_persona.scratch)
+    )
+    finalise_target_chat(target_persona, target_persona_return)
+    return persona.scratch.act_address
@@ -1,16 +1,15 @@
 import os
-import json
 import logging
 from datetime import datetime
 from napthaville.persona.cognitive_modules.plan import plan as plan_function
 from napthaville.persona.cognitive_modules.plan import _wait_react, _chat_react
 from napthaville.maze import Maze
-from napthaville.persona.persona import Persona
+from napthaville_module.persona_cache import persona_cache
 from napthaville.persona.memory_structures.associative_memory import ConceptNode
 from napthaville.utils import dict_to_scratch
 from napthaville_module.utils import (
     MAZE_FOLDER,
-    retrieve_maze_json_from_ipfs,
+    retrieve_maze_from_ipfs,
     setup_logging,
 )
 from napthaville.persona.cognitive_modules.plan import (
@@ -26,26 +25,54 @@ logger = logging.getLogger(__name__)
 
 
 def get_reaction_mode(task_params: dict):
-    retrieved_json = json.loads(task_params["retrieved"])
-    retrieved = json_to_conceptnodes(retrieved_json)
+    retrieved = json_to_conceptnodes(task_params["retrieved"])
     new_day = task_params["new_day"]
     maze_ipfs_hash = task_params["maze_ipfs_hash"]
     sims_folder = task_params["sims_folder"]
     init_persona_name = task_params["init_persona_name"]
-    personas = json.loads(task_params["personas"])
-    maze_json = retrieve_maze_json_from_ipfs(maze_ipfs_hash)
-    maze = Maze.from_json(maze_json, MAZE_FOLDER)
+    personas = task_params["personas"]
+    maze = retrieve_maze_from_ipfs(maze_ipfs_hash)
     persona_folder = f"{os.getenv('BASE_OUTPUT_DIR')}/{sims_folder}"
-    persona = Persona(init_persona_name, persona_folder)
+    persona = persona_cache.get(init_persona_name, persona_folder)
 
     # add curr_time to persona scratch
     curr_time = datetime.strptime(task_params["curr_time"], "%B %d, %Y, %H:%M:%S")
     persona.scratch.curr_time = curr_time
 
+    reaction_mode, focused_event = choose_reaction_mode(
+        persona, maze, retrieved, new_day, personas
+    )
+
+    persona_cache.save(persona, persona_folder)
+
+    # return {
+    #     "reaction_mode": reaction_mode,
+    #     "focused_event": focused_event.to_dict() if focused_event else False
+    # }
+    return {
+        "reaction_mode": reaction_mode,
+        "focused_event": focused_event_to_dict(focused_event),
+    }
+
+
+def choose_reaction_mode(persona, maze, retrieved, new_day, personas):
+    """
+    Plans the persona's day if new_day, picks its next action if the last one
+    is done, and picks how it reacts to what it retrieved.
+
+    Args:
+        retrieved: The retrieved ConceptNodes, keyed by event description.
+        personas: The scratch dicts of every persona, keyed by name.
+
+    Returns:
+        The reaction mode ("chat with <name>", "wait: <time>" or False) and
+        the focused event (or False).
+    """
+    # The persona is saved once, by the caller.
     if new_day:
-        _long_term_planning(persona, new_day, f"{persona_folder}/bootstrap_memory")
+        _long_term_planning(persona, new_day)
     if persona.scratch.act_check_finished:
-        _determine_action(persona, maze, f"{persona_folder}/bootstrap_memory")
+        _determine_action(persona, maze)
 
     focused_event = False
     if retrieved.keys():
@@ -60,34 +87,18 @@ def get_reaction_mode(task_params: dict):
 
     logger.info(f"Focused event: {focused_event}")
     logger.info(f"Reaction mode: {reaction_mode}")
+    return reaction_mode, focused_event
+
 
+def focused_event_to_dict(focused_event):
     if isinstance(focused_event, dict):
+        focused_event = dict(focused_event)
         for k, v in focused_event.items():
             if isinstance(v, ConceptNode):
                 focused_event[k] = v.to_dict()
             if isinstance(v, list):
                 focused_event[k] = [e.to_dict() for e in v]
-
-    persona.scratch.save(
-        f"{os.getenv('BASE_OUTPUT_DIR')}/{sims_folder}/bootstrap_memory/scratch.json"
-    )
-    persona.s_mem.save(
-        f"{os.getenv('BASE_OUTPUT_DIR')}/{sims_folder}/bootstrap_memory/spatial_memory.json"
-    )
-    persona.a_mem.save(
-        f"{os.getenv('BASE_OUTPUT_DIR')}/{sims_folder}/bootstrap_memory/associative_memory"
-    )
-
-    # return {
-    #     "reaction_mode": reaction_mode,
-    #     "focused_event": focused_event.to_dict() if focused_event else False
-    # }
-    return json.dumps(
-        {
-            "reaction_mode": reaction_mode,
-            "focused_event": focused_event,
-        }
-    )
+    return focused_event
 
 
 def json_to_conceptnodes(retrieved_json):
@@ -106,11 +117,11 @@ def get_plan(task_params: dict):
     init_persona_name = task_params["init_persona_name"]
     sims_folder = task_params["sims_folder"]
     persona_folder = f"{os.getenv('BASE_OUTPUT_DIR')}/{sims_folder}"
-    init_persona = Persona(init_persona_name, persona_folder)
+    init_persona = persona_cache.get(init_persona_name, persona_folder)
 
     # JSON String to dict
     # key is the persona name, value is the persona scratch memory dict
-    _personas = json.loads(task_params["personas"])
+    _personas = task_params["personas"]
     personas = {}
     for persona_name, persona_dict in _personas.items():
         personas[persona_name] = dict_to_scratch(persona_dict)
@@ -119,7 +130,7 @@ def get_plan(task_params: dict):
 
     curr_tile = task_params["curr_tile"]
     curr_time = task_params["curr_time"]
-    retrieved = json.loads(task_params["retrieved"])
+    retrieved = task_params["retrieved"]
     init_persona.scratch.curr_tile = curr_tile
 
     new_day = False
@@ -142,7 +153,7 @@ def get_plan(task_params: dict):
 
     print(plan_result)
 
-    return json.dumps(plan_result)
+    return plan_result
 
 
 def get_complete_plan_chat(task_params: dict):
@@ -153,87 +164,76 @@ def get_complete_plan_chat(task_params: dict):
     convo_length = task_params["convo_length"]
     target_persona_scratch = task_params["target_persona_scratch"]
     personals_folder = f"{os.getenv('BASE_OUTPUT_DIR')}/{sims_folder}"
-    persona = Persona(persona_name, personals_folder)
-
-    logger.info(f"all_utt: {all_utt}")
-    logger.info(f"convo_length: {convo_length}")
-    logger.info(f"all utt type: {type(all_utt)}")
+    persona = persona_cache.get(persona_name, personals_folder)
 
-    to_return = _chat_react(
-        persona=persona,
-        target_persona_scratch=target_persona_scratch,
-        all_utt=all_utt,
-        convo_length=convo_length,
-        sims_folder=sims_folder,
-        init_persona_name=persona_name,
+    to_return = complete_plan_chat(
+        persona, all_utt, convo_length, target_persona_scratch
     )
 
-    if persona.scratch.act_event[1] != "chat with":
-        persona.scratch.chatting_with = None
-        persona.scratch.chat = None
-        persona.scratch.chatting_end_time = None
-
-    curr_persona_chat_buffer = persona.scratch.chatting_with_buffer
-    for persona_name, buffer_count in curr_persona_chat_buffer.items():
-        if persona_name != persona.scratch.chatting_with:
-            persona.scratch.chatting_with_buffer[persona_name] -= 1
-
-    persona.scratch.save(
-        f"{os.getenv('BASE_OUTPUT_DIR')}/{sims_folder}/bootstrap_memory/scratch.json"
-    )
-    persona.s_mem.save(
-        f"{os.getenv('BASE_OUTPUT_DIR')}/{sims_folder}/bootstrap_memory/spatial_memory.json"
-    )
-    persona.a_mem.save(
-        f"{os.getenv('BASE_OUTPUT_DIR')}/{sims_folder}/bootstrap_memory/associative_memory"
-    )
+    persona_cache.save(persona, personals_folder)
 
     # return json.dumps(persona.scratch.act_address)
-    return json.dumps(
-        {
-            "init_persona_act_address": persona.scratch.act_address,
-            "target_persona_return": to_return,
-        }
-    )
+    return {
+        "init_persona_act_address": persona.scratch.act_address,
+        "target_persona_return": to_return,
+    }
 
 
 def get_complete_plan_wait(task_params: dict):
     sims_folder = task_params["sims_folder"]
     init_persona_name = task_params["init_persona_name"]
     personals_folder = f"{os.getenv('BASE_OUTPUT_DIR')}/{sims_folder}"
-    persona = Persona(init_persona_name, personals_folder)
+    persona = persona_cache.get(init_persona_name, personals_folder)
     reaction_mode = task_params["reaction_mode"]
     _wait_react(persona, reaction_mode)
+    finish_plan(persona)
 
-    if persona.scratch.act_event[1] != "chat with":
-        persona.scratch.chatting_with = None
-        persona.scratch.chat = None
-        persona.scratch.chatting_end_time = None
-
-    curr_persona_chat_buffer = persona.scratch.chatting_with_buffer
-    for persona_name, buffer_count in curr_persona_chat_buffer.items():
-        if persona_name != persona.scratch.chatting_with:
-            persona.scratch.chatting_with_buffer[persona_name] -= 1
-
-    persona.scratch.save(
-        f"{os.getenv('BASE_OUTPUT_DIR')}/{sims_folder}/bootstrap_memory/scratch.json"
-    )
-    persona.s_mem.save(
-        f"{os.getenv('BASE_OUTPUT_DIR')}/{sims_folder}/bootstrap_memory/spatial_memory.json"
-    )
-    persona.a_mem.save(
-        f"{os.getenv('BASE_OUTPUT_DIR')}/{sims_folder}/bootstrap_memory/associative_memory"
-    )
+    persona_cache.save(persona, personals_folder)
 
-    return json.dumps(persona.scratch.act_address)
+    return persona.scratch.act_address
 
 
 def get_complete_plan_no_reaction(task_params: dict):
     sims_folder = task_params["sims_folder"]
     init_persona_name = task_params["init_persona_name"]
     personals_folder = f"{os.getenv('BASE_OUTPUT_DIR')}/{sims_folder}"
-    persona = Persona(init_persona_name, personals_folder)
+    persona = persona_cache.get(init_persona_name, personals_folder)
+    finish_plan(persona)
+
+    persona_cache.save(persona, personals_folder)
+
+    return persona.scratch.act_address
+
+
+def complete_plan_chat(persona, all_utt, convo_length, target_persona_scratch):
+    """
+    Inserts the chat into the persona's schedule.
+
+    Returns:
+        What finalise_target_chat needs to insert it into the schedule of the
+        persona it chatted with.
+    """
+    logger.info(f"all_utt: {all_utt}")
+    logger.info(f"convo_length: {convo_length}")
+    logger.info(f"all utt type: {type(all_utt)}")
+
+    to_return = _chat_react(
+        persona=persona,
+        target_persona_scratch=target_persona_scratch,
+        all_utt=all_utt,
+        convo_length=convo_length,
+        sims_folder=None,
+        init_persona_name=persona.name,
+    )
+    finish_plan(persona)
+    return to_return
+
 
+def finish_plan(persona):
+    """
+    Ends the persona's chat if its plan moved on from it, and counts down
+    the buffers that keep it from chatting with the same persona again.
+    """
     if persona.scratch.act_event[1] != "chat with":
         persona.scratch.chatting_with = None
         persona.scratch.chat = None
@@ -244,35 +244,38 @@ def get_complete_plan_no_reaction(task_params: dict):
         if persona_name != persona.scratch.chatting_with:
             persona.scratch.chatting_with_buffer[persona_name] -= 1
 
-    persona.scratch.save(
-        f"{os.getenv('BASE_OUTPUT_DIR')}/{sims_folder}/bootstrap_memory/scratch.json"
-    )
-    persona.s_mem.save(
-        f"{os.getenv('BASE_OUTPUT_DIR')}/{sims_folder}/bootstrap_memory/spatial_memory.json"
-    )
-    persona.a_mem.save(
-        f"{os.getenv('BASE_OUTPUT_DIR')}/{sims_folder}/bootstrap_memory/associative_memory"
-    )
-
-    return json.dumps(persona.scratch.act_address)
-
 
 def finalise_target_persona_chat(task_params: dict):
     target_persona_return = task_params["target_persona_return"]
     target_persona_name = task_params["target_persona_name"]
     sims_folder = task_params["sims_folder"]
     personals_folder = f"{os.getenv('BASE_OUTPUT_DIR')}/{sims_folder}"
-    persona = Persona(target_persona_name, personals_folder)
+    persona = persona_cache.get(target_persona_name, personals_folder)
+
+    finalise_target_chat(persona, target_persona_return)
 
+    persona_cache.save(persona, personals_folder)
+
+    persona_scratch = persona.scratch.to_dict()
+    logger.info(f"persona_scratch: {persona_scratch}")
+
+    return persona.scratch.act_address
+
+
+def finalise_target_chat(persona, target_persona_return):
+    """
+    Inserts a chat into the schedule of the persona it was with, from what
+    complete_plan_chat returned to the persona that started it.
+    """
     persona.scratch.f_daily_schedule[
         target_persona_return["start_index"] : target_persona_return["end_index"]
     ] = target_persona_return["ret"]
 
     # convert chatting end time to datetime
-    target_persona_return["chatting_end_time"] = datetime.strptime(
+    chatting_end_time = datetime.strptime(
         target_persona_return["chatting_end_time"], "%Y-%m-%dT%H:%M:%S"
     )
-    target_persona_return["act_start_time"] = datetime.strptime(
+    act_start_time = datetime.strptime(
         target_persona_return["act_start_time"], "%Y-%m-%dT%H:%M:%S"
     )
 
@@ -285,24 +288,9 @@ def finalise_target_persona_chat(task_params: dict):
         target_persona_return["chatting_with"],
         target_persona_return["chat"],
         target_persona_return["chatting_with_buffer"],
-        target_persona_return["chatting_end_time"],
+        chatting_end_time,
         target_persona_return["act_obj_description"],
         target_persona_return["act_obj_pronunciatio"],
         target_persona_return["act_obj_event"],
-        target_persona_return["act_start_time"],
-    )
-
-    persona.scratch.save(
-        f"{os.getenv('BASE_OUTPUT_DIR')}/{sims_folder}/bootstrap_memory/scratch.json"
-    )
-    persona.s_mem.save(
-        f"{os.getenv('BASE_OUTPUT_DIR')}/{sims_folder}/bootstrap_memory/spatial_memory.json"
+        act_start_time,
     )
-    persona.a_mem.save(
-        f"{os.getenv('BASE_OUTPUT_DIR')}/{sims_folder}/bootstrap_memory/associative_memory"
-    )
-
-    persona_scratch = persona.scratch.to_dict()
-    logger.info(f"persona_scratch: {persona_scratch}")
-
-    return json.dumps(persona.scratch.act_address)
@@ -0,0 +1,84 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict
+
+from napthaville.maze import Maze
+
+logger = logging.getLogger(__name__)
+
+MAZE_CACHE_SIZE = int(os.getenv("MAZE_CACHE_SIZE", "32"))
+
+
+class MazeCache:
+    """
+    LRU cache of deserialised mazes keyed by IPFS hash, kept for the life of
+    the worker process. IPFS content never changes under a hash, so entries
+    never go stale; they are only evicted.
+
+    The cached mazes are never handed out. Callers get a copy that shares the
+    static layers and the frozen per-tile event sets with the cached maze, and
+    only copies a tile's events when it writes to them.
+    """
+
+    def __init__(self, max_size: int = MAZE_CACHE_SIZE):
+        self.max_size = max_size
+        self._mazes: "OrderedDict[str, Maze]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, ipfs_hash: str, loader: Callable[[str], Maze]) -> Maze:
+        """
+        Return a private copy of the maze stored at ipfs_hash, calling
+        loader(ipfs_hash) to build it on a miss.
+
+        Args:
+        ipfs_hash (str): The IPFS hash of the maze state
+        loader (Callable[[str], Maze]): Builds the maze from the hash
+
+        Returns:
+        Maze: A copy the caller is free to change
+        """
+        with self._lock:
+            maze = self._mazes.get(ipfs_hash)
+            if maze is not None:
+                self._mazes.move_to_end(ipfs_hash)
+                self.hits += 1
+                return maze.copy()
+            self.misses += 1
+
+        maze = loader(ipfs_hash)
+        self.put(ipfs_hash, maze)
+        return maze.copy()
+
+    def put(self, ipfs_hash: str, maze: Maze):
+        """
+        Cache the current state of maze under ipfs_hash. The cache keeps its
+        own copy, so the caller can go on changing maze.
+        """
+        maze = maze.copy()
+        with self._lock:
+            self._mazes[ipfs_hash] = maze
+            self._mazes.move_to_end(ipfs_hash)
+            while len(self._mazes) > self.max_size:
+                self._mazes.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._mazes.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._mazes),
+                "max_size": self.max_size,
+            }
+
+
+maze_cache = MazeCache()
@@ -1,8 +1,7 @@
-import json
 import os
 import logging
 from napthaville.maze import Maze
-from napthaville.persona.persona import Persona
+from napthaville_module.persona_cache import persona_cache
 from napthaville.persona.cognitive_modules.retrieve import new_retrieve
 from napthaville.persona.cognitive_modules.converse import (
     generate_summarize_agent_relationship,
@@ -19,22 +18,43 @@ def get_personal_info(task_params: dict):
     persona_name = task_params["init_persona_name"]
     sims_folder = task_params["sims_folder"]
     persona_folder = f"{os.getenv('BASE_OUTPUT_DIR')}/{sims_folder}"
-    persona = Persona(persona_name, persona_folder)
+    persona = persona_cache.get(persona_name, persona_folder)
     name = persona.scratch.name
     act_description = persona.scratch.act_description
     res = {"name": name, "act_description": act_description}
-    return json.dumps(res)
+    return res
 
 
 def get_utterence(task_params: dict):
     sims_folder = task_params["sims_folder"]
     persona_folder = f"{os.getenv('BASE_OUTPUT_DIR')}/{sims_folder}"
-    init_persona = Persona(task_params["init_persona_name"], persona_folder)
+    init_persona = persona_cache.get(task_params["init_persona_name"], persona_folder)
     target_persona_name = task_params["target_persona_name"]
     target_persona_description = task_params["target_persona_description"]
-    curr_chat = json.loads(task_params["curr_chat"])
+    curr_chat = task_params["curr_chat"]
     maze = Maze("maze", MAZE_FOLDER)
 
+    utt, end = generate_utterance(
+        maze, init_persona, target_persona_name, target_persona_description, curr_chat
+    )
+
+    curr_chat += [[init_persona.scratch.name, utt]]
+
+    res = {"utterance": utt, "end": end, "curr_chat": curr_chat}
+
+    return res
+
+
+def generate_utterance(
+    maze, init_persona, target_persona_name, target_persona_description, curr_chat
+):
+    """
+    The next thing init_persona says in curr_chat, a list of [speaker,
+    utterance] pairs, to the persona named target_persona_name.
+
+    Returns:
+        The utterance, and whether it ends the chat.
+    """
     focal_points = [f"{target_persona_name}"]
     retrieved = new_retrieve(init_persona, focal_points, 50)
     relationship = generate_summarize_agent_relationship(
@@ -56,7 +76,7 @@ def get_utterence(task_params: dict):
             f"{target_persona_name} is {target_persona_description}",
         ]
     retrieved = new_retrieve(init_persona, focal_points, 15)
-    utt, end = generate_one_utterance(
+    return generate_one_utterance(
         maze=maze,
         init_persona=init_persona,
         target_persona_name=target_persona_name,
@@ -64,9 +84,3 @@ def get_utterence(task_params: dict):
         retrieved=retrieved,
         curr_chat=curr_chat,
     )
-
-    curr_chat += [[init_persona.scratch.name, utt]]
-
-    res = {"utterance": utt, "end": end, "curr_chat": curr_chat}
-
-    return json.dumps(res)
@@ -1,16 +1,14 @@
-import json
 import uuid
 import os
 import shutil
 import logging
 from pathlib import Path
-from napthaville.maze import Maze
 from napthaville.persona.persona import Persona
 from napthaville_module.utils import (
     PERSONAS_FOLDER,
     MAZE_FOLDER,
-    retrieve_maze_json_from_ipfs,
-    upload_maze_json_to_ipfs,
+    retrieve_maze_from_ipfs,
+    upload_maze_to_ipfs,
     setup_logging,
 )
 
@@ -42,22 +40,18 @@ def fork_persona(task_params):
 
     # Retrieve maze_json from IPFS
     maze_ipfs_hash = task_params["maze_ipfs_hash"]
-    maze_json = retrieve_maze_json_from_ipfs(maze_ipfs_hash)
+    maze = retrieve_maze_from_ipfs(maze_ipfs_hash)
 
     curr_tile = task_params["curr_tile"]
-    maze = Maze.from_json(maze_json, MAZE_FOLDER)
     persona = Persona(task_params["persona_name"], new_persona_folder)
-    maze.tiles[curr_tile[1]][curr_tile[0]]["events"].add(
-        persona.scratch.get_curr_event_and_desc()
-    )
+    maze.add_event_from_tile(persona.scratch.get_curr_event_and_desc(), curr_tile)
 
     # Upload updated maze back to IPFS
-    updated_maze_json = maze.to_json()
-    new_maze_ipfs_hash = upload_maze_json_to_ipfs(updated_maze_json)
+    new_maze_ipfs_hash = upload_maze_to_ipfs(maze)
 
     to_return = {
         "maze_ipfs_hash": new_maze_ipfs_hash,
         "sims_folder": new_sims_folder.name,
     }
 
-    return json.dumps(to_return)
+    return to_return
@@ -0,0 +1,60 @@
+import logging
+from typing import Dict, Any
+from napthaville_module.utils import (
+    retrieve_maze_from_ipfs,
+    upload_maze_to_ipfs,
+    setup_logging,
+)
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+def merge_maze_states(task_params: Dict[str, Any]) -> Dict[str, str]:
+    """
+    Merges the mazes personas changed independently, starting from the same
+    state, into one. The changes of each maze are applied in the order given,
+    so a later maze wins where two disagree, and the result only depends on
+    that order.
+
+    Args:
+        task_params: "maze_ipfs_hash", the state every persona started from,
+            and either "maze_ipfs_hashes", the states they ended in, or
+            "maze_changes", one {"maze_ipfs_hash": ...} or {"maze_delta":
+            ...} (as persona_step returns it) per persona.
+
+    Returns:
+        {"maze_ipfs_hash": the merged state}.
+    """
+    maze_ipfs_hash = task_params["maze_ipfs_hash"]
+    maze_changes = task_params.get("maze_changes")
+    if maze_changes is None:
+        maze_changes = [
+            {"maze_ipfs_hash": ipfs_hash}
+            for ipfs_hash in task_params["maze_ipfs_hashes"]
+        ]
+    maze_changes = [
+        change for change in maze_changes if _changes_maze(change, maze_ipfs_hash)
+    ]
+    if not maze_changes:
+        return {"maze_ipfs_hash": maze_ipfs_hash}
+
+    base = retrieve_maze_from_ipfs(maze_ipfs_hash)
+    merged = retrieve_maze_from_ipfs(maze_ipfs_hash)
+    for change in maze_changes:
+        if "maze_delta" in change:
+            merged.apply_event_patch(change["maze_delta"])
+        else:
+            maze = retrieve_maze_from_ipfs(change["maze_ipfs_hash"])
+            merged.apply_event_patch(maze.diff_events(base.events))
+
+    merged_hash = upload_maze_to_ipfs(merged)
+    logger.info(f"Merged {len(maze_changes)} maze changes into {merged_hash}")
+    return {"maze_ipfs_hash": merged_hash}
+
+
+def _changes_maze(change: Dict[str, Any], maze_ipfs_hash: str) -> bool:
+    if "maze_delta" in change:
+        delta = change["maze_delta"]
+        return bool(delta["added"] or delta["removed"])
+    return change["maze_ipfs_hash"] != maze_ipfs_hash
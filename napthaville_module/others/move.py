@@ -1,20 +1,17 @@
-import json
 import os
 import logging
 from typing import Dict, Any
 from datetime import datetime
-from napthaville.maze import Maze
-from napthaville.persona.persona import Persona
+from napthaville_module.persona_cache import persona_cache
 from napthaville.persona.cognitive_modules.perceive import perceive
 from napthaville.persona.cognitive_modules.retrieve import retrieve
 from napthaville.persona.cognitive_modules.reflect import reflect
 from napthaville.persona.cognitive_modules.execute import execute
 from napthaville.persona.cognitive_modules.plan import plan as cognitive_plan
-from napthaville.utils import dict_to_scratch, DateTimeEncoder
+from napthaville.utils import dict_to_scratch
 from napthaville_module.utils import (
-    MAZE_FOLDER,
-    retrieve_maze_json_from_ipfs,
-    upload_maze_json_to_ipfs,
+    retrieve_maze_from_ipfs,
+    upload_maze_to_ipfs,
     setup_logging,
 )
 
@@ -24,11 +21,11 @@ logger = logging.getLogger(__name__)
 
 def prepare_maze(persona, maze):
     p_x, p_y = persona.scratch.curr_tile
-    maze.tiles[p_y][p_x]["events"].add(persona.scratch.get_curr_event_and_desc())
+    maze.add_event_from_tile(persona.scratch.get_curr_event_and_desc(), (p_x, p_y))
     return maze
 
 
-def get_move(task_params: Dict[str, Any]) -> str:
+def get_move(task_params: Dict[str, Any]) -> Dict[str, Any]:
     try:
         sims_folder = task_params["sims_folder"]
         curr_tile = task_params["curr_tile"]
@@ -38,9 +35,9 @@ def get_move(task_params: Dict[str, Any]) -> str:
         persona_folder = (
             f"{os.getenv('BASE_OUTPUT_DIR')}/{sims_folder}/{init_persona_name}"
         )
-        init_persona = Persona(init_persona_name, persona_folder)
+        init_persona = persona_cache.get(init_persona_name, persona_folder)
 
-        _personas = json.loads(task_params["personas"])
+        _personas = task_params["personas"]
         personas = {
             name: dict_to_scratch(persona_dict)
             for name, persona_dict in _personas.items()
@@ -48,8 +45,7 @@ def get_move(task_params: Dict[str, Any]) -> str:
 
         # Retrieve maze_json from IPFS
         maze_ipfs_hash = task_params["maze_ipfs_hash"]
-        maze_json = retrieve_maze_json_from_ipfs(maze_ipfs_hash)
-        maze = Maze.from_json(maze_json, MAZE_FOLDER)
+        maze = retrieve_maze_from_ipfs(maze_ipfs_hash)
 
         init_persona.scratch.curr_tile = curr_tile
 
@@ -74,15 +70,7 @@ def get_move(task_params: Dict[str, Any]) -> str:
         reflect(init_persona)
 
         # Save memories
-        init_persona.a_mem.save(
-            f"{os.getenv('BASE_OUTPUT_DIR')}/{sims_folder}/{init_persona_name}/bootstrap_memory/associative_memory"
-        )
-        init_persona.scratch.save(
-            f"{os.getenv('BASE_OUTPUT_DIR')}/{sims_folder}/{init_persona_name}/bootstrap_memory/scratch.json"
-        )
-        init_persona.s_mem.save(
-            f"{os.getenv('BASE_OUTPUT_DIR')}/{sims_folder}/{init_persona_name}/bootstrap_memory/spatial_memory.json"
-        )
+        persona_cache.save(init_persona, persona_folder)
 
         persona_names_curr_tile = {
             name: persona["curr_tile"] for name, persona in personas.items()
@@ -95,8 +83,7 @@ def get_move(task_params: Dict[str, Any]) -> str:
         )
 
         # Upload updated maze back to IPFS
-        updated_maze_json = maze.to_json()
-        new_maze_ipfs_hash = upload_maze_json_to_ipfs(updated_maze_json)
+        new_maze_ipfs_hash = upload_maze_to_ipfs(maze)
 
         to_return = {
             "execute_response": execute_response,
@@ -104,8 +91,8 @@ def get_move(task_params: Dict[str, Any]) -> str:
             "maze_ipfs_hash": new_maze_ipfs_hash,
         }
 
-        return json.dumps(to_return, cls=DateTimeEncoder)
+        return to_return
 
     except Exception as e:
         logger.error(f"Error in get_move: {str(e)}")
-        return json.dumps({"error": str(e)})
+        return {"error": str(e)}
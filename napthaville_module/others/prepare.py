@@ -1,4 +1,3 @@
-import json
 import os
 import yaml
 import uuid
@@ -12,8 +11,8 @@ from napthaville.persona.cognitive_modules.converse import load_history_via_whis
 from napthaville_module.utils import (
     PERSONAS_FOLDER,
     MAZE_FOLDER,
-    retrieve_maze_json_from_ipfs,
-    upload_maze_json_to_ipfs,
+    retrieve_maze_from_ipfs,
+    upload_maze_to_ipfs,
     get_folder_from_ipfs,
     setup_logging,
 )
@@ -54,16 +53,12 @@ def prepare_persona(task_params: dict):
 
     # 4. Retrieve maze_json from IPFS
     maze_ipfs_hash = task_params["maze_ipfs_hash"]
-    maze_json = retrieve_maze_json_from_ipfs(maze_ipfs_hash)
     curr_tile = task_params["curr_tile"]
-    maze = Maze.from_json(maze_json, MAZE_FOLDER)
-    maze.tiles[curr_tile[1]][curr_tile[0]]["events"].add(
-        persona.scratch.get_curr_event_and_desc()
-    )
+    maze = retrieve_maze_from_ipfs(maze_ipfs_hash)
+    maze.add_event_from_tile(persona.scratch.get_curr_event_and_desc(), curr_tile)
 
     # Upload updated maze back to IPFS
-    updated_maze_json = maze.to_json()
-    new_maze_ipfs_hash = upload_maze_json_to_ipfs(updated_maze_json)
+    new_maze_ipfs_hash = upload_maze_to_ipfs(maze)
 
     # 4. save persona
     persona.a_mem.save(f"{new_persona_folder}/bootstrap_memory/associative_memory")
@@ -76,7 +71,7 @@ def prepare_persona(task_params: dict):
         "sims_folder": f"{folder_id}/{persona_ipfs_hash}",
     }
 
-    return json.dumps(to_return)
+    return to_return
 
 
 def fork_persona(task_params):
@@ -103,25 +98,21 @@ def fork_persona(task_params):
     # Retrieve maze_json from IPFS
     maze_ipfs_hash = task_params["maze_ipfs_hash"]
     logger.info(f"maze_ipfs_hash: {maze_ipfs_hash}")
-    maze_json = retrieve_maze_json_from_ipfs(maze_ipfs_hash)
+    maze = retrieve_maze_from_ipfs(maze_ipfs_hash)
 
     curr_tile = task_params["curr_tile"]
-    maze = Maze.from_json(maze_json, MAZE_FOLDER)
     persona = Persona(task_params["persona_name"], new_persona_folder)
-    maze.tiles[curr_tile[1]][curr_tile[0]]["events"].add(
-        persona.scratch.get_curr_event_and_desc()
-    )
+    maze.add_event_from_tile(persona.scratch.get_curr_event_and_desc(), curr_tile)
 
     # Upload updated maze back to IPFS
-    updated_maze_json = maze.to_json()
-    new_maze_ipfs_hash = upload_maze_json_to_ipfs(updated_maze_json)
+    new_maze_ipfs_hash = upload_maze_to_ipfs(maze)
 
     to_return = {
         "maze_ipfs_hash": new_maze_ipfs_hash,
         "sims_folder": new_sims_folder.name,
     }
 
-    return json.dumps(to_return)
+    return to_return
 
 
 if __name__ == "__main__":
@@ -136,8 +127,7 @@ if __name__ == "__main__":
     maze = Maze(
         "test", "/Users/arshath/play/playground/customizeable_personas/the_ville/matrix"
     )
-    maze_json = maze.to_json()
-    maze_ipfs_hash = upload_maze_json_to_ipfs(maze_json)
+    maze_ipfs_hash = upload_maze_to_ipfs(maze)
     logger.info(f"maze_ipfs_hash: {maze_ipfs_hash}")
 
     personas = {
@@ -1,7 +1,6 @@
-import json
 import os
 import logging
-from napthaville.persona.persona import Persona
+from napthaville_module.persona_cache import persona_cache
 from napthaville.utils import scratch_to_dict
 from napthaville_module.utils import setup_logging
 
@@ -15,6 +14,6 @@ def get_scratch(task_params: dict):
     persona_name = task_params["persona_name"]
     sims_folder = task_params["sims_folder"]
     persona_folder = f"{os.getenv('BASE_OUTPUT_DIR')}/{sims_folder}"
-    persona = Persona(persona_name, persona_folder)
+    persona = persona_cache.get(persona_name, persona_folder)
     scratch = scratch_to_dict(persona.scratch)
-    return json.dumps(scratch)
+    return scratch
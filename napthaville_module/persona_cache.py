@@ -0,0 +1,259 @@
+import os
+import atexit
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from napthaville.persona.persona import Persona
+
+logger = logging.getLogger(__name__)
+
+PERSONA_CACHE_SIZE = int(os.getenv("PERSONA_CACHE_SIZE", "64"))
+# "back" keeps the changes of a task in memory until the persona is flushed
+# (by the flush_personas or evict_personas task, on eviction, or at exit);
+# "through" saves them at the end of every task.
+PERSONA_CACHE_WRITE = os.getenv("PERSONA_CACHE_WRITE", "back")
+
+
+def persona_folder(sims_folder: str) -> str:
+    return f"{os.getenv('BASE_OUTPUT_DIR')}/{sims_folder}"
+
+
+def memory_version(folder: str) -> tuple:
+    """
+    The version of the memory saved in a persona folder: the modification
+    time and size of each of its files.
+    """
+    bootstrap_folder = f"{folder}/bootstrap_memory"
+    paths = [
+        f"{bootstrap_folder}/scratch.json",
+        f"{bootstrap_folder}/spatial_memory.json",
+    ]
+    try:
+        with os.scandir(f"{bootstrap_folder}/associative_memory") as entries:
+            paths += sorted(entry.path for entry in entries if entry.is_file())
+    except FileNotFoundError:
+        pass
+
+    version = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            version.append((path, stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            version.append((path, None, None))
+    return tuple(version)
+
+
+class CachedPersona:
+    def __init__(self, persona: Persona, folder: str, version: tuple):
+        self.persona = persona
+        self.folder = folder
+        # <version> is the memory_version of the folder when the persona was
+        # last loaded from or saved to it.
+        self.version = version
+        self.dirty = False
+        self.lock = threading.Lock()
+
+
+class PersonaCache:
+    """
+    LRU cache of loaded personas keyed by persona folder, kept for the life
+    of the worker process, so that the tasks of a step load each persona
+    once rather than once per task.
+
+    A clean persona is reloaded when the files in its folder change under
+    it. A dirty one (write-back, changed since its last save) is what this
+    worker process last made of the persona, so it is kept over the files
+    until it is flushed, with a warning that the files changed.
+    """
+
+    def __init__(
+        self,
+        max_size: int = PERSONA_CACHE_SIZE,
+        write_back: bool = PERSONA_CACHE_WRITE == "back",
+    ):
+        self.max_size = max_size
+        self.write_back = write_back
+        self._personas: "OrderedDict[str, CachedPersona]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._task = threading.local()
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.writes = 0
+        self.discarded = 0
+
+    def get(self, name: str, folder: str) -> Persona:
+        """
+        Return the persona saved in folder, loading it on a miss. The caller
+        changes the cached persona itself, and calls save when done.
+
+        Args:
+        name (str): The persona's name
+        folder (str): The persona folder, as passed to Persona
+
+        Returns:
+        Persona: The cached persona
+        """
+        with self._lock:
+            entry = self._personas.get(folder)
+            if entry is not None and entry.persona.name == name:
+                version = memory_version(folder)
+                if entry.dirty and version != entry.version:
+                    logger.warning(
+                        f"Persona {folder} changed on disk while it has unflushed "
+                        "changes here; the files will be overwritten when it is "
+                        "flushed"
+                    )
+                    # Warn once per change on disk.
+                    entry.version = version
+                if entry.dirty or version == entry.version:
+                    self._personas.move_to_end(folder)
+                    self.hits += 1
+                    self._touch(folder)
+                    return entry.persona
+                self.reloads += 1
+                del self._personas[folder]
+            self.misses += 1
+
+        # The version is read before loading, so a change made while loading
+        # shows up as a stale version on the next get.
+        version = memory_version(folder)
+        entry = CachedPersona(Persona(name, folder), folder, version)
+        if self.max_size <= 0:
+            return entry.persona
+
+        with self._lock:
+            self._personas[folder] = entry
+            self._personas.move_to_end(folder)
+            evicted = []
+            while len(self._personas) > self.max_size:
+                evicted.append(self._personas.popitem(last=False)[1])
+            self._touch(folder)
+        for old_entry in evicted:
+            self._write(old_entry)
+        return entry.persona
+
+    def save(self, persona: Persona, folder: str):
+        """
+        Record that a task is done changing persona: saved now when writing
+        through (or when the persona is not cached), marked dirty otherwise.
+        """
+        with self._lock:
+            entry = self._personas.get(folder)
+        if entry is None or entry.persona is not persona:
+            persona.save(f"{folder}/bootstrap_memory")
+            self.writes += 1
+            return
+        entry.dirty = True
+        if not self.write_back:
+            self._write(entry)
+
+    def _write(self, entry: CachedPersona):
+        with entry.lock:
+            if not entry.dirty:
+                return
+            entry.persona.save(f"{entry.folder}/bootstrap_memory")
+            entry.version = memory_version(entry.folder)
+            entry.dirty = False
+            self.writes += 1
+
+    def _entries(self, folder: Optional[str]):
+        with self._lock:
+            if folder is None:
+                return list(self._personas.values())
+            entry = self._personas.get(folder)
+            return [entry] if entry is not None else []
+
+    def flush(self, folder: Optional[str] = None) -> int:
+        """
+        Save the dirty personas, all of them or the one in folder. Call it
+        when no task is changing them.
+
+        Returns:
+        int: The number of personas saved
+        """
+        dirty = [entry for entry in self._entries(folder) if entry.dirty]
+        for entry in dirty:
+            self._write(entry)
+        return len(dirty)
+
+    def evict(self, folder: Optional[str] = None) -> int:
+        """
+        Flush and drop the cached personas, all of them or the one in folder.
+
+        Returns:
+        int: The number of personas dropped
+        """
+        entries = self._entries(folder)
+        for entry in entries:
+            self._write(entry)
+        with self._lock:
+            for entry in entries:
+                if self._personas.get(entry.folder) is entry:
+                    del self._personas[entry.folder]
+        return len(entries)
+
+    def _touch(self, folder: str):
+        touched = getattr(self._task, "touched", None)
+        if touched is not None:
+            touched.add(folder)
+
+    @contextmanager
+    def task(self):
+        """
+        Wraps a module task. If the task fails, the personas it got are
+        dropped without being saved, since it may have left them half
+        changed, so the next task reloads them from their last save. The
+        changes earlier tasks made to them and that were not flushed yet are
+        lost with them, with a warning.
+        """
+        self._task.touched = set()
+        try:
+            yield
+        except BaseException:
+            for entry in self._entries(None):
+                if entry.folder not in self._task.touched:
+                    continue
+                if entry.dirty:
+                    logger.warning(
+                        f"Task failed on unflushed persona {entry.folder}; "
+                        "discarding its changes since the last flush"
+                    )
+                with self._lock:
+                    if self._personas.get(entry.folder) is entry:
+                        del self._personas[entry.folder]
+                        self.discarded += 1
+            raise
+        finally:
+            self._task.touched = None
+
+    def clear(self):
+        self.evict()
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.reloads = 0
+            self.writes = 0
+            self.discarded = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "reloads": self.reloads,
+                "writes": self.writes,
+                "discarded": self.discarded,
+                "size": len(self._personas),
+                "dirty": sum(entry.dirty for entry in self._personas.values()),
+                "max_size": self.max_size,
+                "write_back": self.write_back,
+            }
+
+
+persona_cache = PersonaCache()
+atexit.register(persona_cache.flush)
@@ -1,16 +1,35 @@
-import json
+import os
+import asyncio
 import logging
-from napthaville_module.schemas import InputSchema
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional, Set, Union
+from napthaville_module.schemas import (
+    InputSchema,
+    encode_result,
+    parse_task_params,
+    unpack_input,
+)
 from napthaville_module.others.chat import get_personal_info, get_utterence
 from napthaville_module.cognitive_modules.reflect_execute import get_reflect_execute
 from napthaville_module.cognitive_modules.perceive_retrieve import (
     get_perceived_retrieved,
 )
 from napthaville_module.cognitive_modules.plan import get_plan
+from napthaville_module.cognitive_modules.persona_step import get_persona_step
 from napthaville_module.others.scratch import get_scratch
 from napthaville_module.others.move import get_move
 from napthaville_module.others.prepare import prepare_persona, fork_persona
+from napthaville_module.others.merge_maze import merge_maze_states
 from napthaville_module.utils import BASE_OUTPUT_DIR, setup_logging
+from napthaville_module.maze_cache import maze_cache
+from napthaville_module.persona_cache import persona_cache, persona_folder
+from napthaville.persona.prompt_template.embedding_cache import embedding_cache
+from napthaville.persona.prompt_template.completion_cache import completion_cache
+from napthaville.persona.prompt_template.rate_limiter import (
+    chat_limiter,
+    gpt4_limiter,
+    embedding_limiter,
+)
 from napthaville_module.cognitive_modules.plan import get_reaction_mode
 from napthaville_module.cognitive_modules.plan import (
     get_complete_plan_chat,
@@ -22,22 +41,51 @@ from napthaville_module.cognitive_modules.plan import (
 setup_logging()
 logger = logging.getLogger(__name__)
 
+BATCH_MAX_WORKERS = int(os.getenv("BATCH_MAX_WORKERS", "8"))
+
 
 def run(
-    inputs: InputSchema,
+    inputs: Union[InputSchema, bytes],
     worker_nodes=None,
     orchestrator_node=None,
     flow_run=None,
     cfg: dict = None,
 ):
+    """
+    Runs a module task.
+
+    Args:
+        inputs: The task and its parameters, or them packed with
+            schemas.pack_input.
+
+    Returns:
+        The result in the wire format inputs.wire_format asks for: a JSON
+        string by default, msgpack bytes for "msgpack" (schemas.decode_result
+        reads both).
+    """
+    if isinstance(inputs, (bytes, bytearray)):
+        inputs = unpack_input(inputs)
+    wire_format = getattr(inputs, "wire_format", "json")
     if BASE_OUTPUT_DIR is None:
-        return json.dumps({"error": "BASE_OUTPUT_DIR is not set"})
+        return encode_result({"error": "BASE_OUTPUT_DIR is not set"}, wire_format)
     # logger.info(f"Running task {inputs.task} with params {inputs.task_params}")
 
-    task = inputs.task
-    task_params = inputs.task_params
+    with persona_cache.task():
+        result = run_task(inputs.task, inputs.task_params)
+    return encode_result(result, wire_format)
+
+
+def run_task(task: str, task_params: dict):
+    """
+    Runs a module task and returns its result as Python objects, for run to
+    encode once.
+    """
+    task_params = parse_task_params(task, task_params)
 
-    if task == "get_personal_info":
+    if task == "batch":
+        return run_batch(task_params)
+
+    elif task == "get_personal_info":
         return get_personal_info(task_params)
 
     elif task == "get_utterence":
@@ -79,5 +127,140 @@ def run(
     elif task == "finalise_target_persona_chat":
         return finalise_target_persona_chat(task_params)
 
+    elif task == "persona_step":
+        return get_persona_step(task_params)
+
+    elif task == "merge_maze_states":
+        return merge_maze_states(task_params)
+
+    elif task == "flush_personas":
+        folder = task_params.get("sims_folder")
+        return {"flushed": persona_cache.flush(folder and persona_folder(folder))}
+
+    elif task == "evict_personas":
+        folder = task_params.get("sims_folder")
+        return {"evicted": persona_cache.evict(folder and persona_folder(folder))}
+
+    elif task == "get_persona_cache_stats":
+        return persona_cache.stats()
+
+    elif task == "get_maze_cache_stats":
+        return maze_cache.stats()
+
+    elif task == "get_embedding_cache_stats":
+        return embedding_cache.stats()
+
+    elif task == "get_llm_cache_stats":
+        return completion_cache.stats()
+
+    elif task == "get_rate_limiter_stats":
+        return [
+            limiter.stats()
+            for limiter in (chat_limiter, gpt4_limiter, embedding_limiter)
+        ]
+
+    elif task == "get_worker_stats":
+        # Every stats task above, in one round trip.
+        return {
+            name: run_task(f"get_{name}_stats", {})
+            for name in [
+                "persona_cache",
+                "maze_cache",
+                "embedding_cache",
+                "llm_cache",
+                "rate_limiter",
+            ]
+        }
+
     else:
-        return json.dumps({"error": f"Task {task} not found"})
+        return {"error": f"Task {task} not found"}
+
+
+def run_batch(task_params: dict) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Runs a list of tasks in one call. Tasks run concurrently on a thread
+    pool, in this process, so they share the personas and mazes it has
+    loaded; tasks on the same persona folder run one after another, in the
+    order given, as do flush_personas and evict_personas for every folder.
+
+    Args:
+        task_params: "tasks", a list of {"task", "task_params"}, and
+            optionally "max_workers".
+
+    Returns:
+        {"results": [...]}, one {"result": the task's result} or
+        {"error": why it failed} per task, in the order given.
+    """
+    tasks = task_params["tasks"]
+    max_workers = task_params.get("max_workers", BATCH_MAX_WORKERS)
+    folders = [_task_folders(item) for item in tasks]
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = []
+        for i, item in enumerate(tasks):
+            # Every task waits for the earlier ones it shares a folder with.
+            # Those were submitted first, so they are running or done by the
+            # time a thread picks this one up.
+            after = [
+                future
+                for future, earlier in zip(futures, folders[:i])
+                if folders[i] is None or earlier is None or folders[i] & earlier
+            ]
+            futures.append(executor.submit(_run_batch_item, item, after))
+        results = [future.result() for future in futures]
+
+    return {"results": results}
+
+
+def _task_folders(item: Dict[str, Any]) -> Optional[Set[str]]:
+    """
+    The sims folders a batch item changes, or None for all of them.
+    """
+    task_params = item.get("task_params") or {}
+    folders = set((task_params.get("sims_folders") or {}).values())
+    if task_params.get("sims_folder"):
+        folders.add(task_params["sims_folder"])
+    elif item.get("task") in ("flush_personas", "evict_personas"):
+        return None
+    return folders
+
+
+def _run_batch_item(item: Dict[str, Any], after: List) -> Dict[str, Any]:
+    wait(after)
+    try:
+        if item["task"] == "batch":
+            raise ValueError("A batch cannot contain a batch")
+        with persona_cache.task():
+            result = run_task(item["task"], item.get("task_params") or {})
+    except Exception as e:
+        logger.exception(f"Batch task {item.get('task')} failed")
+        return {"error": f"{type(e).__name__}: {e}"}
+    # run_task reports an unknown task as {"error": ...}.
+    if isinstance(result, dict) and list(result) == ["error"]:
+        return result
+    return {"result": result}
+
+
+async def run_async(
+    inputs: InputSchema,
+    worker_nodes=None,
+    orchestrator_node=None,
+    flow_run=None,
+    cfg: dict = None,
+):
+    """
+    run, for callers on an event loop. This is not an async request path:
+    the task itself is synchronous (only the poignancy prompts of perceive
+    go out together, through run_concurrently), and runs on a worker thread,
+    so that the tasks of different personas can wait on the LLM provider
+    together rather than block the loop one after another.
+
+    Args:
+        inputs: The task and its parameters.
+
+    Returns:
+        What run returns.
+    """
+    return await asyncio.to_thread(
+        run, inputs, worker_nodes, orchestrator_node, flow_run, cfg
+    )
@@ -1,7 +1,212 @@
-from pydantic import BaseModel
-from typing import Dict, Any
+import json
+from datetime import datetime
+from typing import Annotated, Any, Dict, Optional, Union
+from pydantic import BaseModel, BeforeValidator, ConfigDict
+from napthaville.utils import DateTimeEncoder
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Bumped whenever the encoding of inputs or results changes incompatibly.
+WIRE_FORMAT_VERSION = 1
+# The wire formats this worker can answer in.
+WIRE_FORMATS = ("json", "msgpack") if msgpack is not None else ("json",)
+# msgpack extension types for the values msgpack has no type for.
+EXT_DATETIME = 1
+EXT_TUPLE = 2
 
 
 class InputSchema(BaseModel):
     task: str
     task_params: Dict[str, Any]
+    # The format the caller wants the result in: "json", a JSON string, or
+    # "msgpack", msgpack bytes. A worker without msgpack answers in JSON;
+    # decode_result reads either.
+    wire_format: str = "json"
+
+
+def _parse_json(value: Any) -> Any:
+    # Older callers send nested values as JSON strings inside the params.
+    if isinstance(value, (str, bytes)):
+        return json.loads(value)
+    return value
+
+
+Nested = Annotated[Any, BeforeValidator(_parse_json)]
+
+
+class TaskParams(BaseModel):
+    """
+    The params of a task. Params without a field are passed on as they are.
+    """
+
+    model_config = ConfigDict(extra="allow")
+
+
+class ReactionModeParams(TaskParams):
+    init_persona_name: str
+    sims_folder: str
+    curr_time: str
+    maze_ipfs_hash: str
+    new_day: Union[bool, str]
+    # The retrieved dict, as get_perceived_retrieved returns it.
+    retrieved: Nested
+    # The scratch of every persona, by name.
+    personas: Nested
+
+
+class UtteranceParams(TaskParams):
+    init_persona_name: str
+    sims_folder: str
+    target_persona_name: str
+    target_persona_description: str
+    # The chat so far, as [speaker, utterance] pairs.
+    curr_chat: Nested
+
+
+class PersonaStepParams(TaskParams):
+    init_persona_name: str
+    sims_folder: str
+    curr_time: str
+    curr_tile: Any
+    maze_ipfs_hash: str
+    personas: Nested
+    personas_curr_tiles: Dict[str, Any]
+    sims_folders: Optional[Dict[str, str]] = None
+
+
+class MoveParams(TaskParams):
+    personas: Nested
+
+
+class PlanParams(TaskParams):
+    personas: Nested
+    retrieved: Nested
+
+
+TASK_PARAMS = {
+    "get_reaction_mode": ReactionModeParams,
+    "get_utterence": UtteranceParams,
+    "persona_step": PersonaStepParams,
+    "get_move": MoveParams,
+    "get_plan": PlanParams,
+}
+
+
+def parse_task_params(task: str, task_params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Validates the params of a task that has a model in TASK_PARAMS, and
+    decodes the nested values older callers send as JSON strings.
+
+    Args:
+        task: The task name.
+        task_params: The params as the caller sent them.
+
+    Returns:
+        The params, with nested values as Python objects.
+    """
+    model = TASK_PARAMS.get(task)
+    if model is None:
+        return task_params
+    return dict(model.model_validate(task_params))
+
+
+def _msgpack_default(obj: Any) -> Any:
+    if isinstance(obj, datetime):
+        return msgpack.ExtType(EXT_DATETIME, obj.isoformat().encode())
+    if isinstance(obj, tuple):
+        return msgpack.ExtType(EXT_TUPLE, _pack(list(obj)))
+    if isinstance(obj, dict):
+        return dict(obj)
+    if isinstance(obj, (list, set, frozenset)):
+        return list(obj)
+    # NumPy scalars.
+    if hasattr(obj, "item"):
+        return obj.item()
+    raise TypeError(f"Cannot encode {type(obj).__name__}")
+
+
+def _msgpack_ext_hook(code: int, data: bytes) -> Any:
+    if code == EXT_DATETIME:
+        return datetime.fromisoformat(data.decode())
+    if code == EXT_TUPLE:
+        return tuple(_unpack(data))
+    return msgpack.ExtType(code, data)
+
+
+def _pack(obj: Any) -> bytes:
+    # strict_types sends tuples (and subclasses of the msgpack types) to the
+    # default hook, rather than packing them as lists.
+    return msgpack.packb(
+        obj, default=_msgpack_default, strict_types=True, use_bin_type=True
+    )
+
+
+def _unpack(data: bytes) -> Any:
+    return msgpack.unpackb(
+        data, ext_hook=_msgpack_ext_hook, raw=False, strict_map_key=False
+    )
+
+
+def _check_version(envelope: Dict[str, Any]):
+    if envelope.get("version") != WIRE_FORMAT_VERSION:
+        raise ValueError(
+            f"Wire format version {envelope.get('version')} is not "
+            f"{WIRE_FORMAT_VERSION}"
+        )
+
+
+def encode_result(result: Any, wire_format: str = "json") -> Union[str, bytes]:
+    """
+    Encodes the result of a task in the wire format the caller asked for,
+    falling back to JSON if this worker does not have it.
+
+    Args:
+        result: The result, as the task returned it.
+        wire_format: "json" or "msgpack".
+
+    Returns:
+        A JSON string, or msgpack bytes. msgpack keeps datetimes and tuples;
+        JSON turns them into ISO strings and lists.
+    """
+    if wire_format == "msgpack" and msgpack is not None:
+        return _pack({"version": WIRE_FORMAT_VERSION, "result": result})
+    return json.dumps(result, cls=DateTimeEncoder)
+
+
+def decode_result(response: Union[str, bytes]) -> Any:
+    """
+    Decodes what encode_result returned, whichever format the worker used.
+    """
+    if isinstance(response, (bytes, bytearray)):
+        envelope = _unpack(response)
+        _check_version(envelope)
+        return envelope["result"]
+    return json.loads(response)
+
+
+def pack_input(inputs: InputSchema) -> bytes:
+    """
+    Encodes a task for transports that carry bytes, with its params as
+    msgpack rather than JSON.
+    """
+    return _pack(
+        {
+            "version": WIRE_FORMAT_VERSION,
+            "task": inputs.task,
+            "task_params": inputs.task_params,
+            "wire_format": inputs.wire_format,
+        }
+    )
+
+
+def unpack_input(data: bytes) -> InputSchema:
+    envelope = _unpack(data)
+    _check_version(envelope)
+    return InputSchema(
+        task=envelope["task"],
+        task_params=envelope["task_params"],
+        wire_format=envelope["wire_format"],
+    )
@@ -0,0 +1,425 @@
+import os
+import sys
+import json
+import queue
+import asyncio
+import hashlib
+import logging
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List
+
+import backoff
+import ipfshttpclient
+from requests.exceptions import ConnectionError, ReadTimeout
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+IPFS_GATEWAY_URL = os.getenv("IPFS_GATEWAY_URL", None)
+IPFS_POOL_SIZE = int(os.getenv("IPFS_POOL_SIZE", "8"))
+MAX_TRIES = 5
+MAX_TIME = 180
+
+# "ipfs" (default) or "local". The local store lives in LOCAL_STORAGE_DIR and
+# compresses objects with zstd when LOCAL_STORAGE_COMPRESSION is "zstd", which
+# needs the zstd extra.
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "ipfs")
+LOCAL_STORAGE_DIR = os.getenv(
+    "LOCAL_STORAGE_DIR", f"{os.getenv('BASE_OUTPUT_DIR')}/storage"
+)
+LOCAL_STORAGE_COMPRESSION = os.getenv("LOCAL_STORAGE_COMPRESSION", "none")
+
+# Marks the objects LocalStorage stores folders as.
+FOLDER_MANIFEST_TYPE = "napthaville_module/folder"
+FOLDER_MANIFEST_VERSION = 1
+
+IPFS_RETRY_EXCEPTIONS = (
+    ipfshttpclient.exceptions.ErrorResponse,
+    ipfshttpclient.exceptions.TimeoutError,
+    ipfshttpclient.exceptions.ConnectionError,
+    ConnectionError,
+    ReadTimeout,
+)
+
+
+class StorageBackend(ABC):
+    """
+    Content-addressed storage: every object is stored under a hash of its
+    content and read back by that hash. The simulation exchanges all of its
+    state (mazes, persona folders, simulation info) through this contract.
+
+    Subclasses implement the single-object methods. The bulk methods run them
+    concurrently on a thread pool, and the async variants hand the bulk
+    methods to the event loop's default executor.
+    """
+
+    max_workers = IPFS_POOL_SIZE
+
+    def __init__(self):
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    @abstractmethod
+    def add_str(self, data: str) -> str: ...
+
+    @abstractmethod
+    def cat(self, ipfs_hash: str) -> bytes: ...
+
+    @abstractmethod
+    def add_json(self, obj: Any) -> str: ...
+
+    @abstractmethod
+    def get_json(self, ipfs_hash: str) -> Any: ...
+
+    @abstractmethod
+    def get(self, ipfs_hash: str, target: str, read_only: bool = False):
+        """
+        Download the file or folder stored at ipfs_hash to target/ipfs_hash.
+        Pass read_only=True when the files will never be written to, which
+        lets a backend share them with its store instead of copying them.
+        """
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _map(self, fn, items: List) -> List:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix=type(self).__name__,
+                )
+        return list(self._executor.map(fn, items))
+
+    def add_many(self, datas: List[str]) -> List[str]:
+        """
+        Store many strings concurrently.
+
+        Args:
+        datas (List[str]): The strings to store
+
+        Returns:
+        List[str]: Their hashes, in the same order
+        """
+        return self._map(self.add_str, datas)
+
+    def cat_many(self, ipfs_hashes: List[str]) -> List[bytes]:
+        """
+        Read many objects concurrently.
+
+        Args:
+        ipfs_hashes (List[str]): The hashes to read
+
+        Returns:
+        List[bytes]: Their contents, in the same order
+        """
+        return self._map(self.cat, ipfs_hashes)
+
+    async def aadd_many(self, datas: List[str]) -> List[str]:
+        return await asyncio.to_thread(self.add_many, datas)
+
+    async def acat_many(self, ipfs_hashes: List[str]) -> List[bytes]:
+        return await asyncio.to_thread(self.cat_many, ipfs_hashes)
+
+
+class IPFSStorage(StorageBackend):
+    """
+    IPFS over the HTTP API, with a pool of persistent client sessions instead
+    of a new connection per call. Every call retries with exponential backoff.
+    """
+
+    def __init__(self, addr: str = IPFS_GATEWAY_URL, pool_size: int = IPFS_POOL_SIZE):
+        super().__init__()
+        self.addr = addr
+        self.max_workers = pool_size
+        # Idle clients. Clients are created on demand and at most <pool_size>
+        # of them are kept around.
+        self._clients = queue.LifoQueue(maxsize=pool_size)
+
+    @contextmanager
+    def _client(self):
+        try:
+            client = self._clients.get_nowait()
+        except queue.Empty:
+            client = ipfshttpclient.connect(self.addr, session=True)
+        try:
+            yield client
+        except BaseException:
+            # The session may be broken; the next call (or the retry) gets a
+            # fresh one.
+            client.close()
+            raise
+        else:
+            try:
+                self._clients.put_nowait(client)
+            except queue.Full:
+                client.close()
+
+    def close(self):
+        super().close()
+        while True:
+            try:
+                self._clients.get_nowait().close()
+            except queue.Empty:
+                break
+
+    @backoff.on_exception(
+        backoff.expo, IPFS_RETRY_EXCEPTIONS, max_tries=MAX_TRIES, max_time=MAX_TIME
+    )
+    def add_str(self, data: str) -> str:
+        with self._client() as client:
+            return client.add_str(data)
+
+    @backoff.on_exception(
+        backoff.expo, IPFS_RETRY_EXCEPTIONS, max_tries=MAX_TRIES, max_time=MAX_TIME
+    )
+    def cat(self, ipfs_hash: str) -> bytes:
+        with self._client() as client:
+            return client.cat(ipfs_hash)
+
+    @backoff.on_exception(
+        backoff.expo, IPFS_RETRY_EXCEPTIONS, max_tries=MAX_TRIES, max_time=MAX_TIME
+    )
+    def add_json(self, obj: Any) -> str:
+        with self._client() as client:
+            return client.add_json(obj)
+
+    @backoff.on_exception(
+        backoff.expo, IPFS_RETRY_EXCEPTIONS, max_tries=MAX_TRIES, max_time=MAX_TIME
+    )
+    def get_json(self, ipfs_hash: str) -> Any:
+        with self._client() as client:
+            return client.get_json(ipfs_hash)
+
+    @backoff.on_exception(
+        backoff.expo, IPFS_RETRY_EXCEPTIONS, max_tries=MAX_TRIES, max_time=MAX_TIME
+    )
+    def get(self, ipfs_hash: str, target: str, read_only: bool = False):
+        with self._client() as client:
+            client.get(ipfs_hash, target)
+
+
+class LocalStorage(StorageBackend):
+    """
+    A content-addressed store on the local filesystem, for running the whole
+    simulation on one node without IPFS. Objects are stored once under the
+    sha256 of their content in <root>/objects; adding the same content again
+    is a no-op. Folders are stored as a manifest object, marked with
+    FOLDER_MANIFEST_TYPE, mapping each relative path to the hash of its file.
+
+    Hashes from IPFS (e.g., BASE_MAZE_IPFS_HASH) can be pointed at local
+    objects with <alias>, so existing hashes keep working offline.
+    """
+
+    max_workers = os.cpu_count() or 4
+
+    def __init__(self, root: str = LOCAL_STORAGE_DIR, compression: str = "none"):
+        super().__init__()
+        self.root = root
+        if compression not in ("none", "zstd"):
+            raise ValueError(f"Unknown local storage compression: {compression}")
+        if compression == "zstd" and zstandard is None:
+            raise RuntimeError(
+                "zstd compression needs zstandard; install the zstd extra, "
+                "or set LOCAL_STORAGE_COMPRESSION=none"
+            )
+        self.compression = compression
+        os.makedirs(f"{root}/objects", exist_ok=True)
+        os.makedirs(f"{root}/refs", exist_ok=True)
+
+    def _resolve(self, ipfs_hash: str) -> str:
+        ref = f"{self.root}/refs/{ipfs_hash}"
+        if os.path.exists(ref):
+            with open(ref) as f:
+                return f.read().strip()
+        return ipfs_hash
+
+    def _object_path(self, digest: str) -> str:
+        return f"{self.root}/objects/{digest[:2]}/{digest}"
+
+    def _find(self, ipfs_hash: str) -> str:
+        path = self._object_path(self._resolve(ipfs_hash))
+        for candidate in [path, f"{path}.zst"]:
+            if os.path.exists(candidate):
+                return candidate
+        raise FileNotFoundError(f"{ipfs_hash} is not in the local store {self.root}")
+
+    def _write_atomic(self, path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def add_bytes(self, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._object_path(digest)
+        if os.path.exists(path) or os.path.exists(f"{path}.zst"):
+            return digest
+        if self.compression == "zstd":
+            self._write_atomic(
+                f"{path}.zst", zstandard.ZstdCompressor().compress(data)
+            )
+        else:
+            self._write_atomic(path, data)
+        return digest
+
+    def add_str(self, data: str) -> str:
+        return self.add_bytes(data.encode("utf-8"))
+
+    def cat(self, ipfs_hash: str) -> bytes:
+        path = self._find(ipfs_hash)
+        with open(path, "rb") as f:
+            data = f.read()
+        if path.endswith(".zst"):
+            if zstandard is None:
+                raise RuntimeError(f"zstandard is needed to read {path}")
+            data = zstandard.ZstdDecompressor().decompress(data)
+        return data
+
+    def add_json(self, obj: Any) -> str:
+        return self.add_str(json.dumps(obj, sort_keys=True))
+
+    def get_json(self, ipfs_hash: str) -> Any:
+        return json.loads(self.cat(ipfs_hash))
+
+    def add_folder(self, folder: str) -> str:
+        """
+        Store every file under folder and return the hash of its manifest.
+        """
+        files = dict()
+        for dirpath, _, filenames in os.walk(folder):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                with open(path, "rb") as f:
+                    files[os.path.relpath(path, folder)] = self.add_bytes(f.read())
+        return self.add_json(
+            {
+                "type": FOLDER_MANIFEST_TYPE,
+                "version": FOLDER_MANIFEST_VERSION,
+                "files": files,
+            }
+        )
+
+    def alias(self, ipfs_hash: str, local_hash: str):
+        """
+        Make ipfs_hash resolve to the local object local_hash.
+        """
+        self._write_atomic(f"{self.root}/refs/{ipfs_hash}", local_hash.encode())
+
+    def get(self, ipfs_hash: str, target: str, read_only: bool = False):
+        """
+        Write the file or folder stored at ipfs_hash to target/ipfs_hash.
+
+        Uncompressed files fetched with read_only=True are hard links to the
+        store, so a maze folder used by many simulations is stored once on
+        disk. Everything else is copied, because the persona code rewrites
+        its files in place and would otherwise change the stored object.
+        """
+        data = self.cat(ipfs_hash)
+        dest = os.path.join(target, ipfs_hash)
+        manifest = self._folder_manifest(data)
+        if manifest is None:
+            os.makedirs(target, exist_ok=True)
+            self._materialise(ipfs_hash, dest, read_only)
+            return
+
+        for relpath, digest in manifest["files"].items():
+            path = os.path.join(dest, relpath)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._materialise(digest, path, read_only)
+
+    @staticmethod
+    def _folder_manifest(data: bytes):
+        """
+        The folder manifest data holds, or None if it is an ordinary file.
+        """
+        if not data.startswith(b"{"):
+            return None
+        try:
+            manifest = json.loads(data)
+        except ValueError:
+            return None
+        if not isinstance(manifest, dict):
+            return None
+        if manifest.get("type") != FOLDER_MANIFEST_TYPE:
+            return None
+        if manifest.get("version") != FOLDER_MANIFEST_VERSION:
+            raise ValueError(
+                f"Unsupported folder manifest version {manifest.get('version')}"
+            )
+        return manifest
+
+    def _materialise(self, ipfs_hash: str, path: str, read_only: bool):
+        source = self._find(ipfs_hash)
+        if os.path.exists(path):
+            os.remove(path)
+        if read_only and not source.endswith(".zst"):
+            try:
+                os.link(source, path)
+                return
+            except OSError:
+                # e.g., the store is on another filesystem.
+                pass
+        with open(path, "wb") as f:
+            f.write(self.cat(ipfs_hash))
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage() -> StorageBackend:
+    """
+    Return the storage backend of this process, creating the one selected by
+    STORAGE_BACKEND on first use.
+    """
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            if STORAGE_BACKEND == "local":
+                _storage = LocalStorage(LOCAL_STORAGE_DIR, LOCAL_STORAGE_COMPRESSION)
+            elif STORAGE_BACKEND == "ipfs":
+                _storage = IPFSStorage()
+            else:
+                raise ValueError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
+        return _storage
+
+
+def set_storage(storage: StorageBackend) -> StorageBackend:
+    """
+    Replace the storage backend of this process, e.g. with a local store in
+    tests and benchmarks. Returns the previous backend.
+    """
+    global _storage
+    with _storage_lock:
+        previous, _storage = _storage, storage
+    return previous
+
+
+if __name__ == "__main__":
+    # Seed the local store so that an existing IPFS hash works offline:
+    #   python -m napthaville_module.storage <folder_or_file> [ipfs_hash]
+    if len(sys.argv) < 2:
+        print("usage: python -m napthaville_module.storage <path> [ipfs_hash]")
+        sys.exit(1)
+    storage = LocalStorage(LOCAL_STORAGE_DIR, LOCAL_STORAGE_COMPRESSION)
+    path = sys.argv[1]
+    if os.path.isdir(path):
+        local_hash = storage.add_folder(path)
+    else:
+        with open(path, "rb") as f:
+            local_hash = storage.add_bytes(f.read())
+    if len(sys.argv) > 2:
+        storage.alias(sys.argv[2], local_hash)
+    print(local_hash)
@@ -2,16 +2,13 @@ import os
 import json
 import logging
 import logging.config
-import backoff
-import ipfshttpclient
-from typing import Dict, Any
-from requests.exceptions import ConnectionError, ReadTimeout
+from typing import Dict, Any, List
+from napthaville.maze import Maze
+from napthaville_module.maze_cache import maze_cache
+from napthaville_module.storage import IPFS_GATEWAY_URL, get_storage
 
-IPFS_GATEWAY_URL = os.getenv("IPFS_GATEWAY_URL", None)
 BASE_OUTPUT_DIR = os.getenv("BASE_OUTPUT_DIR", None)
 PERSONAS_FOLDER = f"{BASE_OUTPUT_DIR}/napthaville/step-3-3/personas"
-MAX_TRIES = 5
-MAX_TIME = 180
 BASE_MAZE_IPFS_HASH = "QmWrCkdJHVb5MfQuL1yXh6Wt2Dxp7ajJPDH7cRRdEuBvAK"
 MAZE_FOLDER = f"{BASE_OUTPUT_DIR}/maze/{BASE_MAZE_IPFS_HASH}/matrix"
 
@@ -53,21 +50,10 @@ def setup_logging(default_level=logging.INFO, log_file="app.log"):
     logging.config.dictConfig(logging_config)
 
 
-@backoff.on_exception(
-    backoff.expo,
-    (
-        ipfshttpclient.exceptions.ErrorResponse,
-        ipfshttpclient.exceptions.TimeoutError,
-        ConnectionError,
-        ReadTimeout,
-    ),
-    max_tries=MAX_TRIES,
-    max_time=MAX_TIME,
-)
 def upload_maze_json_to_ipfs(maze_json: Dict[str, Any]) -> str:
     """
     Upload maze_json to IPFS and return the IPFS hash.
-    Includes exponential backoff and retry mechanism.
+    Retries with exponential backoff in the storage layer.
 
     Args:
     maze_json (Dict[str, Any]): The maze JSON to upload
@@ -76,41 +62,17 @@ def upload_maze_json_to_ipfs(maze_json: Dict[str, Any]) -> str:
     str: The IPFS hash of the uploaded maze_json
     """
     try:
-        with ipfshttpclient.connect(IPFS_GATEWAY_URL) as client:
-            # Convert maze_json to a JSON string
-            maze_json_str = json.dumps(maze_json)
-
-            # Add the JSON string to IPFS
-            res = client.add_str(maze_json_str)
-
-            # Return the IPFS hash
-            return res
-    except (
-        ipfshttpclient.exceptions.ErrorResponse,
-        ipfshttpclient.exceptions.TimeoutError,
-    ) as e:
-        print(f"Error uploading to IPFS (will retry): {str(e)}")
-        raise
+        # Convert maze_json to a JSON string and add it to IPFS
+        return get_storage().add_str(json.dumps(maze_json))
     except Exception as e:
-        print(f"Unexpected error uploading to IPFS: {str(e)}")
+        print(f"Error uploading to IPFS: {str(e)}")
         raise
 
 
-@backoff.on_exception(
-    backoff.expo,
-    (
-        ipfshttpclient.exceptions.ErrorResponse,
-        ipfshttpclient.exceptions.TimeoutError,
-        ConnectionError,
-        ReadTimeout,
-    ),
-    max_tries=MAX_TRIES,
-    max_time=MAX_TIME,
-)
 def retrieve_maze_json_from_ipfs(ipfs_hash: str) -> Dict[str, Any]:
     """
     Retrieve maze_json from IPFS using the provided hash.
-    Includes exponential backoff and retry mechanism.
+    Retries with exponential backoff in the storage layer.
 
     Args:
     ipfs_hash (str): The IPFS hash of the maze_json to retrieve
@@ -119,29 +81,93 @@ def retrieve_maze_json_from_ipfs(ipfs_hash: str) -> Dict[str, Any]:
     Dict[str, Any]: The retrieved maze JSON
     """
     try:
-        with ipfshttpclient.connect(IPFS_GATEWAY_URL) as client:
-            # Get the JSON string from IPFS
-            maze_json_str = client.cat(ipfs_hash)
-
-            # Parse the JSON string back into a dictionary
-            maze_json = json.loads(maze_json_str)
-
-            return maze_json
-    except (
-        ipfshttpclient.exceptions.ErrorResponse,
-        ipfshttpclient.exceptions.TimeoutError,
-    ) as e:
-        print(f"Error retrieving from IPFS (will retry): {str(e)}")
-        raise
+        # Parse the JSON string back into a dictionary
+        return json.loads(get_storage().cat(ipfs_hash))
     except Exception as e:
-        print(f"Unexpected error retrieving from IPFS: {str(e)}")
+        print(f"Error retrieving from IPFS: {str(e)}")
         raise
 
 
-def get_folder_from_ipfs(ipfs_hash: str, base_folder: str):
+def upload_maze_jsons_to_ipfs(maze_jsons: List[Dict[str, Any]]) -> List[str]:
+    """
+    Upload many maze JSONs to IPFS concurrently.
+
+    Args:
+    maze_jsons (List[Dict[str, Any]]): The maze JSONs to upload
+
+    Returns:
+    List[str]: Their IPFS hashes, in the same order
+    """
+    return get_storage().add_many([json.dumps(maze_json) for maze_json in maze_jsons])
+
+
+def retrieve_maze_jsons_from_ipfs(ipfs_hashes: List[str]) -> List[Dict[str, Any]]:
+    """
+    Retrieve many maze JSONs from IPFS concurrently.
+
+    Args:
+    ipfs_hashes (List[str]): The IPFS hashes to retrieve
+
+    Returns:
+    List[Dict[str, Any]]: The retrieved maze JSONs, in the same order
+    """
+    return [json.loads(data) for data in get_storage().cat_many(ipfs_hashes)]
+
+
+def upload_maze_to_ipfs(maze: Maze) -> str:
+    """
+    Upload the event state of a maze to IPFS. Only the events that changed
+    since the state the maze was loaded from are uploaded, as a patch against
+    that state's hash. The maze is also cached under the new hash, so the
+    next task that asks for it skips the fetch.
+
+    Args:
+    maze (Maze): The maze to upload
+
+    Returns:
+    str: The IPFS hash of the uploaded patch
+    """
+    ipfs_hash = upload_maze_json_to_ipfs(maze.to_patch_json())
+    maze_cache.put(ipfs_hash, maze)
+    return ipfs_hash
+
+
+def retrieve_maze_from_ipfs(ipfs_hash: str, maze_folder: str = MAZE_FOLDER) -> Maze:
+    """
+    Retrieve a maze stored with upload_maze_to_ipfs (or a full Maze.to_json
+    dump) and rebuild it on top of the static layers in maze_folder. Mazes
+    are cached per worker process by hash; the caller gets its own copy.
+
+    The returned maze keeps the state its patch was made against as its base,
+    so patches uploaded from it stay one step away from a full state.
+
+    Args:
+    ipfs_hash (str): The IPFS hash of the maze state or patch
+    maze_folder (str): The maze "matrix" folder
+
+    Returns:
+    Maze: The maze with its events restored
+    """
+    return maze_cache.get(ipfs_hash, lambda h: _load_maze(h, maze_folder))
+
+
+def _load_maze(ipfs_hash: str, maze_folder: str) -> Maze:
+    maze_json = retrieve_maze_json_from_ipfs(ipfs_hash)
+    patch = json.loads(maze_json)
+    base_maze_ipfs_hash = patch.get("base_maze_ipfs_hash")
+    if not base_maze_ipfs_hash:
+        maze = Maze.from_json(maze_json, maze_folder)
+        maze.set_base(ipfs_hash)
+        return maze
+
+    maze = retrieve_maze_from_ipfs(base_maze_ipfs_hash, maze_folder)
+    maze.apply_event_patch(patch)
+    return maze
+
+
+def get_folder_from_ipfs(ipfs_hash: str, base_folder: str, read_only: bool = False):
     try:
-        with ipfshttpclient.connect(IPFS_GATEWAY_URL) as client:
-            client.get(ipfs_hash, base_folder)
+        get_storage().get(ipfs_hash, base_folder, read_only=read_only)
     except Exception as e:
         print(f"Error getting persona folder: {str(e)}")
         raise
@@ -149,9 +175,7 @@ def get_folder_from_ipfs(ipfs_hash: str, base_folder: str):
 
 def retrieve_json_from_ipfs(ipfs_hash: str):
     try:
-        with ipfshttpclient.connect(IPFS_GATEWAY_URL) as client:
-            res = client.get_json(ipfs_hash)
-            return res
+        return get_storage().get_json(ipfs_hash)
     except Exception as e:
         print(f"Error getting persona folder: {str(e)}")
         raise
@@ -162,13 +186,11 @@ def upload_json_file_to_ipfs(file_path: str):
         with open(file_path, "r") as file:
             json_data = json.load(file)
 
-        with ipfshttpclient.connect(IPFS_GATEWAY_URL) as client:
-            res = client.add_json(json_data)
-            return res
+        return get_storage().add_json(json_data)
     except Exception as e:
         print(f"Error getting persona folder: {str(e)}")
         raise
 
 
 if not os.path.exists(MAZE_FOLDER):
-    get_folder_from_ipfs(BASE_MAZE_IPFS_HASH, f"{BASE_OUTPUT_DIR}/maze")
+    get_folder_from_ipfs(BASE_MAZE_IPFS_HASH, f"{BASE_OUTPUT_DIR}/maze", read_only=True)
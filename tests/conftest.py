@@ -0,0 +1,112 @@
+"""
+Test setup. The modules read their configuration from the environment when
+they are imported, so it is set here first: everything is written under a
+temporary BASE_OUTPUT_DIR, storage goes through the local backend, and the
+on-disk LLM caches are off. The base maze napthaville_module.utils expects is
+a small synthetic map written from MAZE_ROWS.
+"""
+
+import os
+import json
+import tempfile
+
+import pytest
+
+BASE_OUTPUT_DIR = tempfile.mkdtemp(prefix="napthaville-tests-")
+os.environ["BASE_OUTPUT_DIR"] = BASE_OUTPUT_DIR
+os.environ["STORAGE_BACKEND"] = "local"
+os.environ["LLM_CACHE_PATH"] = ""
+os.environ["EMBEDDING_CACHE_PATH"] = ""
+os.environ["LLM_RATE_LIMIT_PATH"] = ""
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+COLLISION_BLOCK_ID = "32125"
+# "#" is a wall, "b" a bed, "d" a desk and "s" a spawning location. The left
+# half of the map is the kitchen, the right half the bedroom.
+MAZE_ROWS = [
+    "############",
+    "#..d...#..b#",
+    "#......#...#",
+    "#..#.......#",
+    "#..#...#.s.#",
+    "#......#..b#",
+    "############",
+]
+
+
+def write_matrix(folder, rows):
+    """
+    Writes a maze "matrix" folder for the map drawn in <rows>, in the form of
+    the Tiled exports Maze reads.
+    """
+    height, width = len(rows), len(rows[0])
+    os.makedirs(f"{folder}/maze", exist_ok=True)
+    os.makedirs(f"{folder}/special_blocks", exist_ok=True)
+    meta_info = {
+        "world_name": "the Ville",
+        "maze_width": width,
+        "maze_height": height,
+        "sq_tile_size": 32,
+        "special_constraint": "",
+    }
+    with open(f"{folder}/maze_meta_info.json", "w") as outfile:
+        json.dump(meta_info, outfile)
+
+    blocks = {
+        "world_blocks.csv": ["32134, the Ville"],
+        "sector_blocks.csv": ["1000, the Ville, house"],
+        "arena_blocks.csv": [
+            "2000, the Ville, house, kitchen",
+            "2001, the Ville, house, bedroom",
+        ],
+        "game_object_blocks.csv": [
+            "3000, the Ville, <all>, bed",
+            "3001, the Ville, <all>, desk",
+        ],
+        "spawning_location_blocks.csv": [
+            "4000, the Ville, house, bedroom, sp-a",
+        ],
+    }
+    for name, lines in blocks.items():
+        with open(f"{folder}/special_blocks/{name}", "w") as outfile:
+            outfile.write("\n".join(lines) + "\n")
+
+    layers = {name: [] for name in ["collision", "sector", "arena", "game_object"]}
+    layers["spawning_location"] = []
+    for row in rows:
+        for x, cell in enumerate(row):
+            wall = cell == "#"
+            layers["collision"].append(COLLISION_BLOCK_ID if wall else "0")
+            layers["sector"].append("0" if wall else "1000")
+            layers["arena"].append(
+                "0" if wall else ("2000" if x < width // 2 else "2001")
+            )
+            layers["game_object"].append({"b": "3000", "d": "3001"}.get(cell, "0"))
+            layers["spawning_location"].append("4000" if cell == "s" else "0")
+    for name, values in layers.items():
+        with open(f"{folder}/maze/{name}_maze.csv", "w") as outfile:
+            outfile.write(", ".join(values) + "\n")
+    return folder
+
+
+# napthaville_module.utils fetches the base maze when it is not there yet.
+MAZE_FOLDER = write_matrix(
+    f"{BASE_OUTPUT_DIR}/maze/QmWrCkdJHVb5MfQuL1yXh6Wt2Dxp7ajJPDH7cRRdEuBvAK/matrix",
+    MAZE_ROWS,
+)
+
+
+@pytest.fixture
+def maze_folder():
+    """The matrix folder of the base maze."""
+    return MAZE_FOLDER
+
+
+@pytest.fixture
+def matrix_folder(tmp_path):
+    """Writes a matrix folder for the rows given, under tmp_path."""
+
+    def make(rows):
+        return write_matrix(str(tmp_path / "matrix"), rows)
+
+    return make
@@ -0,0 +1,55 @@
+import numpy as np
+
+from napthaville.persona.memory_structures.ann_index import IVFIndex
+from napthaville.persona.memory_structures.embedding_store import EmbeddingStore
+
+
+def random_store(n, dim=16, seed=0):
+    rng = np.random.default_rng(seed)
+    return EmbeddingStore({f"memory {i}": rng.normal(size=dim) for i in range(n)})
+
+
+def test_probing_every_cluster_is_exact():
+    store = random_store(2000)
+    index = IVFIndex(n_probe=10**6, exact_threshold=0)
+    index.train(store)
+    assert index.covers(store)
+
+    queries = np.random.default_rng(1).normal(size=(3, 16))
+    exact = store.cosine(queries)
+    for q, (rows, sims) in enumerate(index.search(store, queries)):
+        assert rows.tolist() == list(range(store.size))
+        assert np.allclose(sims, exact[q], atol=1e-5)
+
+
+def test_search_scores_the_probed_rows_only():
+    store = random_store(2000)
+    index = IVFIndex(n_probe=2, exact_threshold=0)
+    index.train(store)
+
+    queries = np.random.default_rng(1).normal(size=(3, 16))
+    exact = store.cosine(queries)
+    for q, (rows, sims) in enumerate(index.search(store, queries)):
+        assert 0 < len(rows) < store.size
+        assert np.all(np.diff(rows) > 0)
+        assert np.allclose(sims, exact[q][rows], atol=1e-5)
+
+
+def test_added_rows_are_searched():
+    store = random_store(2000)
+    index = IVFIndex(n_probe=1, exact_threshold=0)
+    index.train(store)
+    vector = np.random.default_rng(2).normal(size=16)
+    rows = store.set_many(["new memory"], [vector])
+    index.add(store, rows)
+
+    ((found, sims),) = index.search(store, [vector])
+    assert rows[0] in found.tolist()
+    assert np.isclose(sims[found.tolist().index(rows[0])], 1, atol=1e-5)
+
+
+def test_small_stores_are_not_covered():
+    store = random_store(100)
+    index = IVFIndex(exact_threshold=1000)
+    index.train(store)
+    assert not index.covers(store)
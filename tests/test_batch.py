@@ -0,0 +1,121 @@
+import threading
+
+import pytest
+
+from napthaville_module import run as run_module
+from napthaville_module.schemas import InputSchema, decode_result
+
+
+class FakeTasks:
+    """
+    Stands in for run_task on the "step" task, logging when each one starts
+    and ends. A task with "wait_for" waits until that task has started.
+    """
+
+    def __init__(self, run_task):
+        self.run_task = run_task
+        self.log = []
+        self.started = {}
+        self.lock = threading.Lock()
+
+    def event(self, i):
+        with self.lock:
+            return self.started.setdefault(i, threading.Event())
+
+    def __call__(self, task, task_params):
+        if task != "step":
+            return self.run_task(task, task_params)
+        i = task_params["i"]
+        with self.lock:
+            self.log.append(("start", i))
+        self.event(i).set()
+        if "wait_for" in task_params:
+            assert self.event(task_params["wait_for"]).wait(timeout=5)
+        with self.lock:
+            self.log.append(("end", i))
+        if task_params.get("fail"):
+            raise KeyError(f"task {i} failed")
+        return {"i": i}
+
+
+@pytest.fixture
+def tasks(monkeypatch):
+    fake = FakeTasks(run_module.run_task)
+    monkeypatch.setattr(run_module, "run_task", fake)
+    return fake
+
+
+def step(i, sims_folder, **params):
+    return {
+        "task": "step",
+        "task_params": {"i": i, "sims_folder": sims_folder, **params},
+    }
+
+
+def test_tasks_on_a_folder_run_in_order(tasks):
+    # 0 only finishes once 1, on another folder, has started, so the two
+    # run at the same time; 2 shares a folder with 0 and waits for it.
+    results = run_module.run_batch(
+        {"tasks": [step(0, "a", wait_for=1), step(1, "b"), step(2, "a")]}
+    )["results"]
+    assert results == [{"result": {"i": i}} for i in range(3)]
+    assert tasks.log.index(("end", 0)) < tasks.log.index(("start", 2))
+    assert tasks.log.index(("start", 1)) < tasks.log.index(("end", 0))
+
+
+def test_a_failed_task_does_not_stop_the_others(tasks):
+    results = run_module.run_batch(
+        {"tasks": [step(0, "a", fail=True), step(1, "a"), step(2, "b")]}
+    )["results"]
+    assert results[0] == {"error": "KeyError: 'task 0 failed'"}
+    assert results[1:] == [{"result": {"i": 1}}, {"result": {"i": 2}}]
+    assert tasks.log.index(("end", 0)) < tasks.log.index(("start", 1))
+
+
+def test_flush_waits_for_every_earlier_task(tasks):
+    results = run_module.run_batch(
+        {
+            "tasks": [
+                step(0, "a"),
+                step(1, "b"),
+                {"task": "flush_personas", "task_params": {}},
+                step(2, "c", wait_for=0),
+            ]
+        }
+    )["results"]
+    assert results[2] == {"result": {"flushed": 0}}
+    assert tasks.log.index(("end", 1)) < tasks.log.index(("start", 2))
+
+
+def test_unknown_and_nested_tasks_are_errors(tasks):
+    results = run_module.run_batch(
+        {
+            "tasks": [
+                {"task": "nope", "task_params": {}},
+                {"task": "batch", "task_params": {"tasks": []}},
+                step(0, "a"),
+            ]
+        }
+    )["results"]
+    assert results[0] == {"error": "Task nope not found"}
+    assert results[1]["error"].startswith("ValueError")
+    assert results[2] == {"result": {"i": 0}}
+
+
+def test_batch_through_run(tasks):
+    response = run_module.run(
+        InputSchema(task="batch", task_params={"tasks": [step(0, "a")]})
+    )
+    assert decode_result(response) == {"results": [{"result": {"i": 0}}]}
+
+
+def test_worker_stats_in_one_task():
+    stats = run_module.run_task("get_worker_stats", {})
+    assert list(stats) == [
+        "persona_cache",
+        "maze_cache",
+        "embedding_cache",
+        "llm_cache",
+        "rate_limiter",
+    ]
+    assert stats["persona_cache"] == run_module.run_task("get_persona_cache_stats", {})
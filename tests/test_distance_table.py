@@ -0,0 +1,62 @@
+import pytest
+
+from napthaville import distance_table
+from napthaville.distance_table import DistanceTable, get_distance_table
+from napthaville.path_finder import path_finder_bfs
+
+COLLISION_BLOCK_ID = "32125"
+ROWS = [
+    "#########",
+    "#...#...#",
+    "#.#.#.#.#",
+    "#.#...#.#",
+    "#########",
+]
+
+
+class MazeStub:
+    def __init__(self, maze_folder):
+        self.maze_folder = maze_folder
+
+
+def collision_maze(rows):
+    return [
+        [COLLISION_BLOCK_ID if cell == "#" else "0" for cell in row] for row in rows
+    ]
+
+
+def test_table_paths_match_bfs(matrix_folder):
+    table = DistanceTable.build(matrix_folder(ROWS), COLLISION_BLOCK_ID)
+    maze = collision_maze(ROWS)
+    tiles = [
+        (x, y)
+        for y, row in enumerate(ROWS)
+        for x, cell in enumerate(row)
+        if cell != "#"
+    ]
+    for start in tiles:
+        for end in tiles:
+            path = table.path(start, end)
+            assert len(path) == len(
+                path_finder_bfs(maze, start, end, COLLISION_BLOCK_ID)
+            )
+            assert table.distance(start, end) == len(path) - 1
+
+
+def test_build_refuses_tables_over_max_tiles(matrix_folder):
+    with pytest.raises(ValueError, match="max_tiles"):
+        DistanceTable.build(matrix_folder(ROWS), COLLISION_BLOCK_ID, max_tiles=4)
+
+
+def test_a_table_built_after_a_miss_is_picked_up(matrix_folder, monkeypatch):
+    monkeypatch.setattr(distance_table, "_distance_tables", dict())
+    monkeypatch.setattr(distance_table, "_missing_tables", dict())
+    folder = matrix_folder(ROWS)
+    maze = MazeStub(folder)
+    assert get_distance_table(maze, COLLISION_BLOCK_ID) is None
+    assert get_distance_table(maze, COLLISION_BLOCK_ID) is None
+
+    DistanceTable.build(folder, COLLISION_BLOCK_ID)
+    table = get_distance_table(maze, COLLISION_BLOCK_ID)
+    assert table is not None
+    assert get_distance_table(maze, COLLISION_BLOCK_ID) is table
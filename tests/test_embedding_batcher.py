@@ -0,0 +1,49 @@
+import asyncio
+import threading
+
+from napthaville.persona.prompt_template.embedding_batcher import EmbeddingBatcher
+
+
+class FakeRequests:
+    """Embeds a text as [len(text)], and logs the texts of every request."""
+
+    def __init__(self):
+        self.sent = []
+
+    def __call__(self, texts, model):
+        self.sent.append(list(texts))
+        return [[len(text)] for text in texts]
+
+    async def async_request(self, texts, model):
+        return self(texts, model)
+
+
+def test_embed_async_batches_and_splits():
+    requests = FakeRequests()
+    batcher = EmbeddingBatcher(
+        requests, max_batch=2, tick=0.01, async_request=requests.async_request
+    )
+
+    async def main():
+        return await asyncio.gather(
+            batcher.embed_async(["a", "bb", "ccc"], "model"),
+            batcher.embed_async(["bb", "dddd"], "model"),
+        )
+
+    assert asyncio.run(main()) == [[[1], [2], [3]], [[2], [4]]]
+    assert requests.sent == [["a", "bb"], ["ccc", "dddd"]]
+
+
+def test_threads_and_coroutines_share_a_batch():
+    requests = FakeRequests()
+    batcher = EmbeddingBatcher(requests, tick=0.2, async_request=requests.async_request)
+    results = {}
+    thread = threading.Thread(
+        target=lambda: results.update(sync=batcher.embed(["a", "bb"], "model"))
+    )
+    thread.start()
+    results["async"] = asyncio.run(batcher.embed_async(["bb", "ccc"], "model"))
+    thread.join()
+
+    assert results == {"sync": [[1], [2]], "async": [[2], [3]]}
+    assert requests.sent == [["a", "bb", "ccc"]]
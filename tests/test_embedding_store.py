@@ -0,0 +1,88 @@
+import os
+import json
+
+import numpy as np
+import pytest
+
+from napthaville.persona.memory_structures.embedding_store import (
+    EMBEDDINGS_FILE,
+    EMBEDDINGS_INDEX_FILE,
+    EmbeddingStore,
+    migrate,
+)
+
+
+def vectors(n, dim=8, seed=0):
+    rng = np.random.default_rng(seed)
+    return {f"memory {i}": rng.normal(size=dim).tolist() for i in range(n)}
+
+
+@pytest.fixture
+def store_folder(tmp_path):
+    EmbeddingStore(vectors(5)).save(str(tmp_path))
+    return str(tmp_path)
+
+
+def matrix_bytes(folder):
+    with open(f"{folder}/{EMBEDDINGS_FILE}", "rb") as infile:
+        return infile.read()
+
+
+def test_round_trip(store_folder):
+    store = EmbeddingStore.open(store_folder)
+    assert list(store) == list(vectors(5))
+    for key, vector in vectors(5).items():
+        assert np.allclose(store[key], vector, atol=1e-6)
+
+
+def test_changes_reach_the_file_only_on_save(store_folder):
+    before = matrix_bytes(store_folder)
+    store = EmbeddingStore.open(store_folder)
+    store["memory 0"] = [1.0] * 8
+    store["new memory"] = [2.0] * 8
+    assert matrix_bytes(store_folder) == before
+
+    store.save(store_folder)
+    saved = EmbeddingStore.open(store_folder)
+    assert np.allclose(saved["memory 0"], [1.0] * 8)
+    assert np.allclose(saved["new memory"], [2.0] * 8)
+    assert len(saved) == 6
+
+
+def test_saves_append_new_rows(store_folder):
+    store = EmbeddingStore.open(store_folder)
+    for i, (key, vector) in enumerate(vectors(3, seed=1).items()):
+        store[f"new {key}"] = vector
+        store.save(store_folder)
+        assert os.path.getsize(f"{store_folder}/{EMBEDDINGS_FILE}") == (6 + i) * 8 * 4
+
+    saved = EmbeddingStore.open(store_folder)
+    assert len(saved) == 8
+    assert np.allclose(saved["memory 4"], vectors(5)["memory 4"], atol=1e-6)
+
+
+def test_migrate_keeps_the_original(tmp_path):
+    embeddings = vectors(4)
+    with open(tmp_path / "embeddings.json", "w") as outfile:
+        json.dump(embeddings, outfile)
+
+    assert migrate(str(tmp_path)) == [str(tmp_path)]
+    assert not (tmp_path / "embeddings.json").exists()
+    with open(tmp_path / "embeddings.json.bak") as infile:
+        assert json.load(infile) == embeddings
+    store = EmbeddingStore.load(str(tmp_path))
+    assert np.allclose(store["memory 3"], embeddings["memory 3"], atol=1e-6)
+
+
+def test_migrate_keeps_loading_json_when_the_store_differs(tmp_path, monkeypatch):
+    with open(tmp_path / "embeddings.json", "w") as outfile:
+        json.dump(vectors(4), outfile)
+    monkeypatch.setattr(
+        "napthaville.persona.memory_structures.embedding_store.matches",
+        lambda store, embeddings: False,
+    )
+
+    assert migrate(str(tmp_path)) == []
+    assert (tmp_path / "embeddings.json").exists()
+    assert not (tmp_path / EMBEDDINGS_INDEX_FILE).exists()
+    assert len(EmbeddingStore.load(str(tmp_path))) == 4
@@ -0,0 +1,143 @@
+import asyncio
+import json
+from datetime import datetime
+
+import pytest
+
+import local_simulation
+from local_simulation import SimulationManager
+
+
+class FakeModule:
+    """
+    Answers the module tasks of a step. <chats> maps a persona to the one it
+    chats with; every other persona finishes its step in persona_step.
+    """
+
+    def __init__(self, chats):
+        self.chats = chats
+        self.calls = []
+
+    def executed(self, persona):
+        return [persona, sum(call == ("persona_step", persona) for call in self.calls)]
+
+    async def __call__(self, inputs):
+        params = inputs.task_params
+        persona = (
+            params.get("init_persona_name")
+            or params.get("persona_name")
+            or params.get("target_persona_name")
+        )
+        self.calls.append((inputs.task, persona))
+        await asyncio.sleep(0)
+        return json.dumps(self.answer(inputs.task, persona, params))
+
+    def answer(self, task, persona, params):
+        chat = self.chats.get(persona)
+        if ("finalise_target_persona_chat", persona) in self.calls:
+            chat = None
+        reaction_mode = f"chat with {chat}" if chat else None
+        if task == "persona_step":
+            if chat:
+                return {
+                    "reaction_mode": reaction_mode,
+                    "focused_event": None,
+                    "execution": None,
+                    "maze_delta": {"added": [], "removed": []},
+                    "retrieved": {},
+                    "new_day": False,
+                    "curr_time": params["curr_time"],
+                }
+            return {
+                "reaction_mode": reaction_mode,
+                "focused_event": None,
+                "execution": self.executed(persona),
+                "maze_delta": {"added": [[0, 0, [persona]]], "removed": []},
+            }
+        if task == "get_reaction_mode":
+            return {"reaction_mode": reaction_mode, "focused_event": None}
+        if task == "get_personal_info":
+            return {"name": persona, "act_description": "idle"}
+        if task == "get_utterence":
+            return {"curr_chat": params["curr_chat"] + [[persona, "hi"]]}
+        if task == "get_scratch":
+            return {}
+        if task == "get_complete_plan_chat":
+            return {"init_persona_act_address": "cafe", "target_persona_return": {}}
+        if task == "finalise_target_persona_chat":
+            return {}
+        if task == "get_complete_plan_no_reaction":
+            return "cafe"
+        if task == "get_reflect_execute":
+            return {"execution": [persona, "chat"], "maze_ipfs_hash": f"h_{persona}"}
+        if task == "merge_maze_states":
+            return {"maze_ipfs_hash": json.dumps(params["maze_changes"])}
+        raise KeyError(task)
+
+
+def simulation(personas, chats, monkeypatch):
+    module = FakeModule(chats)
+    monkeypatch.setattr(local_simulation, "module_run_async", module)
+    sim = SimulationManager.__new__(SimulationManager)
+    sim.all_personas = personas
+    sim.sims_folders = {persona: f"sims_{persona}" for persona in personas}
+    sim.persona_tiles = {persona: (0, 0) for persona in personas}
+    sim.curr_time = datetime(2023, 2, 13, 9, 30)
+    sim.maze_ipfs_hash = "base"
+    sim.chat = False
+    sim.chat_personas = []
+    return sim, module
+
+
+def test_step_units_group_chats_in_persona_order(monkeypatch):
+    sim, _ = simulation(["A", "B", "C", "D"], {}, monkeypatch)
+    reactions = {
+        "A": {"reaction_mode": None},
+        "B": {"reaction_mode": "chat with D"},
+        "C": {"reaction_mode": "wait 5"},
+        "D": {"reaction_mode": "chat with A"},
+    }
+    assert sim.get_step_units(reactions) == [["A", "B", "D"], ["C"]]
+
+
+def test_maze_changes_are_merged_in_persona_order(monkeypatch):
+    sim, _ = simulation(["C", "A", "B"], {}, monkeypatch)
+    moves = asyncio.run(sim.get_all_person_moves_v2({}))
+    assert moves == {"C": ["C", 1], "A": ["A", 1], "B": ["B", 1]}
+    changes = json.loads(sim.maze_ipfs_hash)
+    assert [change["maze_delta"]["added"][0][2] for change in changes] == [
+        ["C"],
+        ["A"],
+        ["B"],
+    ]
+
+
+@pytest.mark.parametrize(
+    "personas, target_steps",
+    [
+        # The persona chatted with comes after the one that chats, so it
+        # steps again once the chat is in its plans.
+        (["A", "B", "C"], 2),
+        # It comes first, so it keeps the step it had, as it would have
+        # moved before the chat one persona at a time.
+        (["B", "A", "C"], 1),
+    ],
+)
+def test_a_persona_chatted_with_later_steps_after_the_chat(
+    personas, target_steps, monkeypatch
+):
+    sim, module = simulation(personas, {"A": "B"}, monkeypatch)
+    moves = asyncio.run(sim.get_all_person_moves_v2({}))
+
+    assert moves["A"] == ["A", "chat"]
+    assert moves["B"] == ["B", target_steps]
+    assert moves["C"] == ["C", 1]
+    steps = [i for i, call in enumerate(module.calls) if call == ("persona_step", "B")]
+    assert len(steps) == target_steps
+    if target_steps == 2:
+        assert module.calls.index(("finalise_target_persona_chat", "B")) < steps[1]
+    assert sim.chat and sim.chat_personas[0] == "A"
+
+    changes = dict(zip(personas, json.loads(sim.maze_ipfs_hash)))
+    assert changes["A"] == {"maze_ipfs_hash": "h_A"}
+    assert changes["B"]["maze_delta"]["added"] == [[0, 0, ["B"]]]
@@ -0,0 +1,86 @@
+import json
+
+import pytest
+
+from napthaville.maze import Maze
+
+BED = (10, 1)
+FLOOR = (5, 2)
+SLEEPING = ("Isabella Rodriguez", "is", "sleeping", "sleeping")
+WALKING = ("Isabella Rodriguez", "is", "walking", "walking")
+
+
+def live_events(maze):
+    return {tile: set(events) for tile, events in maze.events.items() if events}
+
+
+def change(maze):
+    bed = next(iter(maze.events[BED]))
+    maze.remove_event_from_tile(bed, BED)
+    maze.add_event_from_tile(SLEEPING, BED)
+    maze.add_event_from_tile(WALKING, FLOOR)
+
+
+def test_the_map_has_its_default_events(maze_folder):
+    maze = Maze("the_ville", maze_folder)
+    assert maze.events[BED] == {("the Ville:house:bedroom:bed", None, None, None)}
+    assert maze.access_tile(BED)["arena"] == "bedroom"
+
+
+def test_event_patch_round_trip(maze_folder):
+    maze = Maze("the_ville", maze_folder)
+    maze.set_base("base")
+    base = maze.copy()
+    change(maze)
+
+    patch = json.loads(maze.to_patch_json())
+    assert patch["base_maze_ipfs_hash"] == "base"
+    assert [FLOOR[0], FLOOR[1], list(WALKING)] in patch["added"]
+    assert len(patch["removed"]) == 1
+
+    base.apply_event_patch(patch)
+    assert live_events(base) == live_events(maze)
+
+
+def test_patch_against_the_default_events_loads_on_its_own(maze_folder):
+    maze = Maze("the_ville", maze_folder)
+    change(maze)
+    loaded = Maze.from_json(maze.to_patch_json(), maze_folder)
+    assert live_events(loaded) == live_events(maze)
+
+
+def test_patch_against_a_stored_state_needs_that_state(maze_folder):
+    maze = Maze("the_ville", maze_folder)
+    maze.set_base("base")
+    change(maze)
+    with pytest.raises(ValueError, match="base"):
+        Maze.from_json(maze.to_patch_json(), maze_folder)
+
+
+def test_full_dump_still_loads(maze_folder):
+    maze = Maze("the_ville", maze_folder)
+    change(maze)
+    loaded = Maze.from_json(maze.to_json(), maze_folder)
+    assert live_events(loaded) == live_events(maze)
+
+
+def test_copies_do_not_share_changes(maze_folder):
+    maze = Maze("the_ville", maze_folder)
+    other = maze.copy()
+    change(other)
+    assert SLEEPING not in maze.events[BED]
+    assert FLOOR not in maze.events
+    assert maze.diff_events(other.events)["added"]
+
+
+def test_reading_tiles_does_not_add_events(maze_folder):
+    maze = Maze("the_ville", maze_folder)
+    tiles = len(maze.events)
+    for row in maze.tiles:
+        for tile in row:
+            tile["events"]
+    assert maze.tiles[FLOOR[1]][FLOOR[0]]["events"] == frozenset()
+    assert maze.access_tile(FLOOR)["events"] == frozenset()
+    assert len(maze.events) == tiles
+    with pytest.raises(AttributeError):
+        maze.tiles[BED[1]][BED[0]]["events"].add(SLEEPING)
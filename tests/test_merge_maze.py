@@ -0,0 +1,65 @@
+from napthaville.maze import Maze
+from napthaville_module.others.merge_maze import merge_maze_states
+from napthaville_module.utils import retrieve_maze_from_ipfs, upload_maze_to_ipfs
+
+TILE = (5, 2)
+COOKING = ("Isabella Rodriguez", "is", "cooking", "cooking")
+READING = ("Klaus Mueller", "is", "reading", "reading")
+
+
+def added(*events):
+    return {"maze_delta": {"added": [[*TILE, list(e)] for e in events], "removed": []}}
+
+
+def removed(*events):
+    return {"maze_delta": {"added": [], "removed": [[*TILE, list(e)] for e in events]}}
+
+
+def merged_events(maze_ipfs_hash, maze_changes):
+    merged_hash = merge_maze_states(
+        {"maze_ipfs_hash": maze_ipfs_hash, "maze_changes": maze_changes}
+    )["maze_ipfs_hash"]
+    return retrieve_maze_from_ipfs(merged_hash).events.get(TILE, set())
+
+
+def test_changes_are_merged(maze_folder):
+    base_hash = upload_maze_to_ipfs(Maze("the_ville", maze_folder))
+    persona = retrieve_maze_from_ipfs(base_hash)
+    persona.add_event_from_tile(READING, TILE)
+    persona_hash = upload_maze_to_ipfs(persona)
+
+    events = merged_events(
+        base_hash, [added(COOKING), {"maze_ipfs_hash": persona_hash}]
+    )
+    assert events == {COOKING, READING}
+
+
+def test_later_changes_win(maze_folder):
+    base_hash = upload_maze_to_ipfs(Maze("the_ville", maze_folder))
+    assert merged_events(base_hash, [added(COOKING), removed(COOKING)]) == set()
+    assert merged_events(base_hash, [removed(COOKING), added(COOKING)]) == {COOKING}
+
+
+def test_no_changes_keep_the_base_state(maze_folder):
+    base_hash = upload_maze_to_ipfs(Maze("the_ville", maze_folder))
+    response = merge_maze_states(
+        {
+            "maze_ipfs_hash": base_hash,
+            "maze_changes": [{"maze_ipfs_hash": base_hash}, added()],
+        }
+    )
+    assert response == {"maze_ipfs_hash": base_hash}
+
+
+def test_maze_ipfs_hashes_are_still_accepted(maze_folder):
+    base_hash = upload_maze_to_ipfs(Maze("the_ville", maze_folder))
+    hashes = []
+    for event in (COOKING, READING):
+        maze = retrieve_maze_from_ipfs(base_hash)
+        maze.add_event_from_tile(event, TILE)
+        hashes.append(upload_maze_to_ipfs(maze))
+
+    merged_hash = merge_maze_states(
+        {"maze_ipfs_hash": base_hash, "maze_ipfs_hashes": hashes}
+    )["maze_ipfs_hash"]
+    assert retrieve_maze_from_ipfs(merged_hash).events[TILE] == {COOKING, READING}
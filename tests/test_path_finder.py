@@ -0,0 +1,119 @@
+import random
+
+import pytest
+
+from napthaville.path_finder import (
+    path_finder,
+    path_finder_astar,
+    path_finder_bfs,
+    path_finder_nearest,
+    path_finder_v2,
+)
+
+COLLISION_BLOCK_ID = "32125"
+
+
+def random_maze(seed, width=24, height=16, walls=0.3):
+    rng = random.Random(seed)
+    return [
+        [COLLISION_BLOCK_ID if rng.random() < walls else "0" for _ in range(width)]
+        for _ in range(height)
+    ]
+
+
+def open_tiles(maze):
+    return [
+        (x, y)
+        for y, row in enumerate(maze)
+        for x, cell in enumerate(row)
+        if cell != COLLISION_BLOCK_ID
+    ]
+
+
+def assert_valid_path(maze, path, start, end):
+    assert path[0] == tuple(start) and path[-1] == tuple(end)
+    for (x0, y0), (x1, y1) in zip(path, path[1:]):
+        assert abs(x1 - x0) + abs(y1 - y0) == 1
+    for x, y in path:
+        assert maze[y][x] != COLLISION_BLOCK_ID
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_astar_and_bfs_find_paths_of_the_same_length(seed):
+    maze = random_maze(seed)
+    tiles = open_tiles(maze)
+    rng = random.Random(seed)
+    for _ in range(30):
+        start, end = rng.choice(tiles), rng.choice(tiles)
+        bfs = path_finder_bfs(maze, start, end, COLLISION_BLOCK_ID)
+        astar = path_finder_astar(maze, start, end, COLLISION_BLOCK_ID)
+        assert len(astar) == len(bfs)
+        if bfs:
+            assert_valid_path(maze, bfs, start, end)
+            assert_valid_path(maze, astar, start, end)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_astar_matches_the_wavefront_path_length(seed):
+    # path_finder_v2 works on (row, col) pairs and walls of 1.
+    maze = random_maze(seed, width=12, height=10)
+    grid = [[1 if cell == COLLISION_BLOCK_ID else 0 for cell in row] for row in maze]
+    tiles = open_tiles(maze)
+    rng = random.Random(seed)
+    for _ in range(10):
+        start, end = rng.choice(tiles), rng.choice(tiles)
+        astar = path_finder_astar(maze, start, end, COLLISION_BLOCK_ID)
+        if not astar:
+            continue
+        wavefront = path_finder_v2(grid, start[::-1], end[::-1], 1)
+        assert len(astar) == len(wavefront)
+
+
+def test_unreachable_and_blocked_targets_have_no_path():
+    maze = [
+        ["0", "0", COLLISION_BLOCK_ID, "0"],
+        ["0", "0", COLLISION_BLOCK_ID, "0"],
+    ]
+    for finder in (path_finder_bfs, path_finder_astar):
+        assert finder(maze, (0, 0), (3, 1), COLLISION_BLOCK_ID) == []
+        assert finder(maze, (0, 0), (2, 0), COLLISION_BLOCK_ID) == []
+        assert finder(maze, (0, 0), (9, 9), COLLISION_BLOCK_ID) == []
+        assert finder(maze, (1, 1), (1, 1), COLLISION_BLOCK_ID) == [(1, 1)]
+
+
+def test_path_finder_takes_an_int_collision_block():
+    maze = random_maze(0)
+    tiles = open_tiles(maze)
+    start, end = tiles[0], tiles[-1]
+    assert path_finder(maze, start, end, int(COLLISION_BLOCK_ID)) == path_finder(
+        maze, start, end, COLLISION_BLOCK_ID
+    )
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_nearest_finds_the_closest_reachable_target(seed):
+    maze = random_maze(seed)
+    tiles = open_tiles(maze)
+    rng = random.Random(seed)
+    for _ in range(20):
+        start = rng.choice(tiles)
+        ends = rng.sample(tiles, 5) + [(-1, 0)]
+        lengths = [
+            len(path_finder_bfs(maze, start, end, COLLISION_BLOCK_ID)) for end in ends
+        ]
+        reachable = [length for length in lengths if length]
+        closest, path = path_finder_nearest(maze, start, ends, COLLISION_BLOCK_ID)
+        if not reachable:
+            assert (closest, path) == (None, [])
+            continue
+        assert len(path) == min(reachable)
+        assert_valid_path(maze, path, start, closest)
+
+
+def test_nearest_returns_the_start_when_it_is_a_target():
+    maze = random_maze(0)
+    start = open_tiles(maze)[0]
+    assert path_finder_nearest(maze, start, [start], COLLISION_BLOCK_ID) == (
+        start,
+        [start],
+    )
@@ -0,0 +1,132 @@
+import os
+import json
+import logging
+
+import pytest
+
+from napthaville_module import persona_cache as persona_cache_module
+from napthaville_module.persona_cache import PersonaCache
+
+
+class FakePersona:
+    """Keeps the scratch.json of a persona folder as a dictionary."""
+
+    def __init__(self, name, folder):
+        self.name = name
+        self.state = read_state(folder)
+
+    def save(self, save_folder):
+        with open(f"{save_folder}/scratch.json", "w") as outfile:
+            json.dump(self.state, outfile)
+
+
+def read_state(folder):
+    with open(f"{folder}/bootstrap_memory/scratch.json") as infile:
+        return json.load(infile)
+
+
+def write_state(folder, state):
+    path = f"{folder}/bootstrap_memory/scratch.json"
+    with open(path, "w") as outfile:
+        json.dump(state, outfile)
+    # Makes the change visible to memory_version on coarse clocks.
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+@pytest.fixture
+def folder(tmp_path, monkeypatch):
+    monkeypatch.setattr(persona_cache_module, "Persona", FakePersona)
+    os.makedirs(tmp_path / "bootstrap_memory")
+    write_state(str(tmp_path), {"step": 0})
+    return str(tmp_path)
+
+
+def run_task(cache, folder, step):
+    with cache.task():
+        persona = cache.get("Isabella", folder)
+        persona.state["step"] = step
+        cache.save(persona, folder)
+
+
+def test_write_back_saves_on_flush(folder):
+    cache = PersonaCache(write_back=True)
+    run_task(cache, folder, 1)
+    run_task(cache, folder, 2)
+    assert read_state(folder) == {"step": 0}
+    assert cache.stats()["dirty"] == 1
+
+    assert cache.flush() == 1
+    assert read_state(folder) == {"step": 2}
+    assert cache.flush() == 0
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_write_through_saves_every_task(folder):
+    cache = PersonaCache(write_back=False)
+    run_task(cache, folder, 1)
+    assert read_state(folder) == {"step": 1}
+    assert cache.stats()["dirty"] == 0
+
+
+def test_failed_task_discards_the_persona(folder, caplog):
+    cache = PersonaCache(write_back=True)
+    run_task(cache, folder, 1)
+    with pytest.raises(KeyError), caplog.at_level(logging.WARNING):
+        with cache.task():
+            persona = cache.get("Isabella", folder)
+            persona.state["step"] = 99
+            raise KeyError("failed halfway")
+    assert "discarding" in caplog.text
+
+    # Nothing of the failed task, nor of the unflushed one before it, is
+    # saved; the persona is reloaded from its last save.
+    assert cache.flush() == 0
+    assert read_state(folder) == {"step": 0}
+    assert cache.get("Isabella", folder).state == {"step": 0}
+    assert cache.stats()["discarded"] == 1
+
+
+def test_failed_task_leaves_personas_it_did_not_get(folder, tmp_path_factory):
+    other = str(tmp_path_factory.mktemp("other"))
+    os.makedirs(f"{other}/bootstrap_memory")
+    write_state(other, {"step": 0})
+    cache = PersonaCache(write_back=True)
+    run_task(cache, other, 1)
+    with pytest.raises(KeyError):
+        with cache.task():
+            cache.get("Isabella", folder)
+            raise KeyError("failed")
+    assert cache.flush() == 1
+    assert read_state(other) == {"step": 1}
+
+
+def test_clean_persona_reloads_when_its_files_change(folder):
+    cache = PersonaCache(write_back=True)
+    assert cache.get("Isabella", folder).state == {"step": 0}
+    write_state(folder, {"step": 5})
+    assert cache.get("Isabella", folder).state == {"step": 5}
+    assert cache.stats()["reloads"] == 1
+
+
+def test_dirty_persona_warns_once_when_its_files_change(folder, caplog):
+    cache = PersonaCache(write_back=True)
+    run_task(cache, folder, 1)
+    write_state(folder, {"step": 5})
+    with caplog.at_level(logging.WARNING):
+        assert cache.get("Isabella", folder).state == {"step": 1}
+        cache.get("Isabella", folder)
+    assert caplog.text.count("changed on disk") == 1
+
+
+def test_eviction_saves_dirty_personas(folder, tmp_path_factory):
+    other = str(tmp_path_factory.mktemp("other"))
+    os.makedirs(f"{other}/bootstrap_memory")
+    write_state(other, {"step": 0})
+    cache = PersonaCache(max_size=1, write_back=True)
+    run_task(cache, folder, 1)
+    run_task(cache, other, 1)
+    assert read_state(folder) == {"step": 1}
+    assert read_state(other) == {"step": 0}
+    assert cache.evict() == 1
+    assert read_state(other) == {"step": 1}
@@ -0,0 +1,150 @@
+import os
+import json
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from napthaville.persona.persona import Persona
+
+CREATED = datetime(2023, 2, 13, 10)
+
+
+def add_event(persona, i):
+    description = f"Isabella Rodriguez is baking {i}"
+    persona.a_mem.add_event(
+        CREATED,
+        None,
+        "Isabella Rodriguez",
+        "is",
+        f"baking {i}",
+        description,
+        {"baking"},
+        3,
+        (description, np.random.default_rng(i).random(8).tolist()),
+        [],
+    )
+
+
+@pytest.fixture
+def persona_folder(tmp_path):
+    """A saved persona with three events in its associative memory."""
+    folder = tmp_path / "sims"
+    memory_folder = folder / "bootstrap_memory" / "associative_memory"
+    os.makedirs(memory_folder)
+    for name, content in [
+        ("nodes.json", {}),
+        ("embeddings.json", {}),
+        ("kw_strength.json", {"kw_strength_event": None, "kw_strength_thought": None}),
+    ]:
+        with open(memory_folder / name, "w") as outfile:
+            json.dump(content, outfile)
+
+    persona = Persona("Isabella Rodriguez", str(folder))
+    persona.scratch.name = "Isabella Rodriguez"
+    persona.s_mem.tree
+    for i in range(3):
+        add_event(persona, i)
+    persona.save(str(folder / "bootstrap_memory"))
+    return str(folder)
+
+
+def written_by(persona, save_folder):
+    """Saves <persona> and returns the files that were written."""
+    paths = [
+        os.path.join(root, name)
+        for root, _, names in os.walk(save_folder)
+        for name in names
+    ]
+    for path in paths:
+        os.utime(path, ns=(0, 0))
+    persona.save(save_folder)
+    return sorted(
+        os.path.relpath(os.path.join(root, name), save_folder)
+        for root, _, names in os.walk(save_folder)
+        for name in names
+        if os.stat(os.path.join(root, name)).st_mtime_ns != 0
+    )
+
+
+def test_memories_are_loaded_on_first_use(persona_folder):
+    persona = Persona("Isabella Rodriguez", persona_folder)
+    assert persona._scratch is None
+    assert persona._s_mem is None
+    assert persona._a_mem is None
+
+    assert len(persona.a_mem.id_to_node) == 3
+    assert persona._scratch is None
+    assert persona.a_mem._embeddings is None
+
+
+def test_saving_unchanged_memories_writes_nothing(persona_folder):
+    persona = Persona("Isabella Rodriguez", persona_folder)
+    persona.scratch.name
+    persona.s_mem.tree
+    len(persona.a_mem.id_to_node)
+    assert written_by(persona, f"{persona_folder}/bootstrap_memory") == []
+
+
+def test_only_changed_memories_are_saved(persona_folder):
+    save_folder = f"{persona_folder}/bootstrap_memory"
+    persona = Persona("Isabella Rodriguez", persona_folder)
+    persona.scratch.act_description = "baking bread"
+    assert written_by(persona, save_folder) == ["scratch.json"]
+
+    add_event(persona, 3)
+    written = written_by(persona, save_folder)
+    assert "scratch.json" not in written
+    assert "spatial_memory.json" not in written
+    assert "associative_memory/journal.jsonl" in written
+
+    reloaded = Persona("Isabella Rodriguez", persona_folder)
+    assert len(reloaded.a_mem.id_to_node) == 4
+    assert reloaded.a_mem.embeddings.size == 4
+    assert reloaded.scratch.act_description == "baking bread"
+
+
+def test_saving_elsewhere_writes_everything(persona_folder, tmp_path):
+    other = tmp_path / "other"
+    os.makedirs(other / "bootstrap_memory" / "associative_memory")
+    Persona("Isabella Rodriguez", persona_folder).save(str(other / "bootstrap_memory"))
+    assert sorted(os.listdir(other / "bootstrap_memory")) == [
+        "associative_memory",
+        "scratch.json",
+        "spatial_memory.json",
+    ]
+    copied = Persona("Isabella Rodriguez", str(other))
+    assert len(copied.a_mem.id_to_node) == 3
+    assert copied.a_mem.embeddings.size == 3
+
+
+@pytest.mark.parametrize("crash_after", ["nodes.json", "kw_strength.json"])
+def test_loading_after_a_compaction_cut_short(persona_folder, crash_after):
+    memory_folder = f"{persona_folder}/bootstrap_memory/associative_memory"
+    persona = Persona("Isabella Rodriguez", persona_folder)
+    persona.a_mem.compact()
+    for i in range(3, 5):
+        add_event(persona, i)
+    persona.save(f"{persona_folder}/bootstrap_memory")
+
+    # What the folder holds before the compaction: a 3-node snapshot and a
+    # journal with the other 2.
+    left = {}
+    for name in ["kw_strength.json", "journal.jsonl"]:
+        with open(f"{memory_folder}/{name}") as infile:
+            left[name] = infile.read()
+    persona.a_mem.compact()
+    if crash_after == "nodes.json":
+        restore = ["kw_strength.json", "journal.jsonl"]
+    else:
+        restore = ["journal.jsonl"]
+    for name in restore:
+        with open(f"{memory_folder}/{name}", "w") as outfile:
+            outfile.write(left[name])
+
+    reloaded = Persona("Isabella Rodriguez", persona_folder).a_mem
+    assert sorted(reloaded.id_to_node) == [f"node_{i}" for i in range(1, 6)]
+    assert reloaded.kw_strength_event == {"baking": 5}
+    assert [node.description for node in reloaded.seq_event] == [
+        f"Isabella Rodriguez is baking {i}" for i in range(4, -1, -1)
+    ]
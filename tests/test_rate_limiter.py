@@ -0,0 +1,31 @@
+import asyncio
+import sqlite3
+import threading
+
+from napthaville.persona.prompt_template.rate_limiter import RateLimiter
+
+
+def test_acquire_async_does_not_block_the_loop(tmp_path):
+    limiter = RateLimiter("chat", rpm=60, tpm=1000, path=str(tmp_path / "limits"))
+    limiter.acquire(1)
+
+    # Another process holds the bucket's lock for a while.
+    other = sqlite3.connect(limiter.path, isolation_level=None, check_same_thread=False)
+    other.execute("BEGIN IMMEDIATE")
+    threading.Timer(0.3, lambda: other.execute("COMMIT")).start()
+
+    async def main():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        ticker = asyncio.ensure_future(tick())
+        await limiter.acquire_async(1)
+        ticker.cancel()
+        return ticks
+
+    assert asyncio.run(main()) > 10
@@ -0,0 +1,101 @@
+import json
+from datetime import datetime
+
+import pytest
+from pydantic import ValidationError
+
+from napthaville_module import schemas
+from napthaville_module.schemas import (
+    InputSchema,
+    decode_result,
+    encode_result,
+    parse_task_params,
+)
+
+RESULT = {
+    "execution": ((58, 9), "😴", "sleeping @ the Ville:house:bedroom:bed"),
+    "curr_time": datetime(2023, 2, 13, 9, 30),
+    "maze_delta": {"added": [[58, 9, ["Isabella Rodriguez", "is", "sleeping"]]]},
+    "reaction_mode": None,
+    "scores": {1: 0.5},
+}
+
+
+def test_json_round_trip():
+    response = encode_result(RESULT)
+    assert isinstance(response, str)
+    # JSON has no tuples or datetimes.
+    assert decode_result(response) == {
+        "execution": [[58, 9], "😴", "sleeping @ the Ville:house:bedroom:bed"],
+        "curr_time": "2023-02-13T09:30:00",
+        "maze_delta": RESULT["maze_delta"],
+        "reaction_mode": None,
+        "scores": {"1": 0.5},
+    }
+
+
+def test_msgpack_round_trip():
+    pytest.importorskip("msgpack")
+    response = encode_result(RESULT, "msgpack")
+    assert isinstance(response, bytes)
+    assert decode_result(response) == RESULT
+
+
+def test_msgpack_input_round_trip():
+    pytest.importorskip("msgpack")
+    inputs = InputSchema(
+        task="persona_step",
+        task_params={"curr_tile": (58, 9), "personas": {"a": {"b": [1]}}},
+        wire_format="msgpack",
+    )
+    assert schemas.unpack_input(schemas.pack_input(inputs)) == inputs
+
+
+def test_other_wire_format_versions_are_rejected(monkeypatch):
+    pytest.importorskip("msgpack")
+    response = encode_result(RESULT, "msgpack")
+    packed_input = schemas.pack_input(InputSchema(task="batch", task_params={}))
+    monkeypatch.setattr(schemas, "WIRE_FORMAT_VERSION", schemas.WIRE_FORMAT_VERSION + 1)
+    with pytest.raises(ValueError, match="version"):
+        decode_result(response)
+    with pytest.raises(ValueError, match="version"):
+        schemas.unpack_input(packed_input)
+
+
+def test_msgpack_falls_back_to_json_without_msgpack(monkeypatch):
+    monkeypatch.setattr(schemas, "msgpack", None)
+    response = encode_result({"a": 1}, "msgpack")
+    assert response == json.dumps({"a": 1})
+    assert decode_result(response) == {"a": 1}
+
+
+def test_nested_params_are_accepted_as_json_strings():
+    params = {
+        "init_persona_name": "Isabella Rodriguez",
+        "sims_folder": "sims",
+        "target_persona_name": "Klaus Mueller",
+        "target_persona_description": "reading",
+        "extra": 1,
+    }
+    chat = [["Isabella Rodriguez", "hi"]]
+    assert parse_task_params(
+        "get_utterence", {**params, "curr_chat": json.dumps(chat)}
+    ) == {**params, "curr_chat": chat}
+    assert parse_task_params("get_utterence", {**params, "curr_chat": chat}) == {
+        **params,
+        "curr_chat": chat,
+    }
+    with pytest.raises(ValidationError):
+        parse_task_params("get_utterence", {"curr_chat": chat})
+
+
+def test_run_answers_in_the_wire_format_asked_for():
+    pytest.importorskip("msgpack")
+    from napthaville_module.run import run
+
+    inputs = InputSchema(task="nope", task_params={}, wire_format="msgpack")
+    for response in (run(inputs), run(schemas.pack_input(inputs))):
+        assert isinstance(response, bytes)
+        assert decode_result(response) == {"error": "Task nope not found"}
+    response = run(InputSchema(task="nope", task_params={}))
+    assert json.loads(response) == {"error": "Task nope not found"}